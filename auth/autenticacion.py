@@ -4,12 +4,16 @@ from typing import Union
 from pydantic import EmailStr
 from jose import jwt, JWTError
 from datetime import timedelta, datetime
-from passlib.context import CryptContext
+from bson import ObjectId
+import uuid
 
 from models.Token import Token, TokenData
 from models.Usuario import Usuario
 from config.db import conn
-from utils.serializers import serialize_mongo_doc
+from utils.serializers import serialize_mongo_doc_filtered
+from services.contrasenas import ejecutor_contrasenas
+from auth.cache_principales import cache_principales
+from auth.revocaciones import TOKENS_AUTOCONTENIDOS, revocaciones
 
 from decouple import config
 
@@ -17,23 +21,27 @@ from decouple import config
 auth = APIRouter(tags=["Autenticacion"])
 
 esquema_oauth = OAuth2PasswordBearer(tokenUrl="token")
-contexto_pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 CLAVE = config("CLAVE_SECRETA")
 ALGORITMO = "HS256"
 TIEMPO_EN_MINUTOS_EXPIRACION_TOKEN = 60
 
 
-def verificar_contra(contra, contra_hasheada):
-    return contexto_pwd.verify(contra, contra_hasheada)
-
-
 async def autenticar_usuario(correo: EmailStr, contra: str):
     usuario = await conn["usuarios"].find_one({"correo": correo})
     if usuario is None:
         return False
-    if not verificar_contra(contra, usuario["contra"]):
+
+    valida, nuevo_hash = await ejecutor_contrasenas.verificar(contra, usuario["contra"])
+    if not valida:
         return False
+
+    # El hash usa un coste distinto al configurado: se actualiza con la contraseña en claro
+    if nuevo_hash is not None:
+        await conn["usuarios"].update_one(
+            {"_id": usuario["_id"]}, {"$set": {"contra": nuevo_hash}}
+        )
+
     return usuario
 
 
@@ -53,13 +61,53 @@ async def obtener_usuario(correo: EmailStr):
     return await conn["usuarios"].find_one({"correo": correo})
 
 
+def claims_de_usuario(usuario: dict) -> dict:
+    """Datos del usuario que viajan dentro de un token autocontenido."""
+    return {
+        "correo": usuario["correo"],
+        "sub": str(usuario["_id"]),
+        "rol": usuario.get("rol"),
+        "inactivo": bool(usuario.get("inactivo")),
+        "ver": usuario.get("version_token", 0),
+        "jti": uuid.uuid4().hex,
+    }
+
+
+def principal_desde_claims(claims: dict) -> dict:
+    """Construye el usuario actual a partir de un token autocontenido."""
+    sub = claims["sub"]
+    return {
+        "_id": ObjectId(sub) if ObjectId.is_valid(sub) else sub,
+        "correo": claims["correo"],
+        "rol": claims["rol"],
+        "inactivo": claims["inactivo"],
+        "version_token": claims["ver"],
+        "jti": claims.get("jti"),
+    }
+
+
+def principal_revocado(usuario: dict) -> bool:
+    if "jti" not in usuario:
+        return False
+    return revocaciones.revocado(
+        usuario["jti"], str(usuario["_id"]), usuario["version_token"]
+    )
+
+
 async def obtener_usuario_actual(token: str = Depends(esquema_oauth)):
+    # Los tokens vistos recientemente se resuelven sin decodificar ni consultar la base de datos
     excepcion_de_credenciales = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Las credenciales pueden no ser correctas",
         headers={"WWW-Autenticate": "Bearer"},
     )
 
+    usuario = cache_principales.obtener(token)
+    if usuario is not None:
+        if principal_revocado(usuario):
+            raise excepcion_de_credenciales
+        return usuario
+
     try:
         ejecutador = jwt.decode(token, CLAVE, algorithms=[ALGORITMO])
         correo: EmailStr = ejecutador.get("correo")
@@ -69,11 +117,20 @@ async def obtener_usuario_actual(token: str = Depends(esquema_oauth)):
     except JWTError:
         raise excepcion_de_credenciales
 
+    if {"sub", "rol", "inactivo", "ver"} <= ejecutador.keys():
+        # Token autocontenido: basta con comprobar la lista de revocaciones en memoria
+        usuario = principal_desde_claims(ejecutador)
+        if principal_revocado(usuario):
+            raise excepcion_de_credenciales
+        cache_principales.guardar(token, usuario, ejecutador.get("exp"))
+        return usuario
+
     usuario = await obtener_usuario(correo=token_data.correo)
 
     if usuario is None:
         raise excepcion_de_credenciales
 
+    cache_principales.guardar(token, usuario, ejecutador.get("exp"))
     return usuario
 
 
@@ -95,13 +152,52 @@ async def generar_token(datos: OAuth2PasswordRequestForm = Depends()):
             headers={"WWW-Autenticate": "Bearer"},
         )
     expiracion_de_token = timedelta(minutes=TIEMPO_EN_MINUTOS_EXPIRACION_TOKEN)
+    datos_token = (
+        claims_de_usuario(usuario)
+        if TOKENS_AUTOCONTENIDOS
+        else {"correo": usuario["correo"]}
+    )
     access_token = crear_access_token(
-        datos={"correo": usuario["correo"]}, expires_delta=expiracion_de_token
+        datos=datos_token, expires_delta=expiracion_de_token
     )
     return {"access_token": access_token, "tipo_token": "bearer"}
 
 
+@auth.post("/token/revocar")
+async def revocar_token(
+    token: str = Depends(esquema_oauth),
+    usuario: Usuario = Depends(obtener_usuario_actual),
+):
+    """
+    Cierra la sesión invalidando el token actual. Solo aplica a los tokens autocontenidos.
+    """
+    if usuario.get("jti") is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El token no admite revocación individual",
+        )
+
+    expiracion = jwt.get_unverified_claims(token)["exp"]
+    await revocaciones.revocar_token(usuario["jti"], expiracion)
+    cache_principales.descartar(token)
+    return {"mensaje": "Token revocado"}
+
+
+@auth.get("/token/verificar")
+async def verificar_token(usuario: Usuario = Depends(obtener_usuario_activo_actual)):
+    """
+    Comprueba que el token es válido. Ruta mínima usada también en las pruebas de carga.
+    """
+    return {"usuario_id": str(usuario["_id"]), "rol": usuario["rol"]}
+
+
 @auth.get("/usuarios/perfil")
 async def obtener_perfil(usuario: Usuario = Depends(obtener_usuario_activo_actual)):
+    if "nombres" not in usuario:
+        # Los tokens autocontenidos no incluyen el perfil completo
+        usuario = await obtener_usuario(usuario["correo"])
+        if usuario is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
     # Usar la función de serialización para convertir ObjectId a string
-    return serialize_mongo_doc(usuario)
+    # sin exponer el hash de la contraseña
+    return serialize_mongo_doc_filtered(usuario, {"contra"})
@@ -0,0 +1,112 @@
+import copy
+import hashlib
+import time
+from typing import Callable, Dict, Optional, Set
+
+from cachetools import Cache, TTLCache
+from decouple import config
+
+TTL_CACHE_PRINCIPALES = config("TTL_CACHE_PRINCIPALES", default=30, cast=int)
+TAMANO_CACHE_PRINCIPALES = config("TAMANO_CACHE_PRINCIPALES", default=10000, cast=int)
+
+
+class _CacheConAvisos(TTLCache):
+    """
+    TTLCache que avisa de cada entrada que sale, también cuando caduca o se
+    descarta por falta de espacio, para mantener al día los índices de fuera.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, al_salir: Callable[[bytes, tuple], None]):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._al_salir = al_salir
+
+    def __delitem__(self, clave):
+        entrada = Cache.__getitem__(self, clave)
+        try:
+            super().__delitem__(clave)
+        finally:
+            self._al_salir(clave, entrada)
+
+    def expire(self, time=None):
+        caducadas = super().expire(time)
+        for clave, entrada in caducadas:
+            self._al_salir(clave, entrada)
+        return caducadas
+
+
+class CachePrincipales:
+    """
+    Caché acotada y de vida corta que relaciona un token con su usuario, para
+    no decodificar el JWT ni consultar MongoDB en cada petición autenticada.
+    Las claves son el SHA-256 del token, nunca el token en claro.
+
+    Se mantienen índices del id y del correo de cada usuario a las claves de
+    sus tokens, para invalidarlos sin recorrer toda la caché.
+    """
+
+    def __init__(self, tamano: int, ttl: int):
+        self._cache = _CacheConAvisos(tamano, ttl, self._desindexar)
+        self._por_id: Dict[str, Set[bytes]] = {}
+        self._por_correo: Dict[str, Set[bytes]] = {}
+
+    @staticmethod
+    def _clave(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _indices(self, usuario: dict):
+        for indice, valor in ((self._por_id, usuario.get("_id")), (self._por_correo, usuario.get("correo"))):
+            if valor is not None:
+                yield indice, str(valor)
+
+    def _desindexar(self, clave: bytes, entrada: tuple) -> None:
+        usuario, _ = entrada
+        for indice, valor in self._indices(usuario):
+            claves = indice.get(valor)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del indice[valor]
+
+    def obtener(self, token: str) -> Optional[dict]:
+        clave = self._clave(token)
+        entrada = self._cache.get(clave)
+        if entrada is None:
+            return None
+
+        usuario, expiracion = entrada
+        if expiracion is not None and expiracion <= time.time():
+            # El token caducó antes que la entrada de la caché
+            self._cache.pop(clave, None)
+            return None
+        # Cada petición recibe su propia copia: si una ruta modifica el usuario
+        # (por ejemplo al quitarle la contraseña) no afecta a las siguientes
+        return copy.deepcopy(usuario)
+
+    def guardar(self, token: str, usuario: dict, expiracion: Optional[float]) -> None:
+        clave = self._clave(token)
+        # Si el token ya estaba, se saca antes del índice de su usuario anterior
+        self._cache.pop(clave, None)
+        self._cache[clave] = (copy.deepcopy(usuario), expiracion)
+        for indice, valor in self._indices(usuario):
+            indice.setdefault(valor, set()).add(clave)
+
+    def descartar(self, token: str) -> None:
+        self._cache.pop(self._clave(token), None)
+
+    def invalidar_usuario(self, usuario_id=None, correo: Optional[str] = None) -> None:
+        """Elimina las entradas de un usuario tras modificarlo o eliminarlo."""
+        claves = set()
+        if usuario_id is not None:
+            claves.update(self._por_id.get(str(usuario_id), ()))
+        if correo is not None:
+            claves.update(self._por_correo.get(str(correo), ()))
+        for clave in claves:
+            self._cache.pop(clave, None)
+
+    def limpiar(self) -> None:
+        self._cache.clear()
+        self._por_id.clear()
+        self._por_correo.clear()
+
+
+cache_principales = CachePrincipales(TAMANO_CACHE_PRINCIPALES, TTL_CACHE_PRINCIPALES)
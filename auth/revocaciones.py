@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from decouple import config
+
+from config.db import conn
+
+logger = logging.getLogger("revocaciones")
+
+INTERVALO_REVOCACIONES = config("INTERVALO_REVOCACIONES", default=5, cast=int)
+# Incluir en el token el id, rol, estado y versión del usuario para no consultar
+# MongoDB. Solo entonces se consultan las revocaciones
+TOKENS_AUTOCONTENIDOS = config("TOKENS_AUTOCONTENIDOS", default=False, cast=bool)
+# Versión asignada a los usuarios eliminados: invalida cualquier token emitido
+VERSION_USUARIO_ELIMINADO = 2**31 - 1
+
+
+class RegistroRevocaciones:
+    """
+    Copia en memoria de la colección `revocaciones`, para comprobar los tokens
+    autocontenidos sin consultar MongoDB. Guarda dos cosas:
+
+    - los `jti` de tokens revocados uno a uno (cierre de sesión) hasta que caducan
+    - la versión mínima de token válida de cada usuario; al cambiar el rol, el
+      estado o la contraseña de un usuario se invalidan sus tokens anteriores
+
+    Cada worker la sincroniza de forma incremental cada pocos segundos.
+    """
+
+    def __init__(self, intervalo: int):
+        self.intervalo = intervalo
+        self._jtis: Dict[str, float] = {}
+        self._versiones: Dict[str, int] = {}
+        self._ultima_lectura: Optional[datetime] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def revocado(self, jti: Optional[str], usuario_id: str, version: int) -> bool:
+        if jti is not None and jti in self._jtis:
+            return True
+        return version < self._versiones.get(usuario_id, 0)
+
+    def _aplicar(self, revocacion: dict) -> None:
+        if revocacion.get("tipo") == "token":
+            self._jtis[revocacion["jti"]] = revocacion["expira"].replace(
+                tzinfo=timezone.utc
+            ).timestamp()
+        elif revocacion.get("tipo") == "usuario":
+            usuario_id = revocacion["usuario_id"]
+            self._versiones[usuario_id] = max(
+                self._versiones.get(usuario_id, 0), revocacion["version"]
+            )
+
+    async def revocar_token(self, jti: str, expira: float) -> None:
+        revocacion = {
+            "tipo": "token",
+            "jti": jti,
+            "expira": datetime.fromtimestamp(expira, timezone.utc),
+            "fecha": datetime.now(timezone.utc),
+        }
+        await conn["revocaciones"].insert_one(revocacion)
+        self._aplicar(revocacion)
+
+    async def revocar_usuario(self, usuario_id, version: int) -> None:
+        """Invalida los tokens del usuario con una versión menor que `version`."""
+        revocacion = {
+            "tipo": "usuario",
+            "usuario_id": str(usuario_id),
+            "version": version,
+            "fecha": datetime.now(timezone.utc),
+        }
+        await conn["revocaciones"].update_one(
+            {"tipo": "usuario", "usuario_id": str(usuario_id)},
+            {"$set": revocacion},
+            upsert=True,
+        )
+        self._aplicar(revocacion)
+
+    async def sincronizar(self) -> None:
+        filtro = {}
+        if self._ultima_lectura is not None:
+            # Margen para tolerar pequeñas diferencias de reloj entre workers
+            margen = timedelta(seconds=self.intervalo * 2)
+            filtro["fecha"] = {"$gte": self._ultima_lectura - margen}
+
+        lectura = datetime.now(timezone.utc)
+        async for revocacion in conn["revocaciones"].find(filtro):
+            self._aplicar(revocacion)
+        self._ultima_lectura = lectura
+
+        # Los jti de tokens ya caducados no hace falta recordarlos
+        ahora = time.time()
+        for jti in [j for j, expira in self._jtis.items() if expira <= ahora]:
+            del self._jtis[jti]
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.sincronizar()
+            except Exception as e:
+                logger.error(f"Error sincronizando revocaciones: {str(e)}")
+
+    async def iniciar(self) -> None:
+        if not TOKENS_AUTOCONTENIDOS:
+            return
+        try:
+            await conn["revocaciones"].create_index("expira", expireAfterSeconds=0)
+            await conn["revocaciones"].create_index("fecha")
+            await self.sincronizar()
+        except Exception as e:
+            logger.error(f"Error cargando revocaciones: {str(e)}")
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+
+revocaciones = RegistroRevocaciones(INTERVALO_REVOCACIONES)
@@ -7,4 +7,5 @@ def usuario_admin_requerido(usuario: Usuario = Depends(obtener_usuario_activo_ac
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="acceso denegado"
-        )
\ No newline at end of file
+        )
+    return usuario
\ No newline at end of file
@@ -0,0 +1,208 @@
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from config.db import conn
+from utils.busqueda import nombre_busqueda
+from services.analitica_ventas import AGREGADOS
+from services.contador_vistas import VISTAS_DIARIAS, VISTAS_DOCUMENTOS
+from services.notificaciones import CONTADORES_NOTIFICACIONES
+from services.recordatorios import fecha_utc
+from services.difusiones import DIFUSIONES
+from models.Notificacion import EstadoNotificacion
+
+logger = logging.getLogger("indices")
+
+TAMANO_LOTE_INDICES = 500
+# Migraciones de datos que ya se han completado, por nombre
+MIGRACIONES = "migraciones"
+
+
+async def _completar_nombre_busqueda() -> None:
+    # Usuarios creados antes de existir el campo o insertados por los scripts
+    operaciones = []
+    cursor = conn["usuarios"].find(
+        {"nombre_busqueda": {"$exists": False}}, {"nombres": 1, "apellidos": 1}
+    )
+    async for usuario in cursor:
+        operaciones.append(
+            UpdateOne(
+                {"_id": usuario["_id"]},
+                {"$set": {"nombre_busqueda": nombre_busqueda(
+                    usuario.get("nombres"), usuario.get("apellidos")
+                )}},
+            )
+        )
+        if len(operaciones) >= TAMANO_LOTE_INDICES:
+            await conn["usuarios"].bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        await conn["usuarios"].bulk_write(operaciones, ordered=False)
+
+
+async def _convertir_fechas(coleccion: str, campos: tuple) -> None:
+    # Antes las fechas se guardaban como texto ISO y no se pueden comparar con
+    # fechas. Se escribían con datetime.now().isoformat(), en hora local y sin
+    # zona, así que se convierten con fecha_utc y no con $dateFromString, que
+    # las tomaría como UTC
+    operaciones = []
+    cursor = conn[coleccion].find(
+        {"$or": [{campo: {"$type": "string"}} for campo in campos]},
+        {campo: 1 for campo in campos},
+    )
+    async for documento in cursor:
+        texto = {campo: documento[campo] for campo in campos if isinstance(documento.get(campo), str)}
+        cambios = {}
+        for campo, valor in texto.items():
+            try:
+                cambios[campo] = fecha_utc(datetime.fromisoformat(valor))
+            except ValueError:
+                logger.warning(f"Fecha no válida en {coleccion}.{campo} de {documento['_id']}: {valor}")
+        if cambios:
+            # Solo si el campo sigue siendo el mismo texto: no pisa lo que otro
+            # worker haya escrito mientras tanto
+            operaciones.append(UpdateOne(
+                {"_id": documento["_id"], **{campo: texto[campo] for campo in cambios}},
+                {"$set": cambios},
+            ))
+        if len(operaciones) >= TAMANO_LOTE_INDICES:
+            await conn[coleccion].bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        await conn[coleccion].bulk_write(operaciones, ordered=False)
+
+
+async def _crear_contadores_notificaciones() -> None:
+    # Migración única: cuenta las no leídas que ya existían. Con $setOnInsert no
+    # pisa los contadores que otros workers ya estén incrementando; esos se
+    # reconcilian al consultarlos. Se marca como hecha solo si termina entera
+    if await conn[MIGRACIONES].find_one({"_id": CONTADORES_NOTIFICACIONES}) is not None:
+        return
+    operaciones = []
+    cursor = conn["notificaciones"].aggregate([
+        {"$match": {"estado": EstadoNotificacion.NO_LEIDA.value}},
+        {"$group": {"_id": "$usuario_id", "no_leidas": {"$sum": 1}}},
+    ])
+    async for grupo in cursor:
+        operaciones.append(
+            UpdateOne(
+                {"_id": grupo["_id"]},
+                {"$setOnInsert": {"no_leidas": grupo["no_leidas"], "contado": True}},
+                upsert=True,
+            )
+        )
+        if len(operaciones) >= TAMANO_LOTE_INDICES:
+            await conn[CONTADORES_NOTIFICACIONES].bulk_write(operaciones, ordered=False)
+            operaciones = []
+    if operaciones:
+        await conn[CONTADORES_NOTIFICACIONES].bulk_write(operaciones, ordered=False)
+    await conn[MIGRACIONES].update_one(
+        {"_id": CONTADORES_NOTIFICACIONES},
+        {"$set": {"fecha": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def crear_indices() -> None:
+    """Crea los índices que necesitan las consultas de la API. Es idempotente."""
+    usuarios = conn["usuarios"]
+    try:
+        await usuarios.create_index("correo", unique=True)
+    except Exception as e:
+        # Falla si ya hay correos duplicados guardados: hay que depurarlos a mano
+        logger.error(f"Error creando el índice único de correo: {str(e)}")
+
+    try:
+        # Listado paginado por (nombre_busqueda, _id) dentro de cada filtro
+        await usuarios.create_index([("nombre_busqueda", ASCENDING), ("_id", ASCENDING)])
+        await usuarios.create_index(
+            [("rol", ASCENDING), ("inactivo", ASCENDING), ("nombre_busqueda", ASCENDING), ("_id", ASCENDING)]
+        )
+        await usuarios.create_index(
+            [("ciudad", ASCENDING), ("nombre_busqueda", ASCENDING), ("_id", ASCENDING)]
+        )
+        # Los anteriores sin el _id quedan cubiertos por estos
+        existentes = await usuarios.index_information()
+        for anterior in ("rol_1_inactivo_1_nombre_busqueda_1", "ciudad_1_nombre_busqueda_1"):
+            if anterior in existentes:
+                await usuarios.drop_index(anterior)
+        # Recorrido por _id de los segmentos de las difusiones
+        await usuarios.create_index([("pais", ASCENDING), ("ciudad", ASCENDING), ("_id", ASCENDING)])
+        await _completar_nombre_busqueda()
+    except Exception as e:
+        logger.error(f"Error creando índices de usuarios: {str(e)}")
+
+    try:
+        await conn["ventas"].create_index("fecha")
+        # Consultas paginadas por _id descendente dentro de cada filtro
+        for campo in ("id_cliente", "id_documento", "tipo_de_adquisicion"):
+            await conn["ventas"].create_index([(campo, ASCENDING), ("_id", DESCENDING)])
+        # Compradores distintos de un documento
+        await conn["ventas"].create_index([("id_documento", ASCENDING), ("id_cliente", ASCENDING)])
+        await conn["documentos"].create_index("titulo")
+        for coleccion in AGREGADOS:
+            await conn[coleccion].create_index([("unidades", DESCENDING)])
+            await conn[coleccion].create_index([("ventas", DESCENDING)])
+    except Exception as e:
+        logger.error(f"Error creando índices de ventas: {str(e)}")
+
+    try:
+        await conn["reservas"].create_index([("estado", ASCENDING), ("expira", ASCENDING)])
+    except Exception as e:
+        logger.error(f"Error creando índices de reservas: {str(e)}")
+
+    try:
+        await conn[VISTAS_DIARIAS].create_index(
+            [("documento_id", ASCENDING), ("dia", ASCENDING)], unique=True
+        )
+        await conn[VISTAS_DIARIAS].create_index([("dia", ASCENDING), ("vistas", DESCENDING)])
+        await conn[VISTAS_DOCUMENTOS].create_index([("total", DESCENDING)])
+    except Exception as e:
+        logger.error(f"Error creando índices de vistas: {str(e)}")
+
+    try:
+        sincronizaciones = conn["sincronizaciones"]
+        await sincronizaciones.create_index(
+            [("usuario_id", ASCENDING), ("documento_id", ASCENDING), ("proveedor", ASCENDING)]
+        )
+        # Reclamo de sincronizaciones vencidas por orden de antigüedad
+        await sincronizaciones.create_index(
+            [("estado", ASCENDING), ("proxima_sincronizacion", ASCENDING)]
+        )
+        await _convertir_fechas("sincronizaciones", ("proxima_sincronizacion", "ultima_sincronizacion"))
+    except Exception as e:
+        logger.error(f"Error creando índices de sincronizaciones: {str(e)}")
+
+    try:
+        notificaciones = conn["notificaciones"]
+        # Listado por fecha y reenvío por (fecha, _id) al reconectar el flujo
+        await notificaciones.create_index([("usuario_id", ASCENDING), ("fecha_creacion", DESCENDING)])
+        await notificaciones.create_index(
+            [("usuario_id", ASCENDING), ("fecha_creacion", ASCENDING), ("_id", ASCENDING)]
+        )
+        if "usuario_id_1__id_1" in await notificaciones.index_information():
+            await notificaciones.drop_index("usuario_id_1__id_1")
+        # Cambios de estado en bloque y recuento de no leídas
+        await notificaciones.create_index([("usuario_id", ASCENDING), ("estado", ASCENDING)])
+        await _crear_contadores_notificaciones()
+        # Reanudación de las difusiones por el último usuario notificado
+        await notificaciones.create_index(
+            [("difusion_id", ASCENDING), ("usuario_id", ASCENDING)],
+            partialFilterExpression={"difusion_id": {"$exists": True}},
+        )
+        await conn[DIFUSIONES].create_index([("estado", ASCENDING), ("fecha_creacion", ASCENDING)])
+    except Exception as e:
+        logger.error(f"Error creando índices de notificaciones: {str(e)}")
+
+    try:
+        recordatorios = conn["recordatorios"]
+        # Carga de los recordatorios que vencen en la siguiente ventana
+        await recordatorios.create_index([("activo", ASCENDING), ("proxima_ejecucion", ASCENDING)])
+        await recordatorios.create_index([("usuario_id", ASCENDING), ("proxima_ejecucion", ASCENDING)])
+        await _convertir_fechas(
+            "recordatorios",
+            ("fecha_programada", "proxima_ejecucion", "ultima_ejecucion", "fecha_creacion"),
+        )
+    except Exception as e:
+        logger.error(f"Error creando índices de recordatorios: {str(e)}")
@@ -11,7 +11,22 @@ from routes.ia import ia
 from routes.integraciones import integracion
 from routes.notificaciones import notificaciones
 from config.db import conn
+from config.indices import crear_indices
+from services.analitica_ventas import asegurar_agregados
+from services.inventario import liberador_reservas
+from services.estadisticas import estadisticas_dashboard
+from services.contador_vistas import contador_vistas
+from services.exportadores import cache_artefactos
+from services.sincronizacion_nube import planificador_sincronizacion
+from services.notificaciones import centro_notificaciones
+from services.recordatorios import motor_recordatorios
+from services.difusiones import motor_difusiones
 from models.Usuario import Role
+from utils.busqueda import nombre_busqueda
+from services.variantes_imagen import generador_variantes
+from services.contrasenas import ejecutor_contrasenas
+from auth.revocaciones import revocaciones
+from services.limitador_tasa import limitador_tasa, LimitadorTasaMiddleware
 
 from auth.autenticacion import auth
 
@@ -21,14 +36,37 @@ from decouple import config
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup code (runs before the app starts)
+    await crear_indices()
+    await asegurar_agregados()
+
     if os.environ.get("INIT_ADMIN", "False").lower() == "true":
         await init_admin()
 
+    await revocaciones.iniciar()
+    await limitador_tasa.iniciar()
+    await liberador_reservas.iniciar()
+    await contador_vistas.iniciar()
+    await planificador_sincronizacion.iniciar()
+    await centro_notificaciones.iniciar()
+    await motor_recordatorios.iniciar()
+    await motor_difusiones.iniciar()
+
     yield  # This is where the app runs
 
     # Shutdown code (runs when the app is shutting down)
-    # Add any cleanup code here if needed
-    pass
+    await planificador_sincronizacion.detener()
+    await motor_recordatorios.detener()
+    await motor_difusiones.detener()
+    await centro_notificaciones.detener()
+    await liberador_reservas.detener()
+    await estadisticas_dashboard.detener()
+    # Último volcado de las vistas acumuladas en memoria
+    await contador_vistas.detener()
+    await limitador_tasa.detener()
+    await revocaciones.detener()
+    await generador_variantes.detener()
+    ejecutor_contrasenas.detener()
+    cache_artefactos.detener()
 
 
 app = FastAPI(
@@ -47,6 +85,8 @@ app.include_router(integracion)
 app.include_router(notificaciones)
 app.include_router(auth)
 
+app.add_middleware(LimitadorTasaMiddleware, limitador=limitador_tasa)
+
 # PRODUCTION_URL = config("PRODUCTION_URL")
 DEVELOPT_URL = str(config("DEVELOPMENT_FRONT", default="http://localhost:5173"))
 app.add_middleware(
@@ -80,7 +120,8 @@ async def init_admin():
         "nombres": "Administrador",
         "apellidos": "Sistema",
         "correo": admin_email,
-        "contra": hashear_contra(admin_password),
+        "contra": await hashear_contra(admin_password),
+        "nombre_busqueda": nombre_busqueda("Administrador", "Sistema"),
         "pais": "Colombia",
         "ciudad": "Bogotá",
         "inactivo": False,
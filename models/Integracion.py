@@ -59,6 +59,20 @@ class SincronizacionNube(BaseModel):
     )
 
 
+class SincronizacionLote(BaseModel):
+    documento_ids: List[str] = Field(..., min_length=1, max_length=500)
+    proveedor: ProveedorNube
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "documento_ids": ["645701810b24c99f29187db0", "645701810b24c99f29187db1"],
+                "proveedor": "google_drive"
+            }
+        },
+    )
+
+
 class DocumentoExportacion(BaseModel):
     documento_id: str
     formato: str  # pdf, docx, txt, etc.
@@ -73,6 +87,28 @@ class DocumentoExportacion(BaseModel):
     )
 
 
+class ExportacionLote(BaseModel):
+    formato: str
+    # Si se indican ids se exportan esos documentos; si no, los que cumplan los
+    # filtros (solo administradores). Sin ids ni filtros la petición se rechaza
+    documento_ids: Optional[List[str]] = Field(None, min_length=1, max_length=500)
+    categoria: Optional[str] = None
+    autor: Optional[str] = None
+    idioma: Optional[str] = None
+    tipo_documento: Optional[str] = None
+    incluir_imagenes: bool = True
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "formato": "pdf",
+                "categoria": "programacion",
+                "incluir_imagenes": True
+            }
+        },
+    )
+
+
 class DatosEstadisticos(BaseModel):
     total_documentos: int
     documentos_por_categoria: Dict[str, int]
@@ -80,6 +116,8 @@ class DatosEstadisticos(BaseModel):
     documentos_mas_vistos: List[Dict[str, Any]]
     usuarios_mas_activos: List[Dict[str, Any]]
     documentos_recientes: List[Dict[str, Any]]
+    # Momento en que se calcularon los datos (se sirven desde una caché)
+    generado: Optional[str] = None
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional
 from enum import Enum
 from datetime import datetime
 
+from models.Usuario import Role
+
 
 class TipoNotificacion(str, Enum):
     INFO = "info"
@@ -36,6 +38,57 @@ class Notificacion(BaseModel):
     )
 
 
+class CambioEstadoNotificaciones(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=500)
+    estado: Literal[EstadoNotificacion.LEIDA, EstadoNotificacion.ARCHIVADA]
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "ids": ["645701810b24c99f29187db0", "645701810b24c99f29187db1"],
+                "estado": "archivada"
+            }
+        },
+    )
+
+
+class EstadoDifusion(str, Enum):
+    PENDIENTE = "pendiente"
+    EN_CURSO = "en_curso"
+    COMPLETADA = "completada"
+    FALLIDA = "fallida"
+
+
+class SegmentoUsuarios(BaseModel):
+    # Los criterios indicados se combinan; sin ninguno se notifica a todos los usuarios activos
+    rol: Optional[Role] = None
+    pais: Optional[str] = None
+    ciudad: Optional[str] = None
+    # Usuarios que han comprado este documento
+    documento_id: Optional[str] = None
+
+
+class DifusionNotificaciones(BaseModel):
+    tipo: TipoNotificacion = TipoNotificacion.INFO
+    titulo: str = Field(..., min_length=1)
+    mensaje: str = Field(..., min_length=1)
+    documento_id: Optional[str] = None
+    accion_url: Optional[str] = None
+    segmento: SegmentoUsuarios = Field(default_factory=SegmentoUsuarios)
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "tipo": "info",
+                "titulo": "Nueva edición disponible",
+                "mensaje": "Ya puedes descargar la segunda edición del documento",
+                "documento_id": "645701810b24c99f29187db0",
+                "segmento": {"pais": "Colombia", "documento_id": "645701810b24c99f29187db0"}
+            }
+        },
+    )
+
+
 class ConfiguracionRecordatorio(BaseModel):
     documento_id: str
     titulo_recordatorio: str
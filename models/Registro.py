@@ -1,5 +1,6 @@
 from pydantic import ConfigDict, BaseModel, Field
-from typing import Optional
+from typing import List, Optional
+from datetime import datetime
 
 # from models.Id import PyObjectId
 
@@ -13,8 +14,10 @@ class Registro(BaseModel):
     titulo_documento: str = Field(...)
     imagen: str = Field(...)
     tipo_de_adquisicion: str = Field(...)
-    cantidad: int = Field(...)
+    cantidad: int = Field(..., gt=0)
     activo: bool = Field(...)
+    # La asigna el servidor al guardar la venta
+    fecha: Optional[datetime] = None
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -32,3 +35,47 @@ class Registro(BaseModel):
             }
         },
     )
+
+
+class ItemPedido(BaseModel):
+    id_documento: str = Field(...)
+    cantidad: int = Field(..., gt=0)
+
+
+class Pedido(BaseModel):
+    id_cliente: str = Field(...)
+    nombre_cliente: str = Field(...)
+    tipo_de_adquisicion: str = Field(...)
+    items: List[ItemPedido] = Field(..., min_length=1)
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "id_cliente": "63afc7da089fe226352a222",
+                "nombre_cliente": "Jhon Hernandez",
+                "tipo_de_adquisicion": "compra",
+                "items": [
+                    {"id_documento": "a9f63fc7d4a089fe22635224", "cantidad": 2},
+                    {"id_documento": "645701810b24c99f29187db0", "cantidad": 1},
+                ],
+            }
+        },
+    )
+
+
+class ReservaPrestamo(BaseModel):
+    id_cliente: str = Field(...)
+    nombre_cliente: str = Field(...)
+    id_documento: str = Field(...)
+    cantidad: int = Field(default=1, gt=0)
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "id_cliente": "63afc7da089fe226352a222",
+                "nombre_cliente": "Jhon Hernandez",
+                "id_documento": "a9f63fc7d4a089fe22635224",
+                "cantidad": 1,
+            }
+        },
+    )
@@ -1,3 +1,6 @@
+from datetime import datetime, timezone
+from typing import Literal
+
 from fastapi import (
     APIRouter,
     Depends,
@@ -7,11 +10,11 @@ from fastapi import (
     UploadFile,
     File,
     Form,
+    Query,
 )
 from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from bson import ObjectId
-import json
 
 from config.db import conn
 from auth.autenticacion import esquema_oauth
@@ -19,22 +22,55 @@ from auth.services import usuario_admin_requerido
 from models.Documento import ActualizarDocumento
 from routes.imagenes import guardar_imagen
 from utils.serializers import serialize_mongo_doc, serialize_mongo_docs
+from utils.proyeccion import CAMPOS_DOCUMENTO, CAMPOS_LISTA_DOCUMENTOS
+from services.exportacion_datos import COLUMNAS_DOCUMENTOS, respuesta_exportacion
+from services.contador_vistas import contador_vistas, documentos_con_vistas
+from services.exportadores import cache_artefactos
 
 documento = APIRouter(tags=["Documentos"])
 
 
 @documento.get("/", response_description="Documentos listados")
-async def obtener_documentos(token: str = Depends(esquema_oauth)):
-    documentos = await conn["documentos"].find().to_list(1000)
+async def obtener_documentos(
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_LISTA_DOCUMENTOS),
+):
+    documentos = await conn["documentos"].find({}, proyeccion).to_list(1000)
     return serialize_mongo_docs(documentos)
 
 
+# Las rutas fijas bajo /documentos/ deben declararse antes de /documentos/{documento_id}
+@documento.get("/documentos/populares", response_description="Documentos más vistos")
+async def obtener_documentos_populares(
+    limite: int = Query(10, ge=1, le=100),
+    token: str = Depends(esquema_oauth),
+):
+    return await documentos_con_vistas(limite)
+
+
+@documento.get(
+    "/documentos/exportar",
+    response_description="Documentos exportados",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def exportar_documentos(
+    formato: Literal["csv", "parquet", "arrow"] = "csv",
+    gzip: bool = False,
+):
+    cursor = conn["documentos"].find({})
+    nombre = f"documentos-{datetime.now(timezone.utc):%Y%m%d}"
+    return respuesta_exportacion(cursor, COLUMNAS_DOCUMENTOS, formato, gzip, nombre)
+
+
 @documento.get("/documentos/{documento_id}", response_description="Documento obtenido")
 async def obtener_documento_por_id(
-    documento_id: str, token: str = Depends(esquema_oauth)
+    documento_id: str,
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_DOCUMENTO),
 ):
-    documento = await conn["documentos"].find_one({"_id": documento_id})
+    documento = await conn["documentos"].find_one({"_id": documento_id}, proyeccion)
     if documento is not None:
+        contador_vistas.registrar(documento_id)
         return serialize_mongo_doc(documento)
 
     raise HTTPException(
@@ -43,8 +79,12 @@ async def obtener_documento_por_id(
 
 
 @documento.get("/documentos/titulo/{titulo}", response_description="Documento obtenido")
-async def obtener_documento_por_titulo(titulo: str = Depends(esquema_oauth)):
-    documento = await conn["documentos"].find_one({"titulo": titulo})
+async def obtener_documento_por_titulo(
+    titulo: str,
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_DOCUMENTO),
+):
+    documento = await conn["documentos"].find_one({"titulo": titulo}, proyeccion)
     if documento is not None:
         return serialize_mongo_doc(documento)
 
@@ -70,8 +110,7 @@ async def guardar_documento(
     imagen: UploadFile = File(...),
     token: str = Depends(esquema_oauth),
 ):
-    image_response = await guardar_imagen(imagenAGuardar=imagen)
-    image_data = json.loads(str(image_response))
+    image_data = await guardar_imagen(imagenAGuardar=imagen)
 
     documento_id = str(ObjectId())
     documento = {
@@ -124,11 +163,15 @@ async def actualizar_documento(
     }
 
     if len(documento_actualizado_dict) >= 1:
+        # La versión identifica las exportaciones guardadas del documento
         update_result = await conn["documentos"].update_one(
-            {"_id": documento_id}, {"$set": documento_actualizado_dict}
+            {"_id": documento_id},
+            {"$set": documento_actualizado_dict, "$inc": {"version": 1}},
         )
 
         if update_result.modified_count == 1:
+            # Las exportaciones de versiones anteriores ya no se van a servir
+            await cache_artefactos.descartar(documento_id)
             documento_actualizado = await conn["documentos"].find_one(
                 {"_id": documento_id}
             )
@@ -153,6 +196,7 @@ async def eliminar_documento_por_id(
     documento_borrado = await conn["documentos"].find_one({"_id": documento_id})
     if documento_borrado:
         await conn["documentos"].delete_one({"_id": documento_id})
+        await cache_artefactos.descartar(documento_id)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
     raise HTTPException(
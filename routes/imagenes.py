@@ -1,31 +1,201 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, status
-from fastapi.responses import JSONResponse, FileResponse
-from pathlib import Path
-import shutil
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from cachetools import LRUCache
+from datetime import datetime
+from decouple import config
+from typing import Optional
+import re
+import time
+
+from config.db import conn
+from services.almacenamiento_imagenes import almacenamiento, url_imagen
+from services.variantes_imagen import (
+    TIPOS_MIME,
+    ImagenIlegible,
+    ancho_normalizado,
+    elegir_formato,
+    generador_variantes,
+    nombre_variante,
+)
+from utils.cabeceras_http import (
+    RangoNoSatisfacible,
+    fecha_http,
+    no_modificado,
+    rango_solicitado,
+)
 
 imagenes = APIRouter(tags=["Imagenes"])
 
+# Caché en memoria de imágenes pequeñas y frecuentes (tamaño total en bytes)
+TAMANO_CACHE_IMAGENES = config("TAMANO_CACHE_IMAGENES", default=32 * 1024 * 1024, cast=int)
+TAMANO_MAXIMO_EN_CACHE = config("TAMANO_MAXIMO_EN_CACHE", default=256 * 1024, cast=int)
+cache_imagenes = LRUCache(maxsize=TAMANO_CACHE_IMAGENES, getsizeof=lambda e: len(e[0]))
 
-@imagenes.get("/images/{nombre_imagen}")
-async def obtener_imagen(nombre_imagen: str):
-    ruta_imagen = Path(f"images/{nombre_imagen}").absolute()
+# Nombres direccionados por contenido: <sha256>.<ext>[_w<ancho>.<ext>]
+PATRON_DIRECCIONADO = re.compile(r"^[0-9a-f]{64}\.[a-z]+(_w\d+\.[a-z]+)?$")
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "public, max-age=3600"
+
+
+def _cabeceras_cache(nombre: str, metadatos: dict) -> dict:
+    if PATRON_DIRECCIONADO.match(nombre):
+        # El contenido nunca cambia para un mismo nombre. La extensión forma
+        # parte del ETag: las variantes webp y avif comparten hash y ancho
+        etag = f'"{nombre}"'
+        cache_control = CACHE_INMUTABLE
+    else:
+        etag = f'"{int(metadatos["modificado"]):x}-{metadatos["tamano"]:x}"'
+        cache_control = CACHE_REVALIDAR
+
+    return {
+        "ETag": etag,
+        "Last-Modified": fecha_http(metadatos["modificado"]),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+
+def _responder(
+    request: Request,
+    nombre: str,
+    metadatos: dict,
+    datos: Optional[bytes],
+    cabeceras_extra: dict,
+) -> Response:
+    cabeceras = {**_cabeceras_cache(nombre, metadatos), **cabeceras_extra}
+    tipo_mime = metadatos["tipo_mime"]
+    tamano = metadatos["tamano"]
+
+    if no_modificado(request, cabeceras["ETag"], metadatos["modificado"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabeceras)
+
+    ruta_imagen = almacenamiento.ruta(nombre)
+    if datos is None and ruta_imagen is not None:
+        # FileResponse atiende por sí misma las cabeceras Range
+        return FileResponse(
+            ruta_imagen,
+            media_type=tipo_mime,
+            headers=cabeceras,
+            stat_result=metadatos.get("estado"),
+        )
+
+    try:
+        rango = rango_solicitado(request, tamano, cabeceras["ETag"], metadatos["modificado"])
+    except RangoNoSatisfacible:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{tamano}"},
+        )
+
+    inicio, fin = rango if rango is not None else (0, tamano)
+    codigo = status.HTTP_206_PARTIAL_CONTENT if rango is not None else status.HTTP_200_OK
+    if rango is not None:
+        cabeceras["Content-Range"] = f"bytes {inicio}-{fin - 1}/{tamano}"
+
+    if datos is not None:
+        return Response(
+            datos[inicio:fin], status_code=codigo, media_type=tipo_mime, headers=cabeceras
+        )
+
+    return StreamingResponse(
+        almacenamiento.flujo(nombre, inicio, fin),
+        status_code=codigo,
+        media_type=tipo_mime,
+        headers={**cabeceras, "Content-Length": str(fin - inicio)},
+    )
 
-    if ruta_imagen.exists():
-        return FileResponse(ruta_imagen)
 
-    raise HTTPException(
+async def _cargar(nombre: str):
+    """Obtiene los metadatos (y los bytes si es pequeña) pasando por la caché LRU."""
+    entrada = cache_imagenes.get(nombre)
+    if entrada is not None:
+        datos, metadatos = entrada
+        return metadatos, datos
+
+    metadatos = await almacenamiento.metadatos(nombre)
+    if metadatos is None:
+        return None, None
+
+    datos = None
+    if metadatos["tamano"] <= TAMANO_MAXIMO_EN_CACHE:
+        datos = await almacenamiento.leer(nombre)
+        if datos is not None:
+            cache_imagenes[nombre] = (datos, metadatos)
+
+    return metadatos, datos
+
+
+@imagenes.get("/images/{nombre_imagen}")
+async def obtener_imagen(
+    nombre_imagen: str,
+    request: Request,
+    w: Optional[int] = Query(
+        None, ge=1, le=4096, description="Ancho deseado en píxeles"
+    ),
+):
+    no_encontrada = HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail=f"Imagen con nombre {nombre_imagen} no encontrada",
     )
 
+    if w is not None and generador_variantes.disponible:
+        ancho = ancho_normalizado(w)
+        formato = elegir_formato(nombre_imagen, request.headers.get("accept"))
+        variante = nombre_variante(nombre_imagen, ancho, formato)
+        # El formato depende de la cabecera Accept, los cachés deben distinguirlo
+        cabeceras = {"Vary": "Accept"}
+
+        metadatos, datos = await _cargar(variante)
+        if metadatos is None:
+            # Variante aún no generada: se genera ahora y queda guardada
+            try:
+                datos = await generador_variantes.generar(nombre_imagen, ancho, formato)
+            except ImagenIlegible:
+                # Original dañado o en un formato que Pillow no conoce: se sirve tal cual
+                return await _responder_original(request, nombre_imagen, no_encontrada)
+            if datos is None:
+                raise no_encontrada
+            metadatos = {
+                "tamano": len(datos),
+                "tipo_mime": TIPOS_MIME[formato],
+                "modificado": time.time(),
+            }
+        return _responder(request, variante, metadatos, datos, cabeceras)
+
+    return await _responder_original(request, nombre_imagen, no_encontrada)
+
+
+async def _responder_original(request: Request, nombre: str, no_encontrada: HTTPException) -> Response:
+    metadatos, datos = await _cargar(nombre)
+    if metadatos is None:
+        raise no_encontrada
+    return _responder(request, nombre, metadatos, datos, {})
+
 
 async def guardar_imagen(imagenAGuardar: UploadFile = File(...)):
     try:
-        ruta_guardado = f"images/{imagenAGuardar.filename}"
-        ruta_completa = Path(ruta_guardado).absolute()
-        with open(ruta_completa, "wb") as archivo:
-            shutil.copyfileobj(imagenAGuardar.file, archivo)
-        url_imagen = f"http://localhost:8000/{ruta_guardado}"
-        return {"url_imagen": url_imagen}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        imagen = await almacenamiento.guardar(imagenAGuardar)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Registrar los metadatos; una imagen repetida solo suma otro nombre original
+    resultado = await conn["imagenes"].update_one(
+        {"_id": imagen["nombre"]},
+        {
+            "$setOnInsert": {
+                "sha256": imagen["sha256"],
+                "tamano": imagen["tamano"],
+                "tipo_mime": imagen["tipo_mime"],
+                "fecha_creacion": datetime.now().isoformat(),
+            },
+            "$addToSet": {"nombres_originales": imagenAGuardar.filename},
+        },
+        upsert=True,
+    )
+
+    # Las miniaturas de una imagen nueva se generan en segundo plano
+    if resultado.upserted_id is not None:
+        generador_variantes.programar(imagen["nombre"])
+
+    return {"url_imagen": url_imagen(imagen["nombre"]), **imagen}
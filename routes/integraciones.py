@@ -1,11 +1,8 @@
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Body
-from fastapi.responses import StreamingResponse
-import json
-from datetime import datetime, timedelta
-import random
-import io
-import time
+from fastapi.responses import FileResponse, StreamingResponse
+from datetime import datetime, timezone
+from pymongo import UpdateOne
 
 from config.db import conn
 from models.Integracion import (
@@ -13,10 +10,18 @@ from models.Integracion import (
     ConfiguracionIntegracion,
     EstadoSincronizacion,
     DocumentoExportacion,
+    ExportacionLote,
+    SincronizacionLote,
     DatosEstadisticos
 )
 from auth.autenticacion import esquema_oauth, obtener_usuario_actual
-from utils.serializers import serialize_mongo_doc, serialize_mongo_docs
+from auth.services import usuario_admin_requerido
+from utils.serializers import serialize_mongo_docs
+from utils.proyeccion import CAMPOS_GENERICOS
+from services.estadisticas import estadisticas_dashboard
+from services.exportadores import cache_artefactos, formato_valido, nombre_archivo
+from services.exportacion_lote import exportar_zip
+from services.sincronizacion_nube import planificador_sincronizacion
 
 integracion = APIRouter(prefix="/integracion", tags=["Integraciones"])
 
@@ -24,12 +29,11 @@ integracion = APIRouter(prefix="/integracion", tags=["Integraciones"])
 @integracion.post("/nube/configurar", response_description="Configuración de integración en la nube guardada")
 async def configurar_integracion_nube(
     configuracion: ConfiguracionIntegracion = Body(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Configura la integración con un servicio en la nube como Google Drive, Dropbox o OneDrive.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar si ya existe una configuración para este usuario y proveedor
@@ -60,19 +64,35 @@ async def configurar_integracion_nube(
         await conn["integraciones_nube"].insert_one(config_doc)
         mensaje = f"Configuración para {configuracion.proveedor} guardada exitosamente"
     
+    # Las sincronizaciones ya hechas entran o salen de la planificación automática
+    filtro = {"usuario_id": usuario_id, "proveedor": configuracion.proveedor}
+    if configuracion.sincronizacion_automatica:
+        await conn["sincronizaciones"].update_many(
+            {**filtro, "proxima_sincronizacion": None},
+            {"$set": {"proxima_sincronizacion": datetime.now(timezone.utc)}}
+        )
+        planificador_sincronizacion.despertar()
+    else:
+        await conn["sincronizaciones"].update_many(
+            {**filtro, "estado": EstadoSincronizacion.COMPLETADO},
+            {"$set": {"proxima_sincronizacion": None}}
+        )
+    
     return {"mensaje": mensaje, "proveedor": configuracion.proveedor}
 
 
 @integracion.get("/nube/configuraciones", response_description="Configuraciones de integraciones en la nube")
-async def listar_configuraciones_nube(token: str = Depends(esquema_oauth)):
+async def listar_configuraciones_nube(
+    usuario: dict = Depends(obtener_usuario_actual),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS)
+):
     """
     Obtiene las configuraciones de integraciones en la nube para el usuario actual.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     configuraciones = await conn["integraciones_nube"].find(
-        {"usuario_id": usuario_id}
+        {"usuario_id": usuario_id}, proyeccion
     ).to_list(10)
     
     # Por seguridad, no devolvemos el token de acceso completo
@@ -87,16 +107,15 @@ async def listar_configuraciones_nube(token: str = Depends(esquema_oauth)):
 async def sincronizar_documento(
     documento_id: str = Body(...),
     proveedor: ProveedorNube = Body(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Sincroniza un documento con un servicio en la nube.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar que el documento existe
-    documento = await conn["documentos"].find_one({"_id": documento_id})
+    documento = await conn["documentos"].find_one({"_id": documento_id}, {"titulo": 1})
     if not documento:
         raise HTTPException(status_code=404, detail=f"Documento con ID {documento_id} no encontrado")
     
@@ -112,59 +131,119 @@ async def sincronizar_documento(
             detail=f"No se ha configurado la integración con {proveedor}. Configure primero la integración."
         )
     
-    # En un sistema real, aquí se realizaría la sincronización con el API del proveedor
-    # Por ahora, simulamos el proceso
+    # El registro de sincronización es también el trabajo que procesa el planificador
+    filtro = {"usuario_id": usuario_id, "documento_id": documento_id, "proveedor": proveedor}
+    await conn["sincronizaciones"].update_one(
+        filtro,
+        {
+            "$set": {"documento_nombre": documento.get("titulo", "Documento sin título")},
+            "$setOnInsert": {"estado": EstadoSincronizacion.PENDIENTE, "intentos": 0},
+        },
+        upsert=True
+    )
     
-    # Simular tiempo de procesamiento
-    time.sleep(random.uniform(1.0, 2.5))
+    trabajo = await planificador_sincronizacion.reclamar(filtro)
+    if trabajo is None:
+        raise HTTPException(status_code=409, detail="El documento ya se está sincronizando")
     
-    # Simular ID y URL en la nube
-    id_en_nube = f"{proveedor}_{int(time.time())}_{random.randint(1000, 9999)}"
-    url_base = {
-        ProveedorNube.GOOGLE_DRIVE: "https://drive.google.com/file/d/",
-        ProveedorNube.DROPBOX: "https://www.dropbox.com/s/",
-        ProveedorNube.ONEDRIVE: "https://1drv.ms/",
-    }.get(proveedor, "https://cloud.example.com/")
+    sincronizacion = await planificador_sincronizacion.ejecutar(trabajo)
+    if sincronizacion["estado"] != EstadoSincronizacion.COMPLETADO:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Error sincronizando con {proveedor}: {sincronizacion.get('error')}"
+        )
     
-    url_en_nube = f"{url_base}{id_en_nube}/view"
+    return {
+        "mensaje": f"Documento sincronizado con {proveedor}",
+        "id_en_nube": sincronizacion["id_en_nube"],
+        "url_en_nube": sincronizacion["url_en_nube"],
+        "estado": EstadoSincronizacion.COMPLETADO
+    }
+
+
+@integracion.post(
+    "/nube/sincronizar/lote",
+    status_code=202,
+    response_description="Documentos puestos en cola para sincronizar"
+)
+async def sincronizar_documentos_lote(
+    lote: SincronizacionLote = Body(...),
+    usuario: dict = Depends(obtener_usuario_actual)
+):
+    """
+    Pone en cola la sincronización de varios documentos con un servicio en la
+    nube. El planificador los sube en segundo plano; el avance se consulta en
+    /nube/sincronizaciones.
+    """
+    usuario_id = usuario["_id"]
     
-    # Crear registro de sincronización
-    sincronizacion = {
+    config = await conn["integraciones_nube"].find_one({
         "usuario_id": usuario_id,
-        "proveedor": proveedor,
-        "documento_id": documento_id,
-        "documento_nombre": documento.get("titulo", "Documento sin título"),
-        "id_en_nube": id_en_nube,
-        "url_en_nube": url_en_nube,
-        "estado": EstadoSincronizacion.COMPLETADO,
-        "ultima_sincronizacion": datetime.now().isoformat(),
-        "proxima_sincronizacion": (datetime.now() + timedelta(hours=24)).isoformat() if config.get("sincronizacion_automatica") else None
-    }
+        "proveedor": lote.proveedor
+    })
+    if not config:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"No se ha configurado la integración con {lote.proveedor}. Configure primero la integración."
+        )
     
-    # Actualizar o insertar el registro de sincronización
-    await conn["sincronizaciones"].update_one(
-        {"usuario_id": usuario_id, "documento_id": documento_id, "proveedor": proveedor},
-        {"$set": sincronizacion},
-        upsert=True
-    )
+    ids = list(dict.fromkeys(lote.documento_ids))
+    documentos = await conn["documentos"].find(
+        {"_id": {"$in": ids}}, {"titulo": 1}
+    ).to_list(len(ids))
+    encontrados = {documento["_id"]: documento for documento in documentos}
+    
+    ahora = datetime.now(timezone.utc)
+    operaciones = [
+        UpdateOne(
+            {"usuario_id": usuario_id, "documento_id": documento_id, "proveedor": lote.proveedor},
+            {
+                # Volver a ponerla en cola le devuelve todos los reintentos
+                "$set": {
+                    "documento_nombre": documento.get("titulo", "Documento sin título"),
+                    "proxima_sincronizacion": ahora,
+                    "intentos": 0,
+                    "error": None,
+                },
+                "$setOnInsert": {"estado": EstadoSincronizacion.PENDIENTE},
+            },
+            upsert=True
+        )
+        for documento_id, documento in encontrados.items()
+    ]
+    if operaciones:
+        await conn["sincronizaciones"].bulk_write(operaciones, ordered=False)
+        planificador_sincronizacion.despertar()
     
     return {
-        "mensaje": f"Documento sincronizado con {proveedor}",
-        "id_en_nube": id_en_nube,
-        "url_en_nube": url_en_nube,
-        "estado": EstadoSincronizacion.COMPLETADO
+        "mensaje": f"{len(operaciones)} documentos en cola para sincronizar con {lote.proveedor}",
+        "en_cola": list(encontrados),
+        "no_encontrados": [documento_id for documento_id in ids if documento_id not in encontrados],
     }
 
 
+@integracion.get(
+    "/nube/planificador",
+    response_description="Estado de la cola de sincronizaciones",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def metricas_planificador():
+    """
+    Métricas del planificador de sincronizaciones: sincronizaciones vencidas,
+    retraso de la cola y resultados del trabajador que responde.
+    """
+    return await planificador_sincronizacion.metricas()
+
+
 @integracion.get("/nube/sincronizaciones", response_description="Historial de sincronizaciones")
 async def listar_sincronizaciones(
     proveedor: Optional[ProveedorNube] = None,
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS)
 ):
     """
     Obtiene el historial de sincronizaciones del usuario actual.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Filtro base
@@ -174,7 +253,7 @@ async def listar_sincronizaciones(
     if proveedor:
         filtro["proveedor"] = proveedor
     
-    sincronizaciones = await conn["sincronizaciones"].find(filtro).sort(
+    sincronizaciones = await conn["sincronizaciones"].find(filtro, proyeccion).sort(
         "ultima_sincronizacion", -1
     ).to_list(50)
     
@@ -184,141 +263,99 @@ async def listar_sincronizaciones(
 @integracion.post("/exportar", response_description="Documento exportado")
 async def exportar_documento(
     exportacion: DocumentoExportacion = Body(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
-    Exporta un documento a diferentes formatos (PDF, DOCX, TXT, etc.)
+    Exporta un documento a diferentes formatos (PDF, DOCX, TXT, CSV, XML, JSON).
+    Cada exportación se guarda en disco por (documento, versión, formato), así
+    que repetirla no vuelve a generarla.
     """
+    formato = exportacion.formato.lower()
+    definicion = formato_valido(formato)
+
     # Verificar que el documento existe
     documento = await conn["documentos"].find_one({"_id": exportacion.documento_id})
     if not documento:
         raise HTTPException(status_code=404, detail=f"Documento con ID {exportacion.documento_id} no encontrado")
-    
-    # Verificar que el formato es válido
-    formatos_validos = ["pdf", "docx", "txt", "csv", "xml", "json"]
-    if exportacion.formato.lower() not in formatos_validos:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Formato no soportado. Formatos válidos: {', '.join(formatos_validos)}"
-        )
-    
-    # En un sistema real, aquí se generaría el documento en el formato especificado
-    # Por ahora, simulamos la generación
-    
-    # Simular tiempo de procesamiento
-    time.sleep(random.uniform(0.5, 2.0))
-    
-    # Generar contenido ficticio para simular el documento exportado
-    if exportacion.formato.lower() == "json":
-        # Para JSON, devolvemos el documento como JSON
-        content = json.dumps(serialize_mongo_doc(documento), indent=2)
-        media_type = "application/json"
-    else:
-        # Para otros formatos, simulamos contenido
-        content = f"""
-        DOCUMENTO EXPORTADO
-        
-        Título: {documento.get('titulo', 'Sin título')}
-        Autor: {documento.get('autor', 'Sin autor')}
-        Descripción: {documento.get('descripcion', 'Sin descripción')}
-        
-        Este es un documento simulado en formato {exportacion.formato.upper()}.
-        En un sistema real, aquí estaría el contenido completo del documento.
-        """
-        media_type = {
-            "pdf": "application/pdf",
-            "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "txt": "text/plain",
-            "csv": "text/csv",
-            "xml": "application/xml"
-        }.get(exportacion.formato.lower(), "text/plain")
-    
-    # Crear un archivo en memoria
-    output = io.BytesIO(content.encode('utf-8'))
-    
+
     # Registrar la exportación en la base de datos
     exportacion_doc = {
-        "usuario_id": (await obtener_usuario_actual(token))["_id"],
+        "usuario_id": usuario["_id"],
         "documento_id": exportacion.documento_id,
-        "formato": exportacion.formato.lower(),
-        "fecha_exportacion": datetime.now().isoformat(),
+        "formato": formato,
+        "fecha_exportacion": datetime.now(timezone.utc),
     }
-    
     await conn["exportaciones"].insert_one(exportacion_doc)
-    
-    # Devolver el archivo como respuesta streaming
-    nombre_archivo = f"{documento.get('titulo', 'documento').replace(' ', '_')}.{exportacion.formato.lower()}"
+
+    nombre = nombre_archivo(documento, formato)
+    ruta = cache_artefactos.existente(documento, formato)
+    if ruta is None and definicion.renderizar is not None:
+        # PDF y DOCX se generan completos antes de responder, para poder
+        # devolver un error si fallan
+        ruta = await cache_artefactos.obtener(documento, formato)
+    if ruta is not None:
+        return FileResponse(ruta, media_type=definicion.tipo_mime, filename=nombre)
+
+    return StreamingResponse(
+        cache_artefactos.generar(documento, formato),
+        media_type=definicion.tipo_mime,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
+    )
+
+
+@integracion.post("/exportar/lote", response_description="Documentos exportados en un ZIP")
+async def exportar_documentos_lote(
+    exportacion: ExportacionLote = Body(...),
+    usuario: dict = Depends(obtener_usuario_actual)
+):
+    """
+    Exporta varios documentos, elegidos por id (hasta 500) o por filtros (solo
+    administradores), en un único ZIP con la exportación de cada uno y su
+    portada. El ZIP se genera y se envía por partes, sin tenerlo nunca
+    completo en memoria.
+    """
+    formato = exportacion.formato.lower()
+    formato_valido(formato)
+
+    filtro = {
+        campo: valor
+        for campo, valor in exportacion.model_dump(
+            include={"categoria", "autor", "idioma", "tipo_documento"}
+        ).items()
+        if valor is not None
+    }
+    if exportacion.documento_ids is not None:
+        filtro["_id"] = {"$in": exportacion.documento_ids}
+    elif not filtro:
+        # Sin ids ni filtros se exportaría el catálogo entero
+        raise HTTPException(status_code=400, detail="Indica documento_ids o algún filtro")
+    else:
+        # Por filtros se pueden exportar miles de documentos, como en /documentos/exportar
+        usuario_admin_requerido(usuario)
+
+    await conn["exportaciones"].insert_one({
+        "usuario_id": usuario["_id"],
+        "formato": formato,
+        "filtro": filtro,
+        "lote": True,
+        "fecha_exportacion": datetime.now(timezone.utc),
+    })
+
+    cursor = conn["documentos"].find(filtro).sort("_id", 1)
+    nombre = f"documentos-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.zip"
     return StreamingResponse(
-        output, 
-        media_type=media_type,
-        headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"}
+        exportar_zip(cursor, formato, exportacion.incluir_imagenes),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
     )
 
 
 @integracion.get("/dashboard/estadisticas", response_description="Estadísticas para el dashboard")
 async def obtener_estadisticas(token: str = Depends(esquema_oauth)):
     """
-    Obtiene estadísticas generales para mostrar en un dashboard.
+    Obtiene estadísticas generales para mostrar en un dashboard. Se sirven desde
+    una instantánea que se recalcula como mucho una vez cada INTERVALO_DASHBOARD
+    segundos, por muchos usuarios que tengan el dashboard abierto.
     """
-    # Contar documentos totales
-    total_documentos = await conn["documentos"].count_documents({})
-    
-    # Obtener documentos por categoría
-    pipeline_categorias = [
-        {"$group": {"_id": "$categoria", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    categorias = await conn["documentos"].aggregate(pipeline_categorias).to_list(20)
-    documentos_por_categoria = {cat["_id"]: cat["count"] for cat in categorias if cat["_id"]}
-    
-    # Obtener documentos por idioma
-    pipeline_idiomas = [
-        {"$group": {"_id": "$idioma", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    idiomas = await conn["documentos"].aggregate(pipeline_idiomas).to_list(20)
-    documentos_por_idioma = {idioma["_id"]: idioma["count"] for idioma in idiomas if idioma["_id"]}
-    
-    # En un sistema real, obtendríamos los documentos más vistos de una tabla de estadísticas
-    # Por ahora, devolvemos algunos documentos aleatorios
-    documentos = await conn["documentos"].find().to_list(20)
-    documentos_mas_vistos = []
-    for doc in documentos[:5]:
-        documentos_mas_vistos.append({
-            "id": doc.get("_id"),
-            "titulo": doc.get("titulo", "Sin título"),
-            "autor": doc.get("autor", "Sin autor"),
-            "vistas": random.randint(50, 500)
-        })
-    
-    # Simular usuarios más activos
-    usuarios_mas_activos = [
-        {"id": f"user_{i}", "nombre": f"Usuario {i}", "documentos_creados": random.randint(5, 30), "acciones": random.randint(20, 100)}
-        for i in range(1, 6)
-    ]
-    
-    # Documentos recientes (los mismos documentos pero con fecha simulada)
-    documentos_recientes = []
-    for i, doc in enumerate(documentos[:8]):
-        dias_atras = random.randint(0, 14)
-        fecha_creacion = (datetime.now() - timedelta(days=dias_atras)).isoformat()
-        documentos_recientes.append({
-            "id": doc.get("_id"),
-            "titulo": doc.get("titulo", "Sin título"),
-            "autor": doc.get("autor", "Sin autor"),
-            "fecha_creacion": fecha_creacion
-        })
-    
-    # Ordenar por fecha más reciente
-    documentos_recientes.sort(key=lambda x: x["fecha_creacion"], reverse=True)
-    
-    estadisticas = DatosEstadisticos(
-        total_documentos=total_documentos,
-        documentos_por_categoria=documentos_por_categoria,
-        documentos_por_idioma=documentos_por_idioma,
-        documentos_mas_vistos=documentos_mas_vistos,
-        usuarios_mas_activos=usuarios_mas_activos,
-        documentos_recientes=documentos_recientes
-    )
-    
-    return estadisticas
+    estadisticas = await estadisticas_dashboard.obtener()
+    return DatosEstadisticos(**estadisticas)
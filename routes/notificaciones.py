@@ -1,15 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Path
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Path
+from fastapi.responses import StreamingResponse
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from bson import ObjectId
 
 from config.db import conn
 from models.Notificacion import (
     TipoNotificacion,
     EstadoNotificacion,
+    CambioEstadoNotificaciones,
+    DifusionNotificaciones,
+    EstadoDifusion,
     ConfiguracionRecordatorio
 )
-from auth.autenticacion import esquema_oauth, obtener_usuario_actual
+from auth.autenticacion import obtener_usuario_actual
+from auth.services import usuario_admin_requerido
 from utils.serializers import serialize_mongo_doc, serialize_mongo_docs
+from utils.proyeccion import CAMPOS_GENERICOS
+from services.notificaciones import (
+    cambiar_estado,
+    contar_no_leidas,
+    flujo_notificaciones,
+    guardar_notificacion,
+    ids_notificacion,
+    nueva_notificacion,
+)
+from services.recordatorios import fecha_utc, motor_recordatorios
+from services.difusiones import DIFUSIONES, motor_difusiones
 
 notificaciones = APIRouter(prefix="/notificaciones", tags=["Notificaciones y Recordatorios"])
 
@@ -18,12 +35,12 @@ notificaciones = APIRouter(prefix="/notificaciones", tags=["Notificaciones y Rec
 async def listar_notificaciones(
     estado: Optional[EstadoNotificacion] = None,
     tipo: Optional[TipoNotificacion] = None,
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS)
 ):
     """
     Obtiene las notificaciones del usuario actual, con filtros opcionales por estado y tipo.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Construir filtro
@@ -34,7 +51,7 @@ async def listar_notificaciones(
         filtro["tipo"] = tipo
     
     # Obtener notificaciones ordenadas por fecha (las más recientes primero)
-    notificaciones_db = await conn["notificaciones"].find(filtro).sort(
+    notificaciones_db = await conn["notificaciones"].find(filtro, proyeccion).sort(
         "fecha_creacion", -1
     ).to_list(50)
     
@@ -48,69 +65,59 @@ async def crear_notificacion(
     mensaje: str = Body(...),
     documento_id: Optional[str] = Body(None),
     accion_url: Optional[str] = Body(None),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Crea una nueva notificación para el usuario actual.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
-    # Definir iconos por tipo de notificación
-    iconos = {
-        TipoNotificacion.INFO: "info-circle",
-        TipoNotificacion.ALERTA: "exclamation-triangle",
-        TipoNotificacion.ERROR: "times-circle",
-        TipoNotificacion.EXITO: "check-circle"
-    }
-    
     # Verificar si el documento existe (si se proporciona un ID)
     if documento_id:
-        documento = await conn["documentos"].find_one({"_id": documento_id})
+        documento = await conn["documentos"].find_one({"_id": documento_id}, {"_id": 1})
         if not documento:
             raise HTTPException(status_code=404, detail=f"Documento con ID {documento_id} no encontrado")
     
-    # Crear la notificación
-    notificacion = {
-        "usuario_id": usuario_id,
-        "tipo": tipo,
-        "titulo": titulo,
-        "mensaje": mensaje,
-        "documento_id": documento_id,
-        "fecha_creacion": datetime.now().isoformat(),
-        "estado": EstadoNotificacion.NO_LEIDA,
-        "fecha_lectura": None,
-        "icono": iconos.get(tipo),
-        "accion_url": accion_url
-    }
-    
-    # Guardar en la base de datos
-    resultado = await conn["notificaciones"].insert_one(notificacion)
-    
-    # Recuperar la notificación creada
-    notificacion_creada = await conn["notificaciones"].find_one(
-        {"_id": resultado.inserted_id}
+    # Guardar la notificación y enviarla a las conexiones abiertas del usuario
+    notificacion = await guardar_notificacion(
+        nueva_notificacion(usuario_id, tipo, titulo, mensaje, documento_id, accion_url)
     )
     
-    return serialize_mongo_doc(notificacion_creada)
+    return serialize_mongo_doc(notificacion)
+
+
+@notificaciones.get("/flujo", response_description="Flujo de notificaciones en tiempo real")
+async def flujo_de_notificaciones(
+    last_event_id: Optional[str] = Header(None),
+    usuario: dict = Depends(obtener_usuario_actual)
+):
+    """
+    Envía las notificaciones del usuario a medida que se crean, como Server-Sent
+    Events. Al reconectar, la cabecera Last-Event-ID hace que se reenvíen las
+    creadas mientras tanto, así que no hace falta consultar periódicamente.
+    """
+    return StreamingResponse(
+        flujo_notificaciones(usuario["_id"], last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @notificaciones.put("/{notificacion_id}/leer", response_description="Notificación marcada como leída")
 async def marcar_notificacion_como_leida(
     notificacion_id: str = Path(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Marca una notificación como leída.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar que la notificación existe y pertenece al usuario
     notificacion = await conn["notificaciones"].find_one({
-        "_id": notificacion_id,
+        "_id": {"$in": ids_notificacion([notificacion_id])},
         "usuario_id": usuario_id
-    })
+    }, {"_id": 1})
     
     if not notificacion:
         raise HTTPException(
@@ -118,51 +125,140 @@ async def marcar_notificacion_como_leida(
             detail=f"Notificación con ID {notificacion_id} no encontrada o no pertenece al usuario"
         )
     
-    # Actualizar el estado de la notificación
-    await conn["notificaciones"].update_one(
-        {"_id": notificacion_id},
-        {
-            "$set": {
-                "estado": EstadoNotificacion.LEIDA,
-                "fecha_lectura": datetime.now().isoformat()
-            }
-        }
-    )
+    # Actualizar el estado de la notificación y el contador de no leídas
+    await cambiar_estado(usuario_id, EstadoNotificacion.LEIDA, [notificacion_id])
     
     return {"mensaje": "Notificación marcada como leída", "notificacion_id": notificacion_id}
 
 
 @notificaciones.put("/leer-todas", response_description="Todas las notificaciones marcadas como leídas")
-async def marcar_todas_notificaciones_como_leidas(token: str = Depends(esquema_oauth)):
+async def marcar_todas_notificaciones_como_leidas(usuario: dict = Depends(obtener_usuario_actual)):
     """
     Marca todas las notificaciones no leídas del usuario como leídas.
     """
-    usuario = await obtener_usuario_actual(token)
-    usuario_id = usuario["_id"]
+    modificadas = await cambiar_estado(usuario["_id"], EstadoNotificacion.LEIDA)
     
-    # Actualizar todas las notificaciones no leídas del usuario
-    resultado = await conn["notificaciones"].update_many(
-        {"usuario_id": usuario_id, "estado": EstadoNotificacion.NO_LEIDA},
-        {
-            "$set": {
-                "estado": EstadoNotificacion.LEIDA,
-                "fecha_lectura": datetime.now().isoformat()
-            }
-        }
-    )
+    return {"mensaje": f"{modificadas} notificaciones marcadas como leídas"}
+
+
+@notificaciones.put("/estado", response_description="Estado de varias notificaciones actualizado")
+async def cambiar_estado_notificaciones(
+    cambio: CambioEstadoNotificaciones = Body(...),
+    usuario: dict = Depends(obtener_usuario_actual)
+):
+    """
+    Marca como leídas o archivadas varias notificaciones del usuario en una
+    sola operación. Los ids que no existen o son de otro usuario se ignoran.
+    """
+    modificadas = await cambiar_estado(usuario["_id"], cambio.estado, cambio.ids)
+    
+    return {
+        "mensaje": f"{modificadas} notificaciones actualizadas",
+        "modificadas": modificadas,
+        "no_leidas": await contar_no_leidas(usuario["_id"])
+    }
+
+
+@notificaciones.get("/no-leidas", response_description="Número de notificaciones no leídas")
+async def contar_notificaciones_no_leidas(usuario: dict = Depends(obtener_usuario_actual)):
+    """
+    Número de notificaciones no leídas del usuario, para el indicador del menú.
+    Se lee de un contador por usuario, sin recorrer las notificaciones.
+    """
+    return {"no_leidas": await contar_no_leidas(usuario["_id"])}
+
+
+def _progreso(difusion: dict) -> dict:
+    difusion = serialize_mongo_doc(difusion)
+    for campo in ("reclamado_por", "reclamado_hasta"):
+        difusion.pop(campo, None)
+    total, enviadas = difusion.get("total"), difusion.get("enviadas", 0)
+    if difusion["estado"] == EstadoDifusion.COMPLETADA:
+        difusion["progreso"] = 100.0
+    else:
+        difusion["progreso"] = round(min(enviadas / total * 100, 100.0), 1) if total else 0.0
+    return difusion
+
+
+@notificaciones.post("/difusiones", status_code=202, response_description="Difusión puesta en cola")
+async def crear_difusion(
+    difusion: DifusionNotificaciones = Body(...),
+    usuario: dict = Depends(usuario_admin_requerido)
+):
+    """
+    Envía una notificación a todos los usuarios de un segmento: por rol, país,
+    ciudad o compradores de un documento. Las notificaciones se crean en
+    segundo plano por lotes; el avance se consulta en /difusiones/{difusion_id}.
+    """
+    for documento_id in {difusion.documento_id, difusion.segmento.documento_id} - {None}:
+        documento = await conn["documentos"].find_one({"_id": documento_id}, {"_id": 1})
+        if not documento:
+            raise HTTPException(status_code=404, detail=f"Documento con ID {documento_id} no encontrado")
+    
+    nueva = {
+        **difusion.model_dump(mode="json"),
+        "estado": EstadoDifusion.PENDIENTE.value,
+        "creada_por": usuario["_id"],
+        "fecha_creacion": datetime.now(timezone.utc),
+        "fecha_inicio": None,
+        "fecha_fin": None,
+        "total": None,
+        "enviadas": 0,
+        "intentos": 0,
+        "error": None,
+    }
+    resultado = await conn[DIFUSIONES].insert_one(nueva)
+    motor_difusiones.despertar()
+    
+    return {
+        "mensaje": "Difusión en cola",
+        "difusion_id": str(resultado.inserted_id),
+        "estado": EstadoDifusion.PENDIENTE
+    }
+
+
+@notificaciones.get(
+    "/difusiones",
+    response_description="Lista de difusiones",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def listar_difusiones(estado: Optional[EstadoDifusion] = None):
+    """
+    Últimas 50 difusiones, las más recientes primero, con su avance.
+    """
+    filtro = {"estado": estado.value} if estado else {}
+    difusiones = await conn[DIFUSIONES].find(filtro).sort("fecha_creacion", -1).to_list(50)
+    
+    return [_progreso(difusion) for difusion in difusiones]
+
+
+@notificaciones.get(
+    "/difusiones/{difusion_id}",
+    response_description="Estado de la difusión",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def obtener_difusion(difusion_id: str = Path(...)):
+    """
+    Estado y avance de una difusión: notificaciones enviadas, total estimado
+    de destinatarios y porcentaje completado.
+    """
+    difusion = None
+    if ObjectId.is_valid(difusion_id):
+        difusion = await conn[DIFUSIONES].find_one({"_id": ObjectId(difusion_id)})
+    if not difusion:
+        raise HTTPException(status_code=404, detail=f"Difusión con ID {difusion_id} no encontrada")
     
-    return {"mensaje": f"{resultado.modified_count} notificaciones marcadas como leídas"}
+    return _progreso(difusion)
 
 
 @notificaciones.post("/recordatorios", response_description="Recordatorio creado")
 async def crear_recordatorio(
     config: ConfiguracionRecordatorio = Body(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Crea un nuevo recordatorio para un documento.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar que el documento existe
@@ -171,7 +267,9 @@ async def crear_recordatorio(
         raise HTTPException(status_code=404, detail=f"Documento con ID {config.documento_id} no encontrado")
     
     # Verificar que la fecha de recordatorio es futura
-    if config.fecha_recordatorio <= datetime.now():
+    fecha_recordatorio = fecha_utc(config.fecha_recordatorio)
+    ahora = datetime.now(timezone.utc)
+    if fecha_recordatorio <= ahora:
         raise HTTPException(
             status_code=400, 
             detail="La fecha del recordatorio debe ser futura"
@@ -183,20 +281,21 @@ async def crear_recordatorio(
         "documento_id": config.documento_id,
         "titulo": config.titulo_recordatorio,
         "mensaje": config.mensaje,
-        "fecha_programada": config.fecha_recordatorio.isoformat(),
+        "fecha_programada": fecha_recordatorio,
         "repetir": config.repetir,
         "intervalo_repeticion": config.intervalo_repeticion,
-        "proxima_ejecucion": config.fecha_recordatorio.isoformat(),
+        "proxima_ejecucion": fecha_recordatorio,
         "ultima_ejecucion": None,
         "enviado": False,
         "activo": True,
         "enviar_email": config.enviar_email,
         "email_destino": config.email_destino if config.enviar_email else None,
-        "fecha_creacion": datetime.now().isoformat()
+        "fecha_creacion": ahora
     }
     
     # Guardar en la base de datos
     resultado = await conn["recordatorios"].insert_one(recordatorio)
+    motor_recordatorios.programar(resultado.inserted_id, fecha_recordatorio)
     
     # Recuperar el recordatorio creado
     recordatorio_creado = await conn["recordatorios"].find_one(
@@ -210,12 +309,12 @@ async def crear_recordatorio(
 async def listar_recordatorios(
     activo: Optional[bool] = None,
     documento_id: Optional[str] = None,
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS)
 ):
     """
     Obtiene los recordatorios del usuario actual, con filtros opcionales.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Construir filtro
@@ -226,7 +325,7 @@ async def listar_recordatorios(
         filtro["documento_id"] = documento_id
     
     # Obtener recordatorios ordenados por fecha (los más próximos primero)
-    recordatorios_db = await conn["recordatorios"].find(filtro).sort(
+    recordatorios_db = await conn["recordatorios"].find(filtro, proyeccion).sort(
         "proxima_ejecucion", 1
     ).to_list(50)
     
@@ -244,19 +343,20 @@ async def actualizar_recordatorio(
     activo: Optional[bool] = Body(None),
     enviar_email: Optional[bool] = Body(None),
     email_destino: Optional[str] = Body(None),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Actualiza un recordatorio existente.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar que el recordatorio existe y pertenece al usuario
-    recordatorio = await conn["recordatorios"].find_one({
-        "_id": recordatorio_id,
-        "usuario_id": usuario_id
-    })
+    recordatorio = None
+    if ObjectId.is_valid(recordatorio_id):
+        recordatorio = await conn["recordatorios"].find_one({
+            "_id": ObjectId(recordatorio_id),
+            "usuario_id": usuario_id
+        })
     
     if not recordatorio:
         raise HTTPException(
@@ -275,13 +375,14 @@ async def actualizar_recordatorio(
     
     if fecha_programada is not None:
         # Verificar que la fecha es futura
-        if fecha_programada <= datetime.now():
+        fecha_programada = fecha_utc(fecha_programada)
+        if fecha_programada <= datetime.now(timezone.utc):
             raise HTTPException(
                 status_code=400, 
                 detail="La fecha del recordatorio debe ser futura"
             )
-        actualizacion["fecha_programada"] = fecha_programada.isoformat()
-        actualizacion["proxima_ejecucion"] = fecha_programada.isoformat()
+        actualizacion["fecha_programada"] = fecha_programada
+        actualizacion["proxima_ejecucion"] = fecha_programada
     
     if repetir is not None:
         actualizacion["repetir"] = repetir
@@ -307,14 +408,20 @@ async def actualizar_recordatorio(
     
     # Actualizar el recordatorio
     await conn["recordatorios"].update_one(
-        {"_id": recordatorio_id},
+        {"_id": recordatorio["_id"]},
         {"$set": actualizacion}
     )
     
     # Obtener el recordatorio actualizado
     recordatorio_actualizado = await conn["recordatorios"].find_one(
-        {"_id": recordatorio_id}
+        {"_id": recordatorio["_id"]}
     )
+    if recordatorio_actualizado.get("activo"):
+        motor_recordatorios.programar(
+            recordatorio["_id"], recordatorio_actualizado.get("proxima_ejecucion")
+        )
+    else:
+        motor_recordatorios.descartar(recordatorio["_id"])
     
     return serialize_mongo_doc(recordatorio_actualizado)
 
@@ -322,19 +429,20 @@ async def actualizar_recordatorio(
 @notificaciones.delete("/recordatorios/{recordatorio_id}", response_description="Recordatorio eliminado")
 async def eliminar_recordatorio(
     recordatorio_id: str = Path(...),
-    token: str = Depends(esquema_oauth)
+    usuario: dict = Depends(obtener_usuario_actual)
 ):
     """
     Elimina un recordatorio.
     """
-    usuario = await obtener_usuario_actual(token)
     usuario_id = usuario["_id"]
     
     # Verificar que el recordatorio existe y pertenece al usuario
-    recordatorio = await conn["recordatorios"].find_one({
-        "_id": recordatorio_id,
-        "usuario_id": usuario_id
-    })
+    recordatorio = None
+    if ObjectId.is_valid(recordatorio_id):
+        recordatorio = await conn["recordatorios"].find_one({
+            "_id": ObjectId(recordatorio_id),
+            "usuario_id": usuario_id
+        })
     
     if not recordatorio:
         raise HTTPException(
@@ -343,6 +451,7 @@ async def eliminar_recordatorio(
         )
     
     # Eliminar el recordatorio
-    await conn["recordatorios"].delete_one({"_id": recordatorio_id})
+    await conn["recordatorios"].delete_one({"_id": recordatorio["_id"]})
+    motor_recordatorios.descartar(recordatorio["_id"])
     
     return {"mensaje": "Recordatorio eliminado correctamente", "recordatorio_id": recordatorio_id}
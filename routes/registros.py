@@ -1,33 +1,93 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from datetime import date, datetime, timedelta, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from bson import ObjectId
 
 from config.db import conn
-from auth.autenticacion import esquema_oauth
-from models.Registro import Registro
-from typing import List
+from auth.autenticacion import esquema_oauth, obtener_usuario_actual
+from auth.services import usuario_admin_requerido
+from models.Registro import Registro, Pedido, ReservaPrestamo
+from models.Usuario import Role
+from services.analitica_ventas import (
+    VENTAS_POR_CLIENTE,
+    VENTAS_POR_DIA,
+    VENTAS_POR_DOCUMENTO,
+    VENTAS_POR_TIPO,
+    FORMATO_DIA,
+    reconstruir_agregados,
+    registrar_venta,
+)
+from services.exportacion_datos import COLUMNAS_VENTAS, respuesta_exportacion
+from services.inventario import (
+    agrupar_items,
+    cerrar_reserva,
+    crear_reserva,
+    descontar_stock,
+    descontar_varios,
+    devolver_stock,
+    reabrir_reserva,
+)
 from utils.serializers import serialize_mongo_doc, serialize_mongo_docs
+from utils.proyeccion import CAMPOS_GENERICOS
+from utils.paginacion import PaginaPorId
 
 registro = APIRouter(tags=["Registro de ventas"])
 
+TAMANO_MAXIMO_RANKING = 100
+# Días devueltos como máximo en la serie temporal (unos diez años)
+DIAS_MAXIMOS_SERIE = 3660
+
+
+@registro.get("/ventas", response_description="Registros listados")
+async def obtener_ventas(
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS),
+):
+    registros = await conn["ventas"].find({}, proyeccion).to_list(1000)
+    return serialize_mongo_docs(registros)
+
 
 @registro.get(
-    "/ventas", response_description="Registros listados", response_model=List[Registro]
+    "/ventas/exportar",
+    response_description="Ventas exportadas",
+    dependencies=[Depends(usuario_admin_requerido)],
 )
-async def obtener_ventas(token: str = Depends(esquema_oauth)):
-    registros = await conn["ventas"].find().to_list(1000)
-    return serialize_mongo_docs(registros)
+async def exportar_ventas(
+    formato: Literal["csv", "parquet", "arrow"] = "csv",
+    gzip: bool = False,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+):
+    filtro = {}
+    if desde is not None:
+        filtro["$gte"] = datetime.combine(desde, datetime.min.time(), timezone.utc)
+    if hasta is not None:
+        filtro["$lt"] = datetime.combine(hasta + timedelta(days=1), datetime.min.time(), timezone.utc)
+
+    cursor = conn["ventas"].find({"fecha": filtro} if filtro else {}).sort("fecha", 1)
+    nombre = f"ventas-{datetime.now(timezone.utc):%Y%m%d}"
+    return respuesta_exportacion(cursor, COLUMNAS_VENTAS, formato, gzip, nombre)
+
+
+def _pagina_de_ventas(ventas: list, siguiente: Optional[str]) -> dict:
+    return {"ventas": serialize_mongo_docs(ventas), "siguiente": siguiente}
 
 
 @registro.get("/ventas/usuario/{usuario_id}", response_description="Usuario obtenido")
 async def obtener_adquisicion_de_usuario(
-    usuario_id: str, token: str = Depends(esquema_oauth)
+    usuario_id: str,
+    pagina: PaginaPorId = Depends(),
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS),
 ):
-    registros = (
-        await conn["ventas"].find({"id_cliente": usuario_id}).to_list(length=None)
+    registros, siguiente = await pagina.consultar(
+        conn["ventas"], {"id_cliente": usuario_id}, proyeccion
     )
-    if registros:
-        return serialize_mongo_docs(registros)
+    if registros or pagina.despues is not None:
+        return _pagina_de_ventas(registros, siguiente)
 
     raise HTTPException(
         status_code=404,
@@ -35,28 +95,62 @@ async def obtener_adquisicion_de_usuario(
     )
 
 
+@registro.get(
+    "/ventas/documento/id/{id_documento}", response_description="Registros obtenidos"
+)
+async def obtener_ventas_por_id_documento(
+    id_documento: str,
+    pagina: PaginaPorId = Depends(),
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS),
+):
+    registros, siguiente = await pagina.consultar(
+        conn["ventas"], {"id_documento": id_documento}, proyeccion
+    )
+    if registros or pagina.despues is not None:
+        return _pagina_de_ventas(registros, siguiente)
+    raise HTTPException(
+        status_code=404, detail=f"No hay ventas del documento con id {id_documento}"
+    )
+
+
 @registro.get("/ventas/documento/{nombre}", response_description="Registro obtenido")
-async def obtener_ventas_de_documento(nombre: str, token: str = Depends(esquema_oauth)):
-    registros = (
-        await conn["ventas"].find({"titulo_documento": nombre}).to_list(length=None)
+async def obtener_ventas_de_documento(
+    nombre: str,
+    pagina: PaginaPorId = Depends(),
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS),
+):
+    # El título se puede modificar: se resuelve a los ids de documento y se
+    # buscan las ventas por id_documento, que sí está indexado y no cambia
+    documentos = await conn["documentos"].find({"titulo": nombre}, {"_id": 1}).to_list(None)
+    if not documentos:
+        raise HTTPException(status_code=404, detail=f"documento {nombre} no encontrado")
+
+    ids_documento = [str(documento["_id"]) for documento in documentos]
+    registros, siguiente = await pagina.consultar(
+        conn["ventas"], {"id_documento": {"$in": ids_documento}}, proyeccion
     )
-    if registros:
-        return serialize_mongo_docs(registros)
-    raise HTTPException(status_code=404, detail=f"documento {nombre} no encontrado")
+    return _pagina_de_ventas(registros, siguiente)
 
 
-@registro.get("/ventas/tipo/{tipo_de_venta}", response_description="Registro obtenido")
+@registro.get(
+    "/ventas/tipo/{tipo_de_adquisicion}", response_description="Registros obtenidos"
+)
 async def obtener_ventas_por_tipo(
-    tipo_de_venta: str, token: str = Depends(esquema_oauth)
+    tipo_de_adquisicion: str,
+    pagina: PaginaPorId = Depends(),
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_GENERICOS),
 ):
-    registro_obtenido = await conn["ventas"].find_one(
-        {"tipo_de_venta": tipo_de_venta}
+    registros, siguiente = await pagina.consultar(
+        conn["ventas"], {"tipo_de_adquisicion": tipo_de_adquisicion}, proyeccion
     )
-    if registro_obtenido is not None:
-        return serialize_mongo_doc(registro_obtenido)
+    if registros or pagina.despues is not None:
+        return _pagina_de_ventas(registros, siguiente)
 
     raise HTTPException(
-        status_code=404, detail=f"registro con tipo: {tipo_de_venta} no encontrado"
+        status_code=404, detail=f"registro con tipo: {tipo_de_adquisicion} no encontrado"
     )
 
 
@@ -64,9 +158,207 @@ async def obtener_ventas_por_tipo(
 async def guardar_registro(
     registro: Registro = Body(...), token: str = Depends(esquema_oauth)
 ):
-    registro = jsonable_encoder(registro)
-    registro_insertado = await conn["ventas"].insert_one(registro)
-    registro_creado = await conn["ventas"].find_one(
-        {"_id": registro_insertado.inserted_id}
+    registro = registro.model_dump(exclude={"id"})
+    await descontar_stock(registro["id_documento"], registro["cantidad"])
+    try:
+        await _insertar_ventas([registro])
+    except Exception:
+        await devolver_stock(registro["id_documento"], registro["cantidad"])
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content=jsonable_encoder(serialize_mongo_doc(registro)),
+    )
+
+
+async def _insertar_ventas(ventas: list) -> None:
+    fecha = datetime.now(timezone.utc)
+    for venta in ventas:
+        venta["fecha"] = fecha
+    await conn["ventas"].insert_many(ventas)
+    for venta in ventas:
+        await registrar_venta(venta)
+
+
+@registro.post("/ventas/pedido", response_description="Pedido guardado")
+async def guardar_pedido(pedido: Pedido = Body(...), token: str = Depends(esquema_oauth)):
+    # Un documento repetido en el pedido se descuenta una sola vez
+    cantidades = agrupar_items([item.model_dump() for item in pedido.items])
+    documentos = await descontar_varios(cantidades)
+
+    ventas = [
+        {
+            "id_cliente": pedido.id_cliente,
+            "nombre_cliente": pedido.nombre_cliente,
+            "id_documento": id_documento,
+            "titulo_documento": documentos[id_documento].get("titulo"),
+            "imagen": documentos[id_documento].get("imagen"),
+            "tipo_de_adquisicion": pedido.tipo_de_adquisicion,
+            "cantidad": cantidad,
+            "activo": True,
+        }
+        for id_documento, cantidad in cantidades.items()
+    ]
+    try:
+        await _insertar_ventas(ventas)
+    except Exception:
+        for id_documento, cantidad in cantidades.items():
+            await devolver_stock(id_documento, cantidad)
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content=jsonable_encoder(serialize_mongo_docs(ventas)),
+    )
+
+
+def _filtro_reserva(reserva_id: str, usuario: dict) -> dict:
+    if not ObjectId.is_valid(reserva_id):
+        raise HTTPException(status_code=404, detail=f"reserva {reserva_id} no encontrada")
+    filtro = {"_id": ObjectId(reserva_id)}
+    # Solo el cliente de la reserva (o un administrador) puede cerrarla
+    if usuario.get("rol") != Role.ADMIN:
+        filtro["id_cliente"] = str(usuario["_id"])
+    return filtro
+
+
+@registro.post("/ventas/reservas", response_description="Reserva de préstamo creada")
+async def reservar_prestamo(
+    reserva: ReservaPrestamo = Body(...), usuario: dict = Depends(obtener_usuario_actual)
+):
+    # Solo un administrador reserva a nombre de otro cliente; el resto, para sí mismo
+    id_cliente = reserva.id_cliente if usuario.get("rol") == Role.ADMIN else str(usuario["_id"])
+    reserva_creada = await crear_reserva(
+        reserva.id_documento, reserva.cantidad, id_cliente, reserva.nombre_cliente
     )
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=serialize_mongo_doc(registro_creado))
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content=jsonable_encoder(serialize_mongo_doc(reserva_creada)),
+    )
+
+
+@registro.post(
+    "/ventas/reservas/{reserva_id}/confirmar", response_description="Préstamo registrado"
+)
+async def confirmar_reserva(reserva_id: str, usuario: dict = Depends(obtener_usuario_actual)):
+    reserva = await cerrar_reserva(
+        {**_filtro_reserva(reserva_id, usuario), "expira": {"$gt": datetime.now(timezone.utc)}},
+        "confirmada",
+    )
+    if reserva is None:
+        raise HTTPException(
+            status_code=404, detail=f"reserva {reserva_id} no encontrada o caducada"
+        )
+
+    # El stock ya se descontó al reservar
+    venta = {
+        "id_cliente": reserva["id_cliente"],
+        "nombre_cliente": reserva["nombre_cliente"],
+        "id_documento": reserva["id_documento"],
+        "titulo_documento": reserva["titulo_documento"],
+        "imagen": reserva["imagen"],
+        "tipo_de_adquisicion": "prestamo",
+        "cantidad": reserva["cantidad"],
+        "activo": True,
+        "id_reserva": reserva["_id"],
+    }
+    try:
+        await _insertar_ventas([venta])
+    except Exception:
+        # Sin venta, la reserva vuelve a pendiente para no perder sus unidades
+        await reabrir_reserva(reserva)
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content=jsonable_encoder(serialize_mongo_doc(venta)),
+    )
+
+
+@registro.delete("/ventas/reservas/{reserva_id}", response_description="Reserva cancelada")
+async def cancelar_reserva(reserva_id: str, usuario: dict = Depends(obtener_usuario_actual)):
+    reserva = await cerrar_reserva(_filtro_reserva(reserva_id, usuario), "cancelada")
+    if reserva is None:
+        raise HTTPException(status_code=404, detail=f"reserva {reserva_id} no encontrada")
+    await devolver_stock(reserva["id_documento"], reserva["cantidad"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def _ranking(coleccion: str, orden: str, limite: int) -> list:
+    agregados = (
+        await conn[coleccion]
+        .find({})
+        .sort([(orden, -1), ("_id", 1)])
+        .limit(limite)
+        .to_list(limite)
+    )
+    return serialize_mongo_docs(agregados)
+
+
+@registro.get(
+    "/ventas/analitica/documentos",
+    response_description="Documentos con más ventas",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def analitica_por_documento(
+    orden: Literal["unidades", "ventas"] = "unidades",
+    limite: int = Query(10, ge=1, le=TAMANO_MAXIMO_RANKING),
+):
+    return await _ranking(VENTAS_POR_DOCUMENTO, orden, limite)
+
+
+@registro.get(
+    "/ventas/analitica/clientes",
+    response_description="Clientes con más adquisiciones",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def analitica_por_cliente(
+    orden: Literal["unidades", "ventas"] = "unidades",
+    limite: int = Query(10, ge=1, le=TAMANO_MAXIMO_RANKING),
+):
+    return await _ranking(VENTAS_POR_CLIENTE, orden, limite)
+
+
+@registro.get(
+    "/ventas/analitica/tipos",
+    response_description="Ventas por tipo de adquisición",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def analitica_por_tipo():
+    return await _ranking(VENTAS_POR_TIPO, "unidades", TAMANO_MAXIMO_RANKING)
+
+
+@registro.get(
+    "/ventas/analitica/dias",
+    response_description="Ventas por día",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def analitica_por_dia(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+):
+    # Los días se guardan como AAAA-MM-DD, que ordena igual que las fechas
+    filtro = {}
+    if desde is not None:
+        filtro["$gte"] = desde.strftime(FORMATO_DIA)
+    if hasta is not None:
+        filtro["$lte"] = hasta.strftime(FORMATO_DIA)
+
+    dias = (
+        await conn[VENTAS_POR_DIA]
+        .find({"_id": filtro} if filtro else {})
+        .sort("_id", 1)
+        .to_list(DIAS_MAXIMOS_SERIE)
+    )
+    return [
+        {"dia": dia["_id"], "ventas": dia["ventas"], "unidades": dia["unidades"]}
+        for dia in dias
+    ]
+
+
+@registro.post(
+    "/ventas/analitica/reconstruir",
+    response_description="Agregados de ventas reconstruidos",
+    dependencies=[Depends(usuario_admin_requerido)],
+)
+async def reconstruir_analitica():
+    await reconstruir_agregados()
+    return {"mensaje": "Agregados de ventas reconstruidos"}
@@ -1,21 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
-from passlib.context import CryptContext
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 from models.Usuario import Usuario, ActualizarUsuario, Role, UserResponse
 from config.db import conn
 from auth.autenticacion import esquema_oauth
 from auth.services import usuario_admin_requerido
 from utils.serializers import serialize_mongo_doc, serialize_mongo_docs, serialize_mongo_doc_filtered
+from utils.proyeccion import CAMPOS_USUARIO
+from services.contrasenas import ejecutor_contrasenas
+from auth.cache_principales import cache_principales
+from auth.revocaciones import revocaciones, VERSION_USUARIO_ELIMINADO
+from utils.busqueda import nombre_busqueda, filtro_prefijo
+from utils.paginacion import PaginaPorId
 
 usuario = APIRouter(tags=["Usuarios"])
 
-contexto_pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cambios que invalidan los tokens emitidos antes de la modificación
+CAMPOS_QUE_REVOCAN = {"correo", "contra", "inactivo", "rol"}
+# Los primeros usuarios registrados son administradores
+USUARIOS_ADMIN_INICIALES = 3
+
+
+async def hashear_contra(contra):
+    return await ejecutor_contrasenas.hashear(contra)
 
 
-def hashear_contra(contra):
-    return contexto_pwd.hash(contra)
+def filtro_usuario(usuario_id: str) -> dict:
+    # Los usuarios se insertan con un ObjectId como _id
+    if ObjectId.is_valid(usuario_id):
+        return {"_id": {"$in": [ObjectId(usuario_id), usuario_id]}}
+    return {"_id": usuario_id}
 
 
 @usuario.get(
@@ -23,17 +42,43 @@ def hashear_contra(contra):
     response_description="Usuarios listados",
     dependencies=[Depends(usuario_admin_requerido)],
 )
-async def obtener_usuarios(token: str = Depends(esquema_oauth)):
-    usuarios = await conn["usuarios"].find().to_list(1000)
-    return serialize_mongo_docs(usuarios)
+async def obtener_usuarios(
+    nombre: Optional[str] = Query(None, description="Prefijo de los nombres y apellidos"),
+    ciudad: Optional[str] = None,
+    rol: Optional[Role] = None,
+    inactivo: Optional[bool] = None,
+    pagina: PaginaPorId = Depends(),
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_USUARIO),
+):
+    filtro = {}
+    if nombre:
+        filtro["nombre_busqueda"] = filtro_prefijo(nombre)
+    if ciudad:
+        filtro["ciudad"] = ciudad
+    if rol is not None:
+        filtro["rol"] = rol
+    if inactivo is not None:
+        filtro["inactivo"] = inactivo
+
+    # Orden alfabético con el _id como desempate, continuando tras el último
+    # usuario de la página anterior en lugar de saltar las primeras con skip
+    usuarios, siguiente = await pagina.consultar(
+        conn["usuarios"], filtro, proyeccion, campo="nombre_busqueda"
+    )
+    return {"usuarios": serialize_mongo_docs(usuarios), "siguiente": siguiente}
 
 
 @usuario.get(
     "/usuarios/correo/{correo}",
     response_description="Usuario obtenido",
 )
-async def obtener_usuario_por_correo(correo: str, token: str = Depends(esquema_oauth)):
-    usuario_obtenido = await conn["usuarios"].find_one({"correo": correo})
+async def obtener_usuario_por_correo(
+    correo: str,
+    token: str = Depends(esquema_oauth),
+    proyeccion: dict = Depends(CAMPOS_USUARIO),
+):
+    usuario_obtenido = await conn["usuarios"].find_one({"correo": correo}, proyeccion)
     if usuario_obtenido is not None:
         return serialize_mongo_doc(usuario_obtenido)
 
@@ -46,21 +91,19 @@ async def obtener_usuario_por_correo(correo: str, token: str = Depends(esquema_o
     response_model=UserResponse,
 )
 async def guardar_usuario(usuario: Usuario = Body(...)):
-    usuarios = await obtener_usuarios()
-    if any(u["correo"] == usuario.correo for u in usuarios):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Correo ya registrado"
-        )
-
-    if len(usuarios) < 3:
+    usuarios_existentes = await conn["usuarios"].count_documents(
+        {}, limit=USUARIOS_ADMIN_INICIALES
+    )
+    if usuarios_existentes < USUARIOS_ADMIN_INICIALES:
         usuario.rol = Role.ADMIN
 
-    usuario.contra = hashear_contra(usuario.contra)
+    usuario.contra = await hashear_contra(usuario.contra)
     
     # Crear un diccionario manualmente para evitar problemas de serialización
     usuario_dict = {
         "nombres": usuario.nombres,
         "apellidos": usuario.apellidos,
+        "nombre_busqueda": nombre_busqueda(usuario.nombres, usuario.apellidos),
         "correo": usuario.correo,
         "contra": usuario.contra,
         "pais": usuario.pais,
@@ -69,12 +112,18 @@ async def guardar_usuario(usuario: Usuario = Body(...)):
         "rol": usuario.rol
     }
     
-    nuevo_usuario = await conn["usuarios"].insert_one(usuario_dict)
-    usuario_creado = await conn["usuarios"].find_one({"_id": nuevo_usuario.inserted_id})
+    # El índice único de correo resuelve también los registros simultáneos
+    try:
+        nuevo_usuario = await conn["usuarios"].insert_one(usuario_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Correo ya registrado"
+        )
+    usuario_dict["_id"] = nuevo_usuario.inserted_id
     
     # Utilizamos la función de serialización que elimina campos confidenciales
     campos_excluir = {"contra"}
-    usuario_serializado = serialize_mongo_doc_filtered(usuario_creado, campos_excluir)
+    usuario_serializado = serialize_mongo_doc_filtered(usuario_dict, campos_excluir)
 
     return JSONResponse(status_code=status.HTTP_201_CREATED, content=usuario_serializado)
 
@@ -91,17 +140,46 @@ async def actualizar_usuario(
     usuario_actualizar = {
         datos: valor for datos, valor in usuario.dict().items() if valor is not None
     }
-    if len(usuario_actualizar) >= 1:
-        update_result = await conn["usuarios"].update_one(
-            {"_id": usuario_id}, {"$set": usuario_actualizar}
+    if "contra" in usuario_actualizar:
+        usuario_actualizar["contra"] = await hashear_contra(usuario_actualizar["contra"])
+    if "nombres" in usuario_actualizar or "apellidos" in usuario_actualizar:
+        actual = await conn["usuarios"].find_one(
+            filtro_usuario(usuario_id), {"nombres": 1, "apellidos": 1}
+        ) or {}
+        usuario_actualizar["nombre_busqueda"] = nombre_busqueda(
+            usuario_actualizar.get("nombres", actual.get("nombres")),
+            usuario_actualizar.get("apellidos", actual.get("apellidos")),
         )
+    if len(usuario_actualizar) >= 1:
+        operacion = {"$set": usuario_actualizar}
+        revocar = not CAMPOS_QUE_REVOCAN.isdisjoint(usuario_actualizar)
+        if revocar:
+            operacion["$inc"] = {"version_token": 1}
+
+        try:
+            update_result = await conn["usuarios"].update_one(
+                filtro_usuario(usuario_id), operacion
+            )
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Correo ya registrado"
+            )
 
         if update_result.modified_count == 1:
-            usuario_actualizado = await conn["usuarios"].find_one({"_id": usuario_id})
+            cache_principales.invalidar_usuario(usuario_id)
+            usuario_actualizado = await conn["usuarios"].find_one(
+                filtro_usuario(usuario_id), {"contra": 0}
+            )
             if usuario_actualizado is not None:
+                if revocar:
+                    await revocaciones.revocar_usuario(
+                        usuario_actualizado["_id"], usuario_actualizado["version_token"]
+                    )
                 return serialize_mongo_doc(usuario_actualizado)
 
-    usuario_existente = await conn["usuarios"].find_one({"_id": usuario_id})
+    usuario_existente = await conn["usuarios"].find_one(
+        filtro_usuario(usuario_id), {"contra": 0}
+    )
     if usuario_existente is not None:
         return serialize_mongo_doc(usuario_existente)
 
@@ -114,8 +192,10 @@ async def actualizar_usuario(
     "/usuarios/eliminar/{usuario_id}", response_description="usuario eliminado"
 )
 async def eliminar_usuario_por_id(usuario_id: str, token: str = Depends(esquema_oauth)):
-    usuario_eliminado = await conn["usuarios"].delete_one({"_id": usuario_id})
+    usuario_eliminado = await conn["usuarios"].delete_one(filtro_usuario(usuario_id))
     if usuario_eliminado.deleted_count == 1:
+        cache_principales.invalidar_usuario(usuario_id)
+        await revocaciones.revocar_usuario(usuario_id, VERSION_USUARIO_ELIMINADO)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
     raise HTTPException(
@@ -0,0 +1,37 @@
+import asyncio
+import argparse
+
+import httpx
+
+from medicion import medir
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Mide las peticiones por segundo de una ruta autenticada sin lógica (/token/verificar)."
+    )
+    parser.add_argument("--base", default="http://localhost:8000", help="URL base de la API")
+    parser.add_argument("--correo", required=True, help="Correo de un usuario existente")
+    parser.add_argument("--contra", required=True, help="Contraseña del usuario")
+    parser.add_argument("--concurrencia", type=int, default=50, help="Clientes simultáneos")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Duración en segundos")
+
+    args = parser.parse_args()
+
+    limites = httpx.Limits(max_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.base, limits=limites, timeout=30) as cliente:
+        respuesta = await cliente.post(
+            "/token", data={"username": args.correo, "password": args.contra}
+        )
+        respuesta.raise_for_status()
+        cabeceras = {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+        medicion = await medir(
+            lambda: cliente.get("/token/verificar", headers=cabeceras), args.concurrencia, args.duracion
+        )
+
+    medicion.imprimir()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+import asyncio
+import argparse
+
+import httpx
+
+from medicion import medir
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Mide el rendimiento del servicio de imágenes de un worker."
+    )
+    parser.add_argument("--url", required=True, help="URL de la imagen (ej. http://localhost:8000/images/<nombre>)")
+    parser.add_argument("--concurrencia", type=int, default=50, help="Clientes simultáneos")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Duración en segundos")
+    parser.add_argument("--condicional", action="store_true", help="Enviar If-None-Match (respuestas 304)")
+    parser.add_argument("--accept", default="image/avif,image/webp,*/*", help="Cabecera Accept")
+
+    args = parser.parse_args()
+
+    cabeceras = {"Accept": args.accept}
+    limites = httpx.Limits(max_connections=args.concurrencia)
+
+    async with httpx.AsyncClient(limits=limites, timeout=30) as cliente:
+        if args.condicional:
+            respuesta = await cliente.get(args.url, headers=cabeceras)
+            cabeceras["If-None-Match"] = respuesta.headers.get("etag", "")
+
+        medicion = await medir(
+            lambda: cliente.get(args.url, headers=cabeceras), args.concurrencia, args.duracion
+        )
+
+    medicion.imprimir()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import asyncio
+import argparse
+
+import httpx
+
+from medicion import medir
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Mide el rendimiento de /token y su efecto sobre el resto de rutas."
+    )
+    parser.add_argument("--base", default="http://localhost:8000", help="URL base de la API")
+    parser.add_argument("--correo", required=True, help="Correo de un usuario existente")
+    parser.add_argument("--contra", required=True, help="Contraseña del usuario")
+    parser.add_argument("--concurrencia", type=int, default=20, help="Inicios de sesión simultáneos")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Duración en segundos")
+    parser.add_argument("--sonda", default="/docs", help="Ruta ligera usada para medir el bloqueo")
+
+    args = parser.parse_args()
+
+    limites = httpx.Limits(max_connections=args.concurrencia + 1)
+    async with httpx.AsyncClient(base_url=args.base, limits=limites, timeout=60) as cliente:
+        formulario = {"username": args.correo, "password": args.contra}
+        # La sonda mide la latencia de una ruta ligera mientras se hacen los inicios de sesión
+        login, sonda = await asyncio.gather(
+            medir(lambda: cliente.post("/token", data=formulario), args.concurrencia, args.duracion),
+            medir(lambda: cliente.get(args.sonda), 1, args.duracion, pausa=0.05),
+        )
+
+    correctos = login.codigos[200]
+    print(f"Inicios de sesión: {correctos} correctos de {len(login.latencias)} en {login.transcurrido:.1f} s")
+    print(f"Rendimiento: {correctos / login.transcurrido:.1f} inicios de sesión/s")
+    print(f"Latencia /token p50: {login.percentil(0.5):.1f} ms, p99: {login.percentil(0.99):.1f} ms")
+    if sonda.latencias:
+        print(f"Latencia {args.sonda} p50: {sonda.percentil(0.5):.1f} ms, p99: {sonda.percentil(0.99):.1f} ms")
+    print(f"Códigos: {dict(login.codigos)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
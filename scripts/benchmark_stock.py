@@ -0,0 +1,100 @@
+import asyncio
+import argparse
+import statistics
+import time
+from collections import Counter
+
+import httpx
+import motor.motor_asyncio
+from bson import ObjectId
+from decouple import config
+
+# Configuración de la base de datos
+mongodb_url = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_url)
+db = client.misiontic
+
+
+async def comprar(cliente, cabeceras, venta, latencias, codigos):
+    inicio = time.perf_counter()
+    respuesta = await cliente.post("/ventas/guardar", json=venta, headers=cabeceras)
+    latencias.append(time.perf_counter() - inicio)
+    codigos[respuesta.status_code] += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Lanza compras simultáneas de un mismo documento y comprueba que el "
+            "stock nunca queda en negativo."
+        )
+    )
+    parser.add_argument("--base", default="http://localhost:8000", help="URL base de la API")
+    parser.add_argument("--correo", required=True, help="Correo de un usuario existente")
+    parser.add_argument("--contra", required=True, help="Contraseña del usuario")
+    parser.add_argument("--stock", type=int, default=100, help="Stock inicial del documento de prueba")
+    parser.add_argument("--compras", type=int, default=500, help="Compras simultáneas")
+    parser.add_argument("--cantidad", type=int, default=1, help="Unidades por compra")
+
+    args = parser.parse_args()
+
+    # Documento de prueba creado directamente en la base de datos
+    documento_id = str(ObjectId())
+    await db["documentos"].insert_one(
+        {"_id": documento_id, "titulo": "benchmark stock", "imagen": "", "stock": args.stock}
+    )
+    venta = {
+        "id_cliente": "benchmark",
+        "nombre_cliente": "benchmark",
+        "id_documento": documento_id,
+        "titulo_documento": "benchmark stock",
+        "imagen": "",
+        "tipo_de_adquisicion": "compra",
+        "cantidad": args.cantidad,
+        "activo": True,
+    }
+
+    try:
+        limites = httpx.Limits(max_connections=args.compras)
+        async with httpx.AsyncClient(base_url=args.base, limits=limites, timeout=60) as cliente:
+            respuesta = await cliente.post(
+                "/token", data={"username": args.correo, "password": args.contra}
+            )
+            respuesta.raise_for_status()
+            cabeceras = {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+            latencias = []
+            codigos = Counter()
+            inicio = time.perf_counter()
+            await asyncio.gather(
+                *[
+                    comprar(cliente, cabeceras, venta, latencias, codigos)
+                    for _ in range(args.compras)
+                ]
+            )
+            transcurrido = time.perf_counter() - inicio
+
+        documento = await db["documentos"].find_one({"_id": documento_id})
+        vendidas = await db["ventas"].count_documents({"id_documento": documento_id})
+    finally:
+        await db["documentos"].delete_one({"_id": documento_id})
+        await db["ventas"].delete_many({"id_documento": documento_id})
+        await db["ventas_por_documento"].delete_one({"_id": documento_id})
+        await db["ventas_por_cliente"].delete_one({"_id": "benchmark"})
+
+    esperadas = min(args.compras, args.stock // args.cantidad)
+    stock_final = documento["stock"]
+    print(f"Compras: {args.compras} en {transcurrido:.2f} s ({args.compras / transcurrido:.0f} compras/s)")
+    print(f"Latencia p50: {statistics.median(latencias) * 1000:.1f} ms")
+    print(f"Códigos: {dict(codigos)}")
+    print(f"Ventas registradas: {vendidas} (esperadas {esperadas})")
+    print(f"Stock final: {stock_final} (esperado {args.stock - esperadas * args.cantidad})")
+
+    if stock_final < 0 or vendidas != esperadas or codigos[201] != esperadas:
+        print("ERROR: el stock no es consistente con las ventas registradas")
+        raise SystemExit(1)
+    print("OK: el stock nunca quedó en negativo")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""Utilidades comunes de los scripts benchmark_*: carga durante un tiempo fijo y percentiles."""
+import asyncio
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+import httpx
+
+
+@dataclass
+class Medicion:
+    latencias: List[float] = field(default_factory=list)
+    codigos: Counter = field(default_factory=Counter)
+    transcurrido: float = 0.0
+
+    def percentil(self, p: float) -> float:
+        """Latencia en milisegundos del percentil `p` (entre 0 y 1)."""
+        if not self.latencias:
+            return 0.0
+        valores = sorted(self.latencias)
+        if p == 0.5:
+            return statistics.median(valores) * 1000
+        return valores[max(0, int(len(valores) * p) - 1)] * 1000
+
+    def imprimir(self, nombre: str = "Peticiones") -> None:
+        print(f"{nombre}: {len(self.latencias)} en {self.transcurrido:.1f} s")
+        print(f"Rendimiento: {len(self.latencias) / self.transcurrido:.0f} {nombre.lower()}/s")
+        print(f"Latencia p50: {self.percentil(0.5):.2f} ms")
+        print(f"Latencia p99: {self.percentil(0.99):.2f} ms")
+        print(f"Códigos: {dict(self.codigos)}")
+
+
+async def _trabajador(
+    peticion: Callable[[], Awaitable[httpx.Response]], fin: float, medicion: Medicion, pausa: float
+) -> None:
+    while time.perf_counter() < fin:
+        inicio = time.perf_counter()
+        respuesta = await peticion()
+        medicion.latencias.append(time.perf_counter() - inicio)
+        medicion.codigos[respuesta.status_code] += 1
+        if pausa:
+            await asyncio.sleep(pausa)
+
+
+async def medir(
+    peticion: Callable[[], Awaitable[httpx.Response]],
+    concurrencia: int,
+    duracion: float,
+    pausa: float = 0.0,
+) -> Medicion:
+    """
+    Lanza `concurrencia` clientes que repiten `peticion` durante `duracion`
+    segundos, con `pausa` segundos entre una petición y la siguiente.
+    """
+    medicion = Medicion()
+    inicio = time.perf_counter()
+    fin = inicio + duracion
+    await asyncio.gather(*[_trabajador(peticion, fin, medicion, pausa) for _ in range(concurrencia)])
+    medicion.transcurrido = time.perf_counter() - inicio
+    return medicion
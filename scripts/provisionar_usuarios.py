@@ -0,0 +1,225 @@
+import asyncio
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import motor.motor_asyncio
+from decouple import config
+from passlib.context import CryptContext
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.busqueda import nombre_busqueda  # noqa: E402
+
+# Mismo coste que usa la API, para no forzar un rehash en el primer inicio de sesión
+BCRYPT_COSTO = config("BCRYPT_COSTO", default=12, cast=int)
+contexto_pwd = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_COSTO
+)
+
+# Configuración de la base de datos
+mongodb_url = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_url)
+db = client.misiontic
+
+CAMPOS_OBLIGATORIOS = ("nombres", "apellidos", "correo", "contra")
+ROLES = {"USER", "ADMIN"}
+CLAVE_DUPLICADA = 11000
+
+
+def hashear_contras(contras):
+    # Se ejecuta en un proceso del pool: bcrypt usa un núcleo completo por hash
+    return [contexto_pwd.hash(contra) for contra in contras]
+
+
+def leer_filas(ruta, saltar):
+    with open(ruta, newline="", encoding="utf-8-sig") as archivo:
+        for numero, fila in enumerate(csv.DictReader(archivo), start=1):
+            if numero > saltar:
+                yield numero, fila
+
+
+def leer_lotes(ruta, saltar, tamano):
+    lote = []
+    for numero, fila in leer_filas(ruta, saltar):
+        lote.append((numero, fila))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def normalizar_fila(numero, fila):
+    fila = {clave.strip().lower(): (valor or "").strip() for clave, valor in fila.items() if clave}
+    faltantes = [campo for campo in CAMPOS_OBLIGATORIOS if not fila.get(campo)]
+    if faltantes:
+        print(f"Fila {numero}: faltan los campos {', '.join(faltantes)}")
+        return None
+
+    rol = (fila.get("rol") or "USER").upper()
+    if rol not in ROLES:
+        print(f"Fila {numero}: rol no válido {rol}")
+        return None
+
+    return {
+        "nombres": fila["nombres"],
+        "apellidos": fila["apellidos"],
+        "nombre_busqueda": nombre_busqueda(fila["nombres"], fila["apellidos"]),
+        "correo": fila["correo"],
+        "contra": fila["contra"],
+        "pais": fila.get("pais") or "Colombia",
+        "ciudad": fila.get("ciudad") or "",
+        "inactivo": False,
+        "rol": rol,
+    }
+
+
+def leer_punto_control(ruta):
+    if not os.path.exists(ruta):
+        return 0
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo).get("filas", 0)
+
+
+def guardar_punto_control(ruta, filas):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump({"filas": filas}, archivo)
+    os.replace(temporal, ruta)
+
+
+class Estadisticas:
+    def __init__(self):
+        self.creados = 0
+        self.existentes = 0
+        self.invalidos = 0
+        self.hashes = 0
+        self.inicio = time.perf_counter()
+
+    def resumen(self, filas):
+        transcurrido = time.perf_counter() - self.inicio
+        return (
+            f"{filas} filas | creados {self.creados}, existentes {self.existentes}, "
+            f"inválidos {self.invalidos} | {filas / transcurrido:.0f} filas/s, "
+            f"{self.hashes / transcurrido:.1f} hashes/s"
+        )
+
+
+async def preparar_lote(lote, ejecutor, procesos, estadisticas):
+    usuarios = []
+    for numero, fila in lote:
+        usuario = normalizar_fila(numero, fila)
+        if usuario is None:
+            estadisticas.invalidos += 1
+        else:
+            usuarios.append(usuario)
+
+    # Los correos ya registrados se descartan antes del paso costoso (el hash)
+    correos = list({usuario["correo"] for usuario in usuarios})
+    existentes = {
+        usuario["correo"]
+        async for usuario in db["usuarios"].find({"correo": {"$in": correos}}, {"correo": 1})
+    }
+    nuevos = [usuario for usuario in usuarios if usuario["correo"] not in existentes]
+    estadisticas.existentes += len(usuarios) - len(nuevos)
+
+    # Un trozo por proceso para repartir el lote entre todos los núcleos
+    loop = asyncio.get_running_loop()
+    tamano_trozo = max(1, -(-len(nuevos) // procesos))
+    trozos = [nuevos[i:i + tamano_trozo] for i in range(0, len(nuevos), tamano_trozo)]
+    resultados = await asyncio.gather(
+        *[
+            loop.run_in_executor(ejecutor, hashear_contras, [u["contra"] for u in trozo])
+            for trozo in trozos
+        ]
+    )
+    for trozo, hashes in zip(trozos, resultados):
+        for usuario, contra in zip(trozo, hashes):
+            usuario["contra"] = contra
+    estadisticas.hashes += len(nuevos)
+    return nuevos
+
+
+async def insertar_lote(usuarios, estadisticas):
+    if not usuarios:
+        return
+    try:
+        resultado = await db["usuarios"].insert_many(usuarios, ordered=False)
+        estadisticas.creados += len(resultado.inserted_ids)
+    except BulkWriteError as e:
+        errores = e.details.get("writeErrors", [])
+        otros = [error for error in errores if error.get("code") != CLAVE_DUPLICADA]
+        if otros:
+            raise
+        # Correos repetidos en el CSV o registrados entre la consulta y la inserción
+        estadisticas.creados += e.details.get("nInserted", 0)
+        estadisticas.existentes += len(errores)
+
+
+async def provisionar(args):
+    punto_control = args.punto_control or f"{args.csv}.checkpoint"
+    saltar = 0 if args.reiniciar else leer_punto_control(punto_control)
+    if saltar:
+        print(f"Reanudando desde la fila {saltar + 1}")
+
+    await db["usuarios"].create_index("correo", unique=True)
+
+    estadisticas = Estadisticas()
+    filas = saltar
+    insercion = None
+    with ProcessPoolExecutor(max_workers=args.procesos) as ejecutor:
+        for lote in leer_lotes(args.csv, saltar, args.lote):
+            # Se hashea el lote siguiente mientras se inserta el anterior
+            usuarios = await preparar_lote(lote, ejecutor, args.procesos, estadisticas)
+            if insercion is not None:
+                await insercion
+                guardar_punto_control(punto_control, filas)
+                print(estadisticas.resumen(filas - saltar))
+            filas = lote[-1][0]
+            insercion = asyncio.ensure_future(insertar_lote(usuarios, estadisticas))
+
+        if insercion is not None:
+            await insercion
+            guardar_punto_control(punto_control, filas)
+
+    print(f"Completado: {estadisticas.resumen(filas - saltar)}")
+    if os.path.exists(punto_control):
+        os.remove(punto_control)
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Crea usuarios de forma masiva a partir de un CSV con las columnas "
+            "nombres, apellidos, correo, contra y opcionalmente pais, ciudad y rol."
+        )
+    )
+    parser.add_argument("csv", help="Ruta del archivo CSV")
+    parser.add_argument("--lote", type=int, default=500, help="Usuarios por inserción")
+    parser.add_argument(
+        "--procesos", type=int, default=os.cpu_count() or 1, help="Procesos para el hash"
+    )
+    parser.add_argument(
+        "--punto-control", help="Archivo de progreso (por defecto <csv>.checkpoint)"
+    )
+    parser.add_argument(
+        "--reiniciar", action="store_true", help="Ignora el progreso guardado y empieza de cero"
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv):
+        print(f"Error: no existe el archivo {args.csv}")
+        sys.exit(1)
+
+    await provisionar(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
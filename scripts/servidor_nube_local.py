@@ -0,0 +1,149 @@
+import argparse
+import math
+import random
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+
+PROVEEDORES = ("google_drive", "dropbox", "onedrive", "otro")
+
+
+class NuevaSubida(BaseModel):
+    nombre: str
+    tamano: int = Field(ge=0)
+    tamano_parte: int = Field(gt=0)
+    carpeta: Optional[str] = None
+    id: Optional[str] = None
+
+
+def crear_app(directorio: Path, fallos: float) -> FastAPI:
+    """
+    Servidor que imita las subidas reanudables de Drive, Dropbox y OneDrive
+    bajo /{proveedor}. Las sesiones se guardan en memoria y las partes en
+    disco: si el servidor se reinicia, las sesiones abiertas desaparecen y el
+    cliente tiene que empezar de nuevo, igual que cuando caduca una sesión real.
+    """
+    app = FastAPI(title="Nube local")
+    sesiones = {}
+
+    def autorizar(authorization: Optional[str]) -> None:
+        if not authorization or not authorization.startswith("Bearer ") or not authorization[7:].strip():
+            raise HTTPException(status_code=401, detail="Token de acceso no válido")
+
+    def sesion_de(proveedor: str, sesion: str) -> dict:
+        datos = sesiones.get(sesion)
+        if datos is None or datos["proveedor"] != proveedor:
+            raise HTTPException(status_code=404, detail="Sesión de subida no encontrada")
+        return datos
+
+    def recibidas(sesion: str) -> list:
+        return sorted(int(ruta.stem) for ruta in (directorio / "sesiones" / sesion).glob("*.parte"))
+
+    @app.post("/{proveedor}/subidas")
+    async def abrir_subida(proveedor: str, subida: NuevaSubida, authorization: Optional[str] = Header(None)):
+        autorizar(authorization)
+        if proveedor not in PROVEEDORES:
+            raise HTTPException(status_code=404, detail="Proveedor desconocido")
+        for valor in (subida.carpeta, subida.id):
+            if valor is not None and not re.fullmatch(r"[\w\-]+", valor):
+                raise HTTPException(status_code=400, detail="Identificador no válido")
+        sesion = uuid.uuid4().hex
+        sesiones[sesion] = {"proveedor": proveedor, **subida.model_dump()}
+        (directorio / "sesiones" / sesion).mkdir(parents=True, exist_ok=True)
+        return {"sesion": sesion}
+
+    @app.get("/{proveedor}/subidas/{sesion}")
+    async def estado_subida(proveedor: str, sesion: str, authorization: Optional[str] = Header(None)):
+        autorizar(authorization)
+        datos = sesion_de(proveedor, sesion)
+        return {"partes": recibidas(sesion), "tamano": datos["tamano"]}
+
+    @app.put("/{proveedor}/subidas/{sesion}/partes/{indice}")
+    async def subir_parte(
+        proveedor: str, sesion: str, indice: int, request: Request,
+        authorization: Optional[str] = Header(None),
+    ):
+        autorizar(authorization)
+        datos = sesion_de(proveedor, sesion)
+        if random.random() < fallos:
+            raise HTTPException(status_code=503, detail="Fallo simulado")
+        total = math.ceil(datos["tamano"] / datos["tamano_parte"])
+        if not 0 <= indice < total:
+            raise HTTPException(status_code=400, detail="Parte fuera de rango")
+        contenido = await request.body()
+        esperado = min(datos["tamano_parte"], datos["tamano"] - indice * datos["tamano_parte"])
+        if len(contenido) != esperado:
+            raise HTTPException(status_code=400, detail=f"La parte debe tener {esperado} bytes")
+        ruta = directorio / "sesiones" / sesion / f"{indice}.parte"
+        temporal = ruta.with_suffix(".tmp")
+        temporal.write_bytes(contenido)
+        temporal.replace(ruta)
+        return {"parte": indice}
+
+    @app.post("/{proveedor}/subidas/{sesion}/completar")
+    async def completar_subida(
+        proveedor: str, sesion: str, request: Request, authorization: Optional[str] = Header(None)
+    ):
+        autorizar(authorization)
+        datos = sesion_de(proveedor, sesion)
+        total = math.ceil(datos["tamano"] / datos["tamano_parte"])
+        faltan = sorted(set(range(total)) - set(recibidas(sesion)))
+        if faltan:
+            raise HTTPException(status_code=409, detail=f"Faltan partes: {faltan[:20]}")
+
+        archivo_id = datos["id"] or uuid.uuid4().hex
+        destino = directorio / proveedor / (datos["carpeta"] or "raiz") / archivo_id
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        carpeta_sesion = directorio / "sesiones" / sesion
+        with open(destino, "wb") as salida:
+            for indice in range(total):
+                with open(carpeta_sesion / f"{indice}.parte", "rb") as parte:
+                    shutil.copyfileobj(parte, salida)
+        shutil.rmtree(carpeta_sesion, ignore_errors=True)
+        del sesiones[sesion]
+        (destino.parent / f"{archivo_id}.nombre").write_text(datos["nombre"], encoding="utf-8")
+        return {
+            "id": archivo_id,
+            "url": str(request.base_url).rstrip("/") + f"/{proveedor}/archivos/{archivo_id}",
+        }
+
+    @app.get("/{proveedor}/archivos/{archivo_id}")
+    async def descargar(proveedor: str, archivo_id: str):
+        for ruta in (directorio / proveedor).glob(f"*/{archivo_id}"):
+            nombre = (ruta.parent / f"{archivo_id}.nombre").read_text(encoding="utf-8")
+            return FileResponse(ruta, filename=nombre)
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Servidor local que imita las subidas reanudables por partes de los "
+            "proveedores en la nube, para probar la sincronización con PROVEEDOR_NUBE=http."
+        )
+    )
+    parser.add_argument("--puerto", type=int, default=8090, help="Puerto en el que escuchar")
+    parser.add_argument("--directorio", default="nube_http", help="Directorio donde guardar los archivos")
+    parser.add_argument(
+        "--fallos", type=float, default=0.0,
+        help="Fracción de partes que se rechazan con 503, para probar las reanudaciones",
+    )
+
+    args = parser.parse_args()
+
+    directorio = Path(args.directorio).absolute()
+    directorio.mkdir(parents=True, exist_ok=True)
+    uvicorn.run(crear_app(directorio, args.fallos), host="127.0.0.1", port=args.puerto)
+
+
+if __name__ == "__main__":
+    main()
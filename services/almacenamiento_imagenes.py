@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from decouple import config
+from fastapi import HTTPException, UploadFile, status
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from starlette.concurrency import run_in_threadpool
+
+from config.db import conn
+
+logger = logging.getLogger("almacenamiento_imagenes")
+
+TAMANO_FRAGMENTO = 1024 * 1024
+DIRECTORIO_IMAGENES = Path(str(config("DIRECTORIO_IMAGENES", default="images"))).absolute()
+URL_PUBLICA = str(config("URL_PUBLICA", default="http://localhost:8000")).rstrip("/")
+
+# Firmas (magic bytes) de los formatos de imagen aceptados
+FIRMAS = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+EXTENSIONES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+
+TIPOS_POR_EXTENSION = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+}
+
+
+def detectar_tipo_mime(cabecera: bytes) -> Optional[str]:
+    """Detecta el tipo MIME de una imagen a partir de sus primeros bytes."""
+    for firma, tipo in FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if cabecera[4:8] == b"ftyp" and cabecera[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return None
+
+
+def tipo_mime_por_nombre(nombre: str) -> str:
+    return TIPOS_POR_EXTENSION.get(Path(nombre).suffix.lower(), "application/octet-stream")
+
+
+def nombre_valido(nombre: str) -> bool:
+    """Evita rutas relativas o nombres que salgan del directorio de imágenes."""
+    return bool(nombre) and Path(nombre).name == nombre and not nombre.startswith(".")
+
+
+def url_imagen(nombre: str) -> str:
+    return f"{URL_PUBLICA}/images/{nombre}"
+
+
+def nombre_de_url(url: Optional[str]) -> Optional[str]:
+    """Nombre de la imagen a partir de la URL guardada en el documento."""
+    if not url or "/images/" not in url:
+        return None
+    nombre = url.rsplit("/images/", 1)[1].split("?", 1)[0]
+    return nombre if nombre_valido(nombre) else None
+
+
+def _tipo_no_soportado() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail=f"Formato de imagen no soportado. Formatos válidos: {', '.join(EXTENSIONES.values())}",
+    )
+
+
+class AlmacenamientoImagenes(ABC):
+    """
+    Interfaz común de los almacenamientos de imágenes.
+
+    Los archivos se guardan con su SHA-256 como nombre, de modo que dos
+    portadas idénticas ocupan un único archivo.
+    """
+
+    @abstractmethod
+    async def guardar(self, archivo: UploadFile) -> dict:
+        """Guarda la imagen subida con su SHA-256 como nombre y devuelve sus datos."""
+
+    @abstractmethod
+    async def guardar_bytes(self, nombre: str, datos: bytes, tipo_mime: str) -> None:
+        """Guarda `datos` con el nombre indicado, por ejemplo una variante generada."""
+
+    @abstractmethod
+    async def metadatos(self, nombre: str) -> Optional[dict]:
+        """Devuelve tamano, tipo_mime y modificado (timestamp) o None si no existe."""
+
+    @abstractmethod
+    async def leer(self, nombre: str) -> Optional[bytes]:
+        """Devuelve el archivo completo o None si no existe."""
+
+    @abstractmethod
+    def flujo(
+        self, nombre: str, inicio: int = 0, fin: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Lee el archivo por fragmentos, opcionalmente solo el rango [inicio, fin)."""
+
+    def ruta(self, nombre: str) -> Optional[Path]:
+        """Ruta local del archivo, solo disponible en el almacenamiento en disco."""
+        return None
+
+
+class AlmacenamientoLocal(AlmacenamientoImagenes):
+    def __init__(self, directorio: Path):
+        self.directorio = directorio
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    def ruta(self, nombre: str) -> Optional[Path]:
+        if not nombre_valido(nombre):
+            return None
+        return self.directorio / nombre
+
+    def _volcar(self, origen) -> tuple:
+        # Se ejecuta en un hilo: copia por fragmentos calculando el hash a la vez
+        hasher = hashlib.sha256()
+        tamano = 0
+        cabecera = b""
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as destino:
+                while True:
+                    fragmento = origen.read(TAMANO_FRAGMENTO)
+                    if not fragmento:
+                        break
+                    if not cabecera:
+                        cabecera = fragmento[:32]
+                    hasher.update(fragmento)
+                    destino.write(fragmento)
+                    tamano += len(fragmento)
+        except BaseException:
+            os.unlink(temporal)
+            raise
+        return Path(temporal), hasher.hexdigest(), tamano, cabecera
+
+    def _publicar(self, temporal: Path, destino: Path) -> None:
+        if destino.exists():
+            # Imagen duplicada: se conserva el archivo existente
+            temporal.unlink()
+        else:
+            os.replace(temporal, destino)
+
+    async def guardar(self, archivo: UploadFile) -> dict:
+        await archivo.seek(0)
+        temporal, sha256, tamano, cabecera = await run_in_threadpool(
+            self._volcar, archivo.file
+        )
+
+        tipo_mime = detectar_tipo_mime(cabecera)
+        if tipo_mime is None:
+            await run_in_threadpool(temporal.unlink)
+            raise _tipo_no_soportado()
+
+        nombre = f"{sha256}{EXTENSIONES[tipo_mime]}"
+        await run_in_threadpool(self._publicar, temporal, self.directorio / nombre)
+
+        return {
+            "nombre": nombre,
+            "sha256": sha256,
+            "tamano": tamano,
+            "tipo_mime": tipo_mime,
+        }
+
+    def _escribir(self, nombre: str, datos: bytes) -> None:
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as destino:
+            destino.write(datos)
+        os.replace(temporal, self.directorio / nombre)
+
+    async def guardar_bytes(self, nombre: str, datos: bytes, tipo_mime: str) -> None:
+        if not nombre_valido(nombre):
+            raise ValueError(f"Nombre de imagen no válido: {nombre}")
+        await run_in_threadpool(self._escribir, nombre, datos)
+
+    async def metadatos(self, nombre: str) -> Optional[dict]:
+        ruta = self.ruta(nombre)
+        if ruta is None:
+            return None
+        try:
+            estado = await run_in_threadpool(os.stat, ruta)
+        except FileNotFoundError:
+            return None
+        return {
+            "tamano": estado.st_size,
+            "tipo_mime": tipo_mime_por_nombre(nombre),
+            "modificado": estado.st_mtime,
+            "estado": estado,
+        }
+
+    async def leer(self, nombre: str) -> Optional[bytes]:
+        ruta = self.ruta(nombre)
+        if ruta is None:
+            return None
+        try:
+            return await run_in_threadpool(ruta.read_bytes)
+        except FileNotFoundError:
+            return None
+
+    async def flujo(
+        self, nombre: str, inicio: int = 0, fin: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        ruta = self.ruta(nombre)
+        with open(ruta, "rb") as archivo:
+            archivo.seek(inicio)
+            restante = None if fin is None else fin - inicio
+            while restante is None or restante > 0:
+                tamano = TAMANO_FRAGMENTO if restante is None else min(TAMANO_FRAGMENTO, restante)
+                fragmento = await run_in_threadpool(archivo.read, tamano)
+                if not fragmento:
+                    break
+                if restante is not None:
+                    restante -= len(fragmento)
+                yield fragmento
+
+
+class AlmacenamientoGridFS(AlmacenamientoImagenes):
+    def __init__(self, db, bucket: str = "imagenes_fs"):
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket)
+        self.archivos = db[f"{bucket}.files"]
+
+    async def guardar(self, archivo: UploadFile) -> dict:
+        await archivo.seek(0)
+        hasher = hashlib.sha256()
+        tamano = 0
+        cabecera = b""
+
+        subida = self.bucket.open_upload_stream(f"tmp-{uuid.uuid4().hex}")
+        try:
+            while True:
+                fragmento = await archivo.read(TAMANO_FRAGMENTO)
+                if not fragmento:
+                    break
+                if not cabecera:
+                    cabecera = fragmento[:32]
+                hasher.update(fragmento)
+                await subida.write(fragmento)
+                tamano += len(fragmento)
+            await subida.close()
+        except BaseException:
+            await subida.abort()
+            raise
+
+        tipo_mime = detectar_tipo_mime(cabecera)
+        if tipo_mime is None:
+            await self.bucket.delete(subida._id)
+            raise _tipo_no_soportado()
+
+        sha256 = hasher.hexdigest()
+        nombre = f"{sha256}{EXTENSIONES[tipo_mime]}"
+
+        if await self.archivos.find_one({"filename": nombre}, {"_id": 1}):
+            await self.bucket.delete(subida._id)
+        else:
+            await self.bucket.rename(subida._id, nombre)
+            await self.archivos.update_one(
+                {"_id": subida._id}, {"$set": {"metadata": {"tipo_mime": tipo_mime}}}
+            )
+
+        return {
+            "nombre": nombre,
+            "sha256": sha256,
+            "tamano": tamano,
+            "tipo_mime": tipo_mime,
+        }
+
+    async def guardar_bytes(self, nombre: str, datos: bytes, tipo_mime: str) -> None:
+        anteriores = await self.archivos.find({"filename": nombre}, {"_id": 1}).to_list(None)
+        await self.bucket.upload_from_stream(
+            nombre, datos, metadata={"tipo_mime": tipo_mime}
+        )
+        for anterior in anteriores:
+            await self.bucket.delete(anterior["_id"])
+
+    async def metadatos(self, nombre: str) -> Optional[dict]:
+        archivo = await self.archivos.find_one(
+            {"filename": nombre}, sort=[("uploadDate", -1)]
+        )
+        if archivo is None:
+            return None
+        return {
+            "tamano": archivo["length"],
+            "tipo_mime": (archivo.get("metadata") or {}).get(
+                "tipo_mime", tipo_mime_por_nombre(nombre)
+            ),
+            "modificado": archivo["uploadDate"].timestamp(),
+        }
+
+    async def leer(self, nombre: str) -> Optional[bytes]:
+        try:
+            descarga = await self.bucket.open_download_stream_by_name(nombre)
+        except NoFile:
+            return None
+        return await descarga.read()
+
+    async def flujo(
+        self, nombre: str, inicio: int = 0, fin: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        descarga = await self.bucket.open_download_stream_by_name(nombre)
+        if inicio:
+            descarga.seek(inicio)
+        restante = None if fin is None else fin - inicio
+        while restante is None or restante > 0:
+            fragmento = await descarga.readchunk()
+            if not fragmento:
+                break
+            if restante is not None:
+                fragmento = fragmento[:restante]
+                restante -= len(fragmento)
+            yield fragmento
+
+
+def crear_almacenamiento() -> AlmacenamientoImagenes:
+    tipo = str(config("ALMACENAMIENTO_IMAGENES", default="local")).lower()
+    if tipo == "gridfs":
+        logger.info("Usando GridFS para almacenar imágenes")
+        return AlmacenamientoGridFS(conn)
+    return AlmacenamientoLocal(DIRECTORIO_IMAGENES)
+
+
+almacenamiento = crear_almacenamiento()
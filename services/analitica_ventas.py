@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from config.db import conn
+
+logger = logging.getLogger("analitica_ventas")
+
+# Colecciones de agregados: cada venta incrementa un documento de cada una
+VENTAS_POR_DOCUMENTO = "ventas_por_documento"
+VENTAS_POR_CLIENTE = "ventas_por_cliente"
+VENTAS_POR_TIPO = "ventas_por_tipo"
+VENTAS_POR_DIA = "ventas_por_dia"
+
+# Clave de agrupación y campos descriptivos que se copian de la venta
+AGREGADOS = {
+    VENTAS_POR_DOCUMENTO: ("id_documento", ("titulo_documento",)),
+    VENTAS_POR_CLIENTE: ("id_cliente", ("nombre_cliente",)),
+    VENTAS_POR_TIPO: ("tipo_de_adquisicion", ()),
+}
+
+FORMATO_DIA = "%Y-%m-%d"
+
+# Las ventas anteriores al campo `fecha` usan la fecha de creación de su ObjectId
+FECHA_VENTA = {
+    "$ifNull": [
+        "$fecha",
+        {"$convert": {"input": "$_id", "to": "date", "onError": None, "onNull": None}},
+    ]
+}
+
+
+def dia_de(fecha: datetime) -> str:
+    return fecha.astimezone(timezone.utc).strftime(FORMATO_DIA)
+
+
+async def registrar_venta(venta: dict) -> None:
+    """Actualiza de forma incremental los agregados con una venta nueva."""
+    fecha = venta["fecha"]
+    incremento = {"ventas": 1, "unidades": venta.get("cantidad", 0)}
+
+    operaciones = []
+    for coleccion, (clave, descriptivos) in AGREGADOS.items():
+        operaciones.append(
+            conn[coleccion].update_one(
+                {"_id": venta.get(clave)},
+                {
+                    "$inc": incremento,
+                    "$set": {campo: venta.get(campo) for campo in descriptivos},
+                    "$max": {"ultima_venta": fecha},
+                },
+                upsert=True,
+            )
+        )
+    operaciones.append(
+        conn[VENTAS_POR_DIA].update_one(
+            {"_id": dia_de(fecha)}, {"$inc": incremento}, upsert=True
+        )
+    )
+
+    try:
+        await asyncio.gather(*operaciones)
+    except Exception as e:
+        # La venta ya está guardada: los agregados se corrigen al reconstruirlos
+        logger.error(f"Error actualizando agregados de ventas: {str(e)}")
+
+
+def _pipeline_agregado(clave: str, descriptivos, coleccion: str) -> list:
+    grupo = {
+        "_id": f"${clave}",
+        "ventas": {"$sum": 1},
+        "unidades": {"$sum": "$cantidad"},
+        "ultima_venta": {"$max": FECHA_VENTA},
+    }
+    for campo in descriptivos:
+        grupo[campo] = {"$last": f"${campo}"}
+    return [
+        {"$group": grupo},
+        {"$out": coleccion},
+    ]
+
+
+def _pipeline_dias() -> list:
+    return [
+        {"$project": {"fecha": FECHA_VENTA, "cantidad": 1}},
+        {"$match": {"fecha": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": {"$dateToString": {"format": FORMATO_DIA, "date": "$fecha"}},
+                "ventas": {"$sum": 1},
+                "unidades": {"$sum": "$cantidad"},
+            }
+        },
+        {"$out": VENTAS_POR_DIA},
+    ]
+
+
+async def reconstruir_agregados() -> None:
+    """
+    Recalcula todos los agregados desde `ventas` con pipelines `$out`. Sirve
+    para cargarlos la primera vez y para corregir desviaciones; las ventas que
+    se registren mientras se ejecuta pueden quedar contadas dos veces o ninguna,
+    por lo que conviene lanzarlo en momentos de poca actividad.
+
+    `$out` escribe en una colección temporal y la intercambia con la de destino
+    al terminar, conservando sus índices: las claves que ya no tienen ventas
+    desaparecen y las consultas nunca ven un agregado a medio construir.
+    """
+    for coleccion, (clave, descriptivos) in AGREGADOS.items():
+        await conn["ventas"].aggregate(
+            _pipeline_agregado(clave, descriptivos, coleccion)
+        ).to_list(None)
+    await conn["ventas"].aggregate(_pipeline_dias()).to_list(None)
+
+
+async def asegurar_agregados() -> None:
+    """Construye los agregados al arrancar si hay ventas pero aún no existen."""
+    try:
+        sin_agregados = await conn[VENTAS_POR_TIPO].find_one({}, {"_id": 1}) is None
+        if sin_agregados and await conn["ventas"].find_one({}, {"_id": 1}) is not None:
+            await reconstruir_agregados()
+    except Exception as e:
+        logger.error(f"Error preparando agregados de ventas: {str(e)}")
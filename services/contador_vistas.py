@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+
+from decouple import config
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config.db import conn
+
+logger = logging.getLogger("contador_vistas")
+
+INTERVALO_VISTAS = config("INTERVALO_VISTAS", default=10, cast=int)
+
+VISTAS_DIARIAS = "vistas_diarias"
+VISTAS_DOCUMENTOS = "vistas_documentos"
+
+
+async def _escribir(coleccion, operaciones: list) -> Tuple[Set[int], Optional[BulkWriteError]]:
+    """
+    bulk_write sin orden. Si algunas operaciones fallan, las demás ya se han
+    aplicado: se devuelven los índices de las fallidas y el error, para
+    reintentar solo esas.
+    """
+    try:
+        await coleccion.bulk_write(operaciones, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"] for error in e.details.get("writeErrors", [])}, e
+    return set(), None
+
+
+class ContadorVistas:
+    """
+    Cuenta las vistas de documentos en memoria y las escribe en MongoDB cada
+    `intervalo` segundos con un único bulk_write de `$inc`. Registrar una vista
+    no toca la base de datos; si el volcado falla, los contadores que no se
+    guardaron se conservan para el siguiente intento.
+    """
+
+    def __init__(self, intervalo: int):
+        self.intervalo = intervalo
+        self._pendientes: Counter = Counter()
+        # Totales que no se pudieron guardar aunque sus vistas diarias sí
+        self._totales_pendientes: Counter = Counter()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def registrar(self, documento_id: str) -> None:
+        dia = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        self._pendientes[(str(documento_id), dia)] += 1
+
+    async def volcar(self) -> None:
+        if not self._pendientes and not self._totales_pendientes:
+            return
+        # Se cambia el contador antes de escribir para no perder las vistas
+        # que lleguen mientras tanto
+        pendientes, self._pendientes = self._pendientes, Counter()
+        anteriores, self._totales_pendientes = self._totales_pendientes, Counter()
+
+        # Los totales solo suman las vistas diarias que llegaron a guardarse
+        totales = Counter(anteriores)
+        error = None
+        if pendientes:
+            diarias = list(pendientes.items())
+            try:
+                fallidas, error = await _escribir(conn[VISTAS_DIARIAS], [
+                    UpdateOne(
+                        {"documento_id": documento_id, "dia": dia},
+                        {"$inc": {"vistas": vistas}},
+                        upsert=True,
+                    )
+                    for (documento_id, dia), vistas in diarias
+                ])
+            except Exception:
+                self._pendientes.update(pendientes)
+                self._totales_pendientes.update(anteriores)
+                raise
+            for indice, ((documento_id, dia), vistas) in enumerate(diarias):
+                if indice in fallidas:
+                    self._pendientes[(documento_id, dia)] += vistas
+                else:
+                    totales[documento_id] += vistas
+
+        if totales:
+            documentos = list(totales.items())
+            try:
+                fallidos, error_totales = await _escribir(conn[VISTAS_DOCUMENTOS], [
+                    UpdateOne({"_id": documento_id}, {"$inc": {"total": vistas}}, upsert=True)
+                    for documento_id, vistas in documentos
+                ])
+            except Exception:
+                self._totales_pendientes.update(totales)
+                raise
+            for indice in fallidos:
+                documento_id, vistas = documentos[indice]
+                self._totales_pendientes[documento_id] += vistas
+            error = error or error_totales
+
+        if error is not None:
+            raise error
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.volcar()
+            except Exception as e:
+                logger.error(f"Error guardando vistas: {str(e)}")
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        try:
+            await self.volcar()
+        except Exception as e:
+            logger.error(f"Error guardando vistas al detener: {str(e)}")
+
+
+async def mas_vistos(limite: int) -> List[Tuple[str, int]]:
+    """Documentos con más vistas, leídos del índice por `total`."""
+    documentos = (
+        await conn[VISTAS_DOCUMENTOS]
+        .find({}, {"total": 1})
+        .sort("total", -1)
+        .limit(limite)
+        .to_list(limite)
+    )
+    return [(documento["_id"], documento["total"]) for documento in documentos]
+
+
+async def documentos_con_vistas(limite: int) -> list:
+    """Documentos más vistos con su título y autor."""
+    vistos = await mas_vistos(limite)
+    documentos = await conn["documentos"].find(
+        {"_id": {"$in": [documento_id for documento_id, _ in vistos]}},
+        {"titulo": 1, "autor": 1},
+    ).to_list(limite)
+    por_id = {documento["_id"]: documento for documento in documentos}
+    return [
+        {
+            "id": documento_id,
+            "titulo": por_id.get(documento_id, {}).get("titulo", "Sin título"),
+            "autor": por_id.get(documento_id, {}).get("autor", "Sin autor"),
+            "vistas": vistas,
+        }
+        for documento_id, vistas in vistos
+        if documento_id in por_id
+    ]
+
+
+contador_vistas = ContadorVistas(INTERVALO_VISTAS)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from decouple import config
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+logger = logging.getLogger("contrasenas")
+
+# Coste de bcrypt (log2 de las iteraciones). Los hashes con otro coste se
+# vuelven a calcular de forma transparente en el siguiente inicio de sesión.
+BCRYPT_COSTO = config("BCRYPT_COSTO", default=12, cast=int)
+# bcrypt libera el GIL, por lo que un pool de hilos aprovecha varios núcleos
+HILOS_CONTRASENAS = config("HILOS_CONTRASENAS", default=4, cast=int)
+# Operaciones en cola o en curso a partir de las cuales se responde 503
+COLA_MAXIMA_CONTRASENAS = config("COLA_MAXIMA_CONTRASENAS", default=64, cast=int)
+
+contexto_pwd = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_COSTO,
+    bcrypt__min_rounds=BCRYPT_COSTO,
+    bcrypt__max_rounds=BCRYPT_COSTO,
+)
+
+
+class EjecutorContrasenas:
+    """
+    Ejecuta el hash y la verificación de contraseñas fuera del bucle de eventos,
+    en un pool acotado. Si la cola se llena se rechaza la operación con 503 en
+    lugar de acumular inicios de sesión que bloquearían al resto de peticiones.
+    """
+
+    def __init__(self, hilos: int, cola_maxima: int):
+        self.cola_maxima = cola_maxima
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="bcrypt")
+        self._pendientes = 0
+        self._cerrojo = threading.Lock()
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    async def _ejecutar(self, funcion, *args):
+        if self._pendientes >= self.cola_maxima:
+            logger.warning("Cola de contraseñas saturada, se rechaza la operación")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="El servidor está ocupado, intente de nuevo en unos segundos",
+                headers={"Retry-After": "1"},
+            )
+
+        with self._cerrojo:
+            self._pendientes += 1
+        futuro = self._ejecutor.submit(funcion, *args)
+        # Se descuenta al terminar el hilo, no al volver la petición: si esta se
+        # cancela, bcrypt sigue ocupando el hilo hasta acabar
+        futuro.add_done_callback(self._terminada)
+        return await asyncio.wrap_future(futuro)
+
+    def _terminada(self, _futuro) -> None:
+        # Se llama desde el hilo del pool
+        with self._cerrojo:
+            self._pendientes -= 1
+
+    async def hashear(self, contra: str) -> str:
+        return await self._ejecutar(contexto_pwd.hash, contra)
+
+    async def verificar(self, contra: str, contra_hasheada: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verifica la contraseña. Devuelve (valida, nuevo_hash), donde nuevo_hash
+        solo se informa cuando el hash guardado usa un coste distinto al actual.
+        """
+        return await self._ejecutar(contexto_pwd.verify_and_update, contra, contra_hasheada)
+
+    def detener(self) -> None:
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+
+
+ejecutor_contrasenas = EjecutorContrasenas(HILOS_CONTRASENAS, COLA_MAXIMA_CONTRASENAS)
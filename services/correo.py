@@ -0,0 +1,45 @@
+import logging
+import smtplib
+from email.message import EmailMessage
+
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger("correo")
+
+# Sin SMTP_SERVIDOR no se envían correos
+SMTP_SERVIDOR = config("SMTP_SERVIDOR", default="")
+SMTP_PUERTO = config("SMTP_PUERTO", default=587, cast=int)
+SMTP_USUARIO = config("SMTP_USUARIO", default="")
+SMTP_CONTRA = config("SMTP_CONTRA", default="")
+SMTP_REMITENTE = config("SMTP_REMITENTE", default="no-responder@localhost")
+SMTP_TLS = config("SMTP_TLS", default=True, cast=bool)
+SMTP_TIEMPO_ESPERA = config("SMTP_TIEMPO_ESPERA", default=30, cast=int)
+
+
+def correo_configurado() -> bool:
+    return bool(SMTP_SERVIDOR)
+
+
+def _enviar(destino: str, asunto: str, cuerpo: str) -> None:
+    mensaje = EmailMessage()
+    mensaje["From"] = SMTP_REMITENTE
+    mensaje["To"] = destino
+    mensaje["Subject"] = asunto
+    mensaje.set_content(cuerpo)
+    with smtplib.SMTP(SMTP_SERVIDOR, SMTP_PUERTO, timeout=SMTP_TIEMPO_ESPERA) as servidor:
+        if SMTP_TLS:
+            servidor.starttls()
+        if SMTP_USUARIO:
+            servidor.login(SMTP_USUARIO, SMTP_CONTRA)
+        servidor.send_message(mensaje)
+
+
+async def enviar_correo(destino: str, asunto: str, cuerpo: str) -> bool:
+    """Envía un correo de texto. Devuelve False si no hay SMTP configurado."""
+    if not correo_configurado():
+        logger.warning(f"SMTP no configurado: no se envía el correo a {destino}")
+        return False
+    # smtplib es bloqueante: se ejecuta en el pool de hilos
+    await run_in_threadpool(_enviar, destino, asunto, cuerpo)
+    return True
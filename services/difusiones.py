@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from decouple import config
+from pymongo import ReturnDocument
+
+from config.db import conn
+from models.Notificacion import EstadoDifusion
+from services.notificaciones import guardar_notificaciones, nueva_notificacion
+
+logger = logging.getLogger("difusiones")
+
+# Notificaciones que se insertan con cada insert_many
+TAMANO_LOTE_DIFUSION = config("TAMANO_LOTE_DIFUSION", default=1000, cast=int)
+# Segundos entre búsquedas de difusiones pendientes si nadie despierta antes al motor
+INTERVALO_DIFUSIONES = config("INTERVALO_DIFUSIONES", default=30, cast=int)
+# Segundos que un trabajador se reserva una difusión; cada lote lo renueva
+DURACION_RECLAMO_DIFUSION = config("DURACION_RECLAMO_DIFUSION", default=300, cast=int)
+MAX_INTENTOS_DIFUSION = config("MAX_INTENTOS_DIFUSION", default=5, cast=int)
+
+DIFUSIONES = "difusiones"
+
+
+class DifusionRetomada(Exception):
+    """Otro trabajador se ha quedado con la difusión al vencer el reclamo."""
+
+
+def filtro_usuarios(segmento: dict) -> dict:
+    filtro = {"inactivo": {"$ne": True}}
+    for campo in ("rol", "pais", "ciudad"):
+        if segmento.get(campo):
+            filtro[campo] = segmento[campo]
+    return filtro
+
+
+def _compradores(segmento: dict, desde=None) -> list:
+    coincidencia = {"id_documento": segmento["documento_id"]}
+    if desde is not None:
+        # Los ids de cliente son el _id del usuario en hexadecimal: ordenan igual
+        coincidencia["id_cliente"] = {"$gt": str(desde)}
+    return [
+        {"$match": coincidencia},
+        {"$group": {"_id": "$id_cliente"}},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+async def contar_destinatarios(segmento: dict) -> int:
+    """
+    Usuarios del segmento. Si es de compradores de un documento se cuentan los
+    compradores distintos, aunque luego algunos no cumplan el resto de criterios.
+    """
+    if not segmento.get("documento_id"):
+        return await conn["usuarios"].count_documents(filtro_usuarios(segmento))
+    resultado = await conn["ventas"].aggregate(
+        [*_compradores(segmento), {"$count": "total"}], allowDiskUse=True
+    ).to_list(1)
+    return resultado[0]["total"] if resultado else 0
+
+
+async def destinatarios(segmento: dict, desde=None, tamano_lote: int = TAMANO_LOTE_DIFUSION):
+    """
+    Genera, en lotes de `tamano_lote` y por orden de _id, los ids de los
+    usuarios del segmento posteriores a `desde`. Los usuarios se leen con un
+    cursor, así que en memoria solo hay un lote cada vez.
+    """
+    filtro = filtro_usuarios(segmento)
+    if not segmento.get("documento_id"):
+        if desde is not None:
+            filtro["_id"] = {"$gt": desde}
+        cursor = conn["usuarios"].find(filtro, {"_id": 1}).sort("_id", 1)
+        cursor.batch_size(tamano_lote)
+        lote = []
+        async for usuario in cursor:
+            lote.append(usuario["_id"])
+            if len(lote) >= tamano_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+        return
+
+    # Compradores del documento: se recorren los clientes distintos de sus
+    # ventas y cada lote se cruza con los usuarios activos que cumplen el resto
+    cursor = conn["ventas"].aggregate(
+        _compradores(segmento, desde), allowDiskUse=True, batchSize=tamano_lote
+    )
+    clientes = []
+    async for grupo in cursor:
+        if ObjectId.is_valid(grupo["_id"]):
+            clientes.append(ObjectId(grupo["_id"]))
+        if len(clientes) >= tamano_lote:
+            lote = await _usuarios_de(clientes, filtro)
+            clientes = []
+            if lote:
+                yield lote
+    if clientes:
+        lote = await _usuarios_de(clientes, filtro)
+        if lote:
+            yield lote
+
+
+async def _usuarios_de(ids: List[ObjectId], filtro: dict) -> List[ObjectId]:
+    usuarios = await conn["usuarios"].find(
+        {**filtro, "_id": {"$in": ids}}, {"_id": 1}
+    ).sort("_id", 1).to_list(len(ids))
+    return [usuario["_id"] for usuario in usuarios]
+
+
+class MotorDifusiones:
+    """
+    Envía en segundo plano las difusiones de notificaciones a segmentos de
+    usuarios. Cada difusión se reclama con un `find_one_and_update` atómico y un
+    plazo (`reclamado_hasta`) que se renueva con cada lote, de modo que solo un
+    trabajador la procesa y, si cae, otro la retoma al vencer el plazo.
+
+    Las notificaciones llevan el `difusion_id` y los usuarios se recorren por
+    orden de _id, así que al retomar una difusión se continúa tras el último
+    usuario notificado en lugar de empezar de nuevo.
+    """
+
+    def __init__(self, intervalo: int, tamano_lote: int):
+        self.intervalo = intervalo
+        self.tamano_lote = tamano_lote
+        self.trabajador = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._despertar = asyncio.Event()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def _plazo(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=DURACION_RECLAMO_DIFUSION)
+
+    async def reclamar(self) -> Optional[dict]:
+        """Pasa a en_curso, de forma atómica, la difusión pendiente más antigua."""
+        ahora = datetime.now(timezone.utc)
+        return await conn[DIFUSIONES].find_one_and_update(
+            {"$or": [
+                {"estado": EstadoDifusion.PENDIENTE.value},
+                {"estado": EstadoDifusion.EN_CURSO.value, "reclamado_hasta": {"$lte": ahora}},
+            ]},
+            {"$set": {
+                "estado": EstadoDifusion.EN_CURSO.value,
+                "reclamado_por": self.trabajador,
+                "reclamado_hasta": self._plazo(),
+            }},
+            sort=[("fecha_creacion", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _actualizar(self, difusion: dict, cambios: dict, finalizar: bool = False) -> None:
+        # Solo se guarda si el reclamo sigue siendo de este trabajador
+        actualizacion = {"$set": cambios}
+        if finalizar:
+            actualizacion["$unset"] = {"reclamado_por": "", "reclamado_hasta": ""}
+        else:
+            actualizacion["$set"] = {**cambios, "reclamado_hasta": self._plazo()}
+        resultado = await conn[DIFUSIONES].update_one(
+            {"_id": difusion["_id"], "reclamado_por": self.trabajador}, actualizacion
+        )
+        if resultado.matched_count == 0:
+            raise DifusionRetomada(str(difusion["_id"]))
+
+    async def _reanudar(self, difusion: dict) -> Tuple[int, Optional[ObjectId]]:
+        # Las notificaciones ya creadas son el punto de control de la difusión
+        ultima = await conn["notificaciones"].find_one(
+            {"difusion_id": difusion["_id"]}, {"usuario_id": 1}, sort=[("usuario_id", -1)]
+        )
+        if ultima is None:
+            return 0, None
+        enviadas = await conn["notificaciones"].count_documents({"difusion_id": difusion["_id"]})
+        return enviadas, ultima["usuario_id"]
+
+    async def ejecutar(self, difusion: dict) -> bool:
+        """
+        Crea las notificaciones de una difusión ya reclamada, lote a lote.
+        Devuelve False si ha fallado y queda pendiente de reintento.
+        """
+        try:
+            enviadas, desde = await self._reanudar(difusion)
+            cambios = {"enviadas": enviadas}
+            if difusion.get("total") is None:
+                cambios["total"] = await contar_destinatarios(difusion["segmento"])
+            if difusion.get("fecha_inicio") is None:
+                cambios["fecha_inicio"] = datetime.now(timezone.utc)
+            await self._actualizar(difusion, cambios)
+
+            async for lote in destinatarios(difusion["segmento"], desde, self.tamano_lote):
+                notificaciones = [
+                    {
+                        **nueva_notificacion(
+                            usuario_id,
+                            difusion["tipo"],
+                            difusion["titulo"],
+                            difusion["mensaje"],
+                            difusion.get("documento_id"),
+                            difusion.get("accion_url"),
+                        ),
+                        "difusion_id": difusion["_id"],
+                    }
+                    for usuario_id in lote
+                ]
+                # En orden: si el lote falla, lo guardado es un prefijo y la
+                # reanudación desde el último usuario notificado no salta a nadie
+                enviadas += await guardar_notificaciones(notificaciones, ordenado=True)
+                await self._actualizar(difusion, {"enviadas": enviadas})
+
+            await self._actualizar(difusion, {
+                "estado": EstadoDifusion.COMPLETADA.value,
+                "enviadas": enviadas,
+                "fecha_fin": datetime.now(timezone.utc),
+                "error": None,
+            }, finalizar=True)
+        except DifusionRetomada:
+            logger.warning(f"La difusión {difusion['_id']} la ha retomado otro trabajador")
+        except asyncio.CancelledError:
+            await self._liberar(difusion)
+            raise
+        except Exception as e:
+            logger.error(f"Error enviando la difusión {difusion['_id']}: {str(e)}")
+            await self._registrar_fallo(difusion, e)
+            return False
+        return True
+
+    async def _registrar_fallo(self, difusion: dict, error: Exception) -> None:
+        # Se reintenta en la siguiente ronda, continuando donde se quedó
+        intentos = difusion.get("intentos", 0) + 1
+        estado = EstadoDifusion.PENDIENTE if intentos < MAX_INTENTOS_DIFUSION else EstadoDifusion.FALLIDA
+        cambios = {"estado": estado.value, "intentos": intentos, "error": str(error)}
+        if estado == EstadoDifusion.FALLIDA:
+            cambios["fecha_fin"] = datetime.now(timezone.utc)
+        try:
+            await self._actualizar(difusion, cambios, finalizar=True)
+        except Exception as e:
+            logger.error(f"Error registrando el fallo de la difusión {difusion['_id']}: {str(e)}")
+
+    async def _liberar(self, difusion: dict) -> None:
+        # Al detener el motor la difusión vuelve a quedar disponible
+        try:
+            await self._actualizar(difusion, {"estado": EstadoDifusion.PENDIENTE.value}, finalizar=True)
+        except Exception as e:
+            logger.error(f"Error liberando la difusión {difusion['_id']}: {str(e)}")
+
+    def despertar(self) -> None:
+        self._despertar.set()
+
+    async def _bucle(self) -> None:
+        while True:
+            self._despertar.clear()
+            try:
+                while (difusion := await self.reclamar()) is not None:
+                    if not await self.ejecutar(difusion):
+                        # El reintento espera a la siguiente ronda
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error buscando difusiones pendientes: {str(e)}")
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+
+motor_difusiones = MotorDifusiones(INTERVALO_DIFUSIONES, TAMANO_LOTE_DIFUSION)
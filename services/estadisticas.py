@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from bson import ObjectId
+from decouple import config
+
+from config.db import conn
+from services.analitica_ventas import VENTAS_POR_CLIENTE
+from services.contador_vistas import documentos_con_vistas
+
+logger = logging.getLogger("estadisticas")
+
+INTERVALO_DASHBOARD = config("INTERVALO_DASHBOARD", default=30, cast=int)
+TOP_DASHBOARD = 5
+RECIENTES_DASHBOARD = 8
+
+
+class InstantaneaCacheada:
+    """
+    Guarda el último resultado de un cálculo costoso y lo sirve a todas las
+    peticiones. Cuando caduca se sigue devolviendo el valor anterior mientras
+    se recalcula en segundo plano (stale-while-revalidate), y nunca hay más de
+    un cálculo en curso, de modo que cualquier número de lectores provoca como
+    mucho un cálculo por intervalo.
+    """
+
+    def __init__(self, calcular: Callable[[], Awaitable], intervalo: int):
+        self._calcular = calcular
+        self.intervalo = intervalo
+        self._valor = None
+        self._calculado = 0.0
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def _refrescar(self):
+        try:
+            valor = await self._calcular()
+            self._valor = valor
+            self._calculado = time.monotonic()
+            return valor
+        finally:
+            self._tarea = None
+
+    def _lanzar(self) -> asyncio.Task:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._refrescar())
+            self._tarea.add_done_callback(self._registrar_error)
+        return self._tarea
+
+    async def obtener(self):
+        if self._valor is None:
+            # Primera vez: no hay nada que servir y hay que esperar al cálculo
+            return await asyncio.shield(self._lanzar())
+
+        if time.monotonic() - self._calculado >= self.intervalo:
+            self._lanzar()
+        return self._valor
+
+    @staticmethod
+    def _registrar_error(tarea: asyncio.Task) -> None:
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.error(f"Error actualizando la instantánea: {str(tarea.exception())}")
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+
+def _fecha_de_id(documento_id) -> Optional[str]:
+    # Los documentos usan un ObjectId (o su texto) como _id: incluye la fecha de creación
+    try:
+        return ObjectId(str(documento_id)).generation_time.isoformat()
+    except Exception:
+        return None
+
+
+PIPELINE_DOCUMENTOS = [
+    {
+        "$facet": {
+            "total": [{"$count": "n"}],
+            "categorias": [
+                {"$group": {"_id": "$categoria", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 20},
+            ],
+            "idiomas": [
+                {"$group": {"_id": "$idioma", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 20},
+            ],
+            "recientes": [
+                {"$sort": {"_id": -1}},
+                {"$limit": RECIENTES_DASHBOARD},
+                {"$project": {"titulo": 1, "autor": 1}},
+            ],
+        }
+    }
+]
+
+
+async def calcular_estadisticas() -> dict:
+    """
+    Calcula los datos del dashboard con una sola agregación `$facet` sobre
+    `documentos`, el ranking de vistas y el agregado de ventas por cliente,
+    en paralelo.
+    """
+    facetas, mas_vistos, clientes = await asyncio.gather(
+        conn["documentos"].aggregate(PIPELINE_DOCUMENTOS).to_list(1),
+        documentos_con_vistas(TOP_DASHBOARD),
+        conn[VENTAS_POR_CLIENTE].find({}).sort("ventas", -1).limit(TOP_DASHBOARD).to_list(TOP_DASHBOARD),
+    )
+    facetas = facetas[0] if facetas else {}
+    total = facetas.get("total") or [{"n": 0}]
+
+    return {
+        "total_documentos": total[0]["n"],
+        "documentos_por_categoria": {
+            c["_id"]: c["count"] for c in facetas.get("categorias", []) if c["_id"]
+        },
+        "documentos_por_idioma": {
+            i["_id"]: i["count"] for i in facetas.get("idiomas", []) if i["_id"]
+        },
+        "documentos_mas_vistos": mas_vistos,
+        "usuarios_mas_activos": [
+            {
+                "id": c["_id"],
+                "nombre": c.get("nombre_cliente"),
+                "acciones": c.get("ventas", 0),
+                "unidades": c.get("unidades", 0),
+            }
+            for c in clientes
+        ],
+        "documentos_recientes": [
+            {
+                "id": str(d["_id"]),
+                "titulo": d.get("titulo", "Sin título"),
+                "autor": d.get("autor", "Sin autor"),
+                "fecha_creacion": _fecha_de_id(d["_id"]),
+            }
+            for d in facetas.get("recientes", [])
+        ],
+        "generado": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+estadisticas_dashboard = InstantaneaCacheada(calcular_estadisticas, INTERVALO_DASHBOARD)
@@ -0,0 +1,204 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bson import ObjectId
+from decouple import config
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él solo se exporta CSV
+    pa = None
+    pq = None
+
+# Filas leídas del cursor y codificadas de una vez
+TAMANO_LOTE_EXPORTACION = config("TAMANO_LOTE_EXPORTACION", default=2000, cast=int)
+
+# (campo, tipo) de cada columna exportada, en orden
+COLUMNAS_VENTAS: List[Tuple[str, str]] = [
+    ("_id", "texto"),
+    ("fecha", "fecha"),
+    ("id_cliente", "texto"),
+    ("nombre_cliente", "texto"),
+    ("id_documento", "texto"),
+    ("titulo_documento", "texto"),
+    ("tipo_de_adquisicion", "texto"),
+    ("cantidad", "entero"),
+    ("activo", "booleano"),
+]
+
+COLUMNAS_DOCUMENTOS: List[Tuple[str, str]] = [
+    ("_id", "texto"),
+    ("titulo", "texto"),
+    ("autor", "texto"),
+    ("tipo_documento", "texto"),
+    ("categoria", "texto"),
+    ("editorial", "texto"),
+    ("idioma", "texto"),
+    ("paginas", "entero"),
+    ("stock", "entero"),
+    ("precio", "entero"),
+    ("imagen", "texto"),
+    ("descripcion", "texto"),
+]
+
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrow"),
+}
+
+
+def _valor(valor, tipo: str):
+    if valor is None:
+        return None
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    try:
+        if tipo == "entero":
+            return int(valor)
+        if tipo == "booleano":
+            return bool(valor)
+        if tipo == "fecha":
+            return valor if isinstance(valor, datetime) else None
+    except (TypeError, ValueError):
+        return None
+    return str(valor)
+
+
+class CodificadorCSV:
+    def __init__(self, columnas, comprimir: bool):
+        self.columnas = columnas
+        # wbits=31 produce un flujo gzip completo que se puede escribir por partes
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+        self._cabecera = True
+
+    def _comprimir(self, datos: bytes) -> bytes:
+        return self._gzip.compress(datos) if self._gzip else datos
+
+    def lote(self, documentos: List[dict]) -> bytes:
+        salida = io.StringIO()
+        escritor = csv.writer(salida)
+        if self._cabecera:
+            escritor.writerow([campo for campo, _ in self.columnas])
+            self._cabecera = False
+        for documento in documentos:
+            fila = []
+            for campo, tipo in self.columnas:
+                valor = _valor(documento.get(campo), tipo)
+                fila.append(valor.isoformat() if isinstance(valor, datetime) else valor)
+            escritor.writerow(fila)
+        return self._comprimir(salida.getvalue().encode("utf-8"))
+
+    def cerrar(self) -> bytes:
+        # Sin filas se exporta al menos la cabecera
+        datos = self.lote([]) if self._cabecera else b""
+        return datos + self._gzip.flush() if self._gzip else datos
+
+
+class SumideroBytes(io.RawIOBase):
+    """Archivo de solo escritura que acumula lo escrito hasta que se recoge."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        datos = bytes(datos)
+        self._partes.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def recoger(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+class CodificadorArrow:
+    """Escribe Parquet (un row group por lote) o un stream IPC de Arrow."""
+
+    TIPOS = {
+        "texto": lambda: pa.string(),
+        "entero": lambda: pa.int64(),
+        "booleano": lambda: pa.bool_(),
+        "fecha": lambda: pa.timestamp("ms", tz="UTC"),
+    }
+
+    def __init__(self, columnas, formato: str):
+        self.columnas = columnas
+        self.esquema = pa.schema([(campo, self.TIPOS[tipo]()) for campo, tipo in columnas])
+        self._sumidero = SumideroBytes()
+        if formato == "parquet":
+            self._escritor = pq.ParquetWriter(self._sumidero, self.esquema, compression="snappy")
+        else:
+            self._escritor = pa.ipc.new_stream(self._sumidero, self.esquema)
+
+    def lote(self, documentos: List[dict]) -> bytes:
+        datos = {
+            campo: [_valor(documento.get(campo), tipo) for documento in documentos]
+            for campo, tipo in self.columnas
+        }
+        self._escritor.write_table(pa.Table.from_pydict(datos, schema=self.esquema))
+        return self._sumidero.recoger()
+
+    def cerrar(self) -> bytes:
+        self._escritor.close()
+        return self._sumidero.recoger()
+
+
+def crear_codificador(formato: str, columnas, comprimir: bool = False):
+    if formato == "csv":
+        return CodificadorCSV(columnas, comprimir)
+    if pa is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El formato {formato} requiere instalar pyarrow",
+        )
+    return CodificadorArrow(columnas, formato)
+
+
+async def exportar(cursor, codificador, tamano_lote: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    Recorre el cursor por lotes y entrega cada lote ya codificado, de modo que
+    la memoria usada no depende del número de filas y la respuesta empieza en
+    cuanto llega el primer lote de MongoDB.
+    """
+    tamano_lote = tamano_lote or TAMANO_LOTE_EXPORTACION
+    cursor.batch_size(tamano_lote)
+    lote = []
+    async for documento in cursor:
+        lote.append(documento)
+        if len(lote) >= tamano_lote:
+            # Codificar y comprimir usa CPU: se hace fuera del bucle de eventos
+            yield await run_in_threadpool(codificador.lote, lote)
+            lote = []
+    if lote:
+        yield await run_in_threadpool(codificador.lote, lote)
+    yield await run_in_threadpool(codificador.cerrar)
+
+
+def respuesta_exportacion(
+    cursor, columnas, formato: str, comprimir: bool, nombre: str
+) -> StreamingResponse:
+    tipo_mime, extension = FORMATOS[formato]
+    codificador = crear_codificador(formato, columnas, comprimir and formato == "csv")
+    cabeceras = {}
+    if comprimir and formato == "csv":
+        # Se descarga como .csv.gz: no se usa Content-Encoding para que el
+        # cliente no lo descomprima por su cuenta
+        tipo_mime, extension = "application/gzip", ".csv.gz"
+    cabeceras["Content-Disposition"] = f'attachment; filename="{nombre}{extension}"'
+    return StreamingResponse(exportar(cursor, codificador), media_type=tipo_mime, headers=cabeceras)
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, List
+
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+
+from services.almacenamiento_imagenes import almacenamiento, nombre_de_url
+from services.exportacion_datos import SumideroBytes
+from services.exportadores import cache_artefactos, nombre_archivo
+
+logger = logging.getLogger("exportacion_lote")
+
+# Documentos leídos del cursor y preparados a la vez
+TAMANO_LOTE_ZIP = config("TAMANO_LOTE_ZIP", default=50, cast=int)
+# Exportaciones generándose en paralelo como máximo
+CONCURRENCIA_EXPORTACION = config("CONCURRENCIA_EXPORTACION", default=4, cast=int)
+TAMANO_LECTURA = 256 * 1024
+
+
+class ArchivoZipEnFlujo:
+    """
+    ZIP escrito sobre un sumidero sin posicionamiento: zipfile usa entonces
+    descriptores de datos tras cada entrada y nunca retrocede, así que cada
+    parte escrita se puede enviar al cliente en cuanto se genera.
+    """
+
+    def __init__(self):
+        self._sumidero = SumideroBytes()
+        self._zip = zipfile.ZipFile(self._sumidero, "w", compression=zipfile.ZIP_DEFLATED)
+        self._nombres = set()
+
+    def nombre_unico(self, nombre: str) -> str:
+        base, punto, extension = nombre.rpartition(".")
+        candidato, n = nombre, 1
+        while candidato in self._nombres:
+            n += 1
+            candidato = f"{base}_{n}{punto}{extension}" if punto else f"{nombre}_{n}"
+        self._nombres.add(candidato)
+        return candidato
+
+    def abrir(self, nombre: str, comprimir: bool = True):
+        info = zipfile.ZipInfo(self.nombre_unico(nombre), time.localtime()[:6])
+        # Las imágenes ya están comprimidas: se guardan tal cual
+        info.compress_type = zipfile.ZIP_DEFLATED if comprimir else zipfile.ZIP_STORED
+        return self._zip.open(info, "w")
+
+    def escribir_texto(self, nombre: str, texto: str) -> None:
+        with self.abrir(nombre) as destino:
+            destino.write(texto.encode("utf-8"))
+
+    def recoger(self) -> bytes:
+        return self._sumidero.recoger()
+
+    def cerrar(self) -> bytes:
+        self._zip.close()
+        return self.recoger()
+
+
+async def _preparar(documento: dict, formato: str, semaforo: asyncio.Semaphore) -> Path:
+    async with semaforo:
+        return await cache_artefactos.obtener(documento, formato)
+
+
+async def _copiar_archivo(archivo_zip: ArchivoZipEnFlujo, nombre: str, ruta: Path) -> AsyncIterator[bytes]:
+    destino = await run_in_threadpool(archivo_zip.abrir, nombre)
+    try:
+        with open(ruta, "rb") as origen:
+            while True:
+                fragmento = await run_in_threadpool(origen.read, TAMANO_LECTURA)
+                if not fragmento:
+                    break
+                await run_in_threadpool(destino.write, fragmento)
+                yield archivo_zip.recoger()
+    finally:
+        await run_in_threadpool(destino.close)
+    yield archivo_zip.recoger()
+
+
+async def _copiar_imagen(archivo_zip: ArchivoZipEnFlujo, carpeta: str, documento: dict) -> AsyncIterator[bytes]:
+    nombre = nombre_de_url(documento.get("imagen"))
+    if nombre is None or await almacenamiento.metadatos(nombre) is None:
+        return
+    extension = Path(nombre).suffix
+    destino = await run_in_threadpool(archivo_zip.abrir, f"{carpeta}/portada{extension}", False)
+    try:
+        async for fragmento in almacenamiento.flujo(nombre):
+            await run_in_threadpool(destino.write, fragmento)
+            yield archivo_zip.recoger()
+    finally:
+        await run_in_threadpool(destino.close)
+    yield archivo_zip.recoger()
+
+
+async def _escribir_lote(
+    archivo_zip: ArchivoZipEnFlujo,
+    documentos: List[dict],
+    formato: str,
+    incluir_imagenes: bool,
+    semaforo: asyncio.Semaphore,
+    errores: List[str],
+) -> AsyncIterator[bytes]:
+    # Las exportaciones del lote se generan en paralelo; después se añaden
+    # al ZIP en orden, que es secuencial por naturaleza
+    rutas = await asyncio.gather(
+        *[_preparar(documento, formato, semaforo) for documento in documentos],
+        return_exceptions=True,
+    )
+    for documento, ruta in zip(documentos, rutas):
+        if isinstance(ruta, BaseException):
+            logger.error(f"Error exportando el documento {documento['_id']}: {str(ruta)}")
+            errores.append(f"{documento['_id']}: {str(ruta)}")
+            continue
+
+        nombre = nombre_archivo(documento, formato)
+        carpeta = f"{nombre.rsplit('.', 1)[0]}_{str(documento['_id'])[-6:]}"
+        async for parte in _copiar_archivo(archivo_zip, f"{carpeta}/{nombre}", ruta):
+            if parte:
+                yield parte
+        if incluir_imagenes:
+            async for parte in _copiar_imagen(archivo_zip, carpeta, documento):
+                if parte:
+                    yield parte
+
+
+async def exportar_zip(cursor, formato: str, incluir_imagenes: bool = True) -> AsyncIterator[bytes]:
+    """
+    Genera un ZIP con la exportación de cada documento del cursor y su portada.
+    Los documentos se leen por lotes y el archivo se envía a medida que se
+    escribe, así que nunca está completo en memoria.
+    """
+    archivo_zip = ArchivoZipEnFlujo()
+    semaforo = asyncio.Semaphore(CONCURRENCIA_EXPORTACION)
+    errores: List[str] = []
+    cursor.batch_size(TAMANO_LOTE_ZIP)
+
+    lote: List[dict] = []
+    async for documento in cursor:
+        lote.append(documento)
+        if len(lote) >= TAMANO_LOTE_ZIP:
+            async for parte in _escribir_lote(archivo_zip, lote, formato, incluir_imagenes, semaforo, errores):
+                yield parte
+            lote = []
+    if lote:
+        async for parte in _escribir_lote(archivo_zip, lote, formato, incluir_imagenes, semaforo, errores):
+            yield parte
+
+    if errores:
+        await run_in_threadpool(archivo_zip.escribir_texto, "errores.txt", "\n".join(errores) + "\n")
+    yield await run_in_threadpool(archivo_zip.cerrar)
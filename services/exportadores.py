@@ -0,0 +1,318 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from decouple import config
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+except ImportError:  # reportlab es opcional: sin él no se exporta a PDF
+    SimpleDocTemplate = None
+
+try:
+    import docx
+except ImportError:  # python-docx es opcional: sin él no se exporta a DOCX
+    docx = None
+
+logger = logging.getLogger("exportadores")
+
+DIRECTORIO_EXPORTACIONES = Path(
+    str(config("DIRECTORIO_EXPORTACIONES", default="exportaciones"))
+).absolute()
+PROCESOS_EXPORTACION = config("PROCESOS_EXPORTACION", default=2, cast=int)
+# Tamaño máximo en bytes de la caché de exportaciones; al superarlo se borran
+# las usadas hace más tiempo
+TAMANO_CACHE_EXPORTACIONES = config(
+    "TAMANO_CACHE_EXPORTACIONES", default=512 * 1024 * 1024, cast=int
+)
+
+# Campos del documento incluidos en la exportación, en orden
+CAMPOS_EXPORTADOS = [
+    ("titulo", "Título"),
+    ("autor", "Autor"),
+    ("tipo_documento", "Tipo de documento"),
+    ("categoria", "Categoría"),
+    ("editorial", "Editorial"),
+    ("idioma", "Idioma"),
+    ("paginas", "Páginas"),
+    ("precio", "Precio"),
+    ("imagen", "Imagen"),
+    ("descripcion", "Descripción"),
+]
+
+
+def _datos_exportables(documento: dict) -> Dict[str, str]:
+    return {
+        "id": str(documento.get("_id")),
+        **{campo: "" if documento.get(campo) is None else str(documento.get(campo))
+           for campo, _ in CAMPOS_EXPORTADOS},
+    }
+
+
+# Formatos ligeros: se generan por partes en el propio worker
+
+
+def generar_json(documento: dict) -> Iterator[bytes]:
+    # Solo los campos exportados, como en el resto de formatos: el stock y otros
+    # campos que cambian sin subir la versión dejarían la caché desactualizada
+    datos = {"id": str(documento.get("_id"))}
+    datos.update({campo: documento.get(campo) for campo, _ in CAMPOS_EXPORTADOS})
+    yield json.dumps(datos, ensure_ascii=False, indent=2, default=str).encode("utf-8")
+
+
+def generar_csv(documento: dict) -> Iterator[bytes]:
+    datos = _datos_exportables(documento)
+    for fila in (list(datos.keys()), list(datos.values())):
+        salida = io.StringIO()
+        csv.writer(salida).writerow(fila)
+        yield salida.getvalue().encode("utf-8")
+
+
+def generar_xml(documento: dict) -> Iterator[bytes]:
+    datos = _datos_exportables(documento)
+    yield b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<documento id="{escape(datos.pop("id"))}">\n'.encode("utf-8")
+    for campo, valor in datos.items():
+        yield f"  <{campo}>{escape(valor)}</{campo}>\n".encode("utf-8")
+    yield b"</documento>\n"
+
+
+def generar_txt(documento: dict) -> Iterator[bytes]:
+    datos = _datos_exportables(documento)
+    for campo, etiqueta in CAMPOS_EXPORTADOS:
+        if campo == "descripcion":
+            yield f"\n{etiqueta}:\n{datos[campo]}\n".encode("utf-8")
+        else:
+            yield f"{etiqueta}: {datos[campo]}\n".encode("utf-8")
+
+
+# Formatos costosos: se generan completos en un proceso del pool
+
+
+def renderizar_pdf(datos: Dict[str, str]) -> bytes:
+    salida = io.BytesIO()
+    estilos = getSampleStyleSheet()
+    contenido = [Paragraph(escape(datos["titulo"] or "Documento"), estilos["Title"])]
+    for campo, etiqueta in CAMPOS_EXPORTADOS[1:]:
+        if campo == "descripcion":
+            contenido.append(Spacer(1, 12))
+            contenido.append(Paragraph(escape(datos[campo]).replace("\n", "<br/>"), estilos["BodyText"]))
+        else:
+            contenido.append(Paragraph(f"<b>{etiqueta}:</b> {escape(datos[campo])}", estilos["Normal"]))
+    SimpleDocTemplate(salida, pagesize=A4, title=datos["titulo"]).build(contenido)
+    return salida.getvalue()
+
+
+def renderizar_docx(datos: Dict[str, str]) -> bytes:
+    archivo = docx.Document()
+    archivo.core_properties.title = datos["titulo"]
+    archivo.add_heading(datos["titulo"] or "Documento", level=0)
+    for campo, etiqueta in CAMPOS_EXPORTADOS[1:]:
+        if campo == "descripcion":
+            archivo.add_paragraph(datos[campo])
+        else:
+            parrafo = archivo.add_paragraph()
+            parrafo.add_run(f"{etiqueta}: ").bold = True
+            parrafo.add_run(datos[campo])
+    salida = io.BytesIO()
+    archivo.save(salida)
+    return salida.getvalue()
+
+
+class Formato:
+    def __init__(
+        self,
+        tipo_mime: str,
+        generar: Optional[Callable[[dict], Iterator[bytes]]] = None,
+        renderizar: Optional[Callable[[Dict[str, str]], bytes]] = None,
+        disponible: bool = True,
+        requisito: str = "",
+    ):
+        self.tipo_mime = tipo_mime
+        self.generar = generar
+        self.renderizar = renderizar
+        self.disponible = disponible
+        self.requisito = requisito
+
+
+FORMATOS: Dict[str, Formato] = {
+    "json": Formato("application/json", generar=generar_json),
+    "csv": Formato("text/csv; charset=utf-8", generar=generar_csv),
+    "xml": Formato("application/xml", generar=generar_xml),
+    "txt": Formato("text/plain; charset=utf-8", generar=generar_txt),
+    "pdf": Formato(
+        "application/pdf",
+        renderizar=renderizar_pdf,
+        disponible=SimpleDocTemplate is not None,
+        requisito="reportlab",
+    ),
+    "docx": Formato(
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        renderizar=renderizar_docx,
+        disponible=docx is not None,
+        requisito="python-docx",
+    ),
+}
+
+
+def formato_valido(formato: str) -> Formato:
+    definicion = FORMATOS.get(formato.lower())
+    if definicion is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Formato no soportado. Formatos válidos: {', '.join(FORMATOS)}",
+        )
+    if not definicion.disponible:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"El formato {formato} requiere instalar {definicion.requisito}",
+        )
+    return definicion
+
+
+def nombre_archivo(documento: dict, formato: str) -> str:
+    titulo = re.sub(r"[^\w\-]+", "_", str(documento.get("titulo") or "documento")).strip("_")
+    return f"{titulo or 'documento'}.{formato}"
+
+
+class CacheArtefactos:
+    """
+    Guarda en disco cada exportación generada, identificada por (id del
+    documento, versión, formato). Como la versión cambia al modificar el
+    documento, una entrada nunca queda desactualizada: las exportaciones
+    repetidas se sirven desde el archivo sin volver a generarlas.
+
+    El directorio se limita a `tamano_maximo` bytes como una LRU: cada acierto
+    actualiza la fecha de modificación del archivo y, tras guardar uno nuevo,
+    se borran los de fecha más antigua hasta volver por debajo del límite. La
+    fecha está en el propio archivo, así que vale con varios workers.
+    """
+
+    def __init__(self, directorio: Path, procesos: int, tamano_maximo: int):
+        self.directorio = directorio
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.tamano_maximo = tamano_maximo
+        self._procesos = procesos
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Se crea al primer uso para no lanzar procesos si nadie exporta a PDF o DOCX
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._procesos)
+        return self._pool
+
+    def ruta(self, documento: dict, formato: str) -> Path:
+        documento_id = re.sub(r"[^\w\-]", "_", str(documento["_id"]))
+        return self.directorio / f"{documento_id}_v{documento.get('version', 0)}.{formato}"
+
+    def existente(self, documento: dict, formato: str) -> Optional[Path]:
+        ruta = self.ruta(documento, formato)
+        try:
+            # Marca la exportación como usada recientemente
+            os.utime(ruta)
+        except OSError:
+            return None
+        return ruta
+
+    def _recortar(self, conservar: Path) -> None:
+        # `conservar` es la exportación recién guardada, que se va a servir
+        archivos = []
+        for ruta in self.directorio.iterdir():
+            if ruta.suffix == ".tmp" or ruta == conservar:
+                continue
+            try:
+                estado = ruta.stat()
+            except OSError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+
+        total = sum(tamano for _, tamano, _ in archivos) + conservar.stat().st_size
+        for _, tamano, ruta in sorted(archivos, key=lambda archivo: archivo[0]):
+            if total <= self.tamano_maximo:
+                break
+            try:
+                ruta.unlink()
+            except OSError as e:
+                logger.error(f"Error eliminando la exportación {ruta}: {str(e)}")
+                continue
+            total -= tamano
+
+    def _temporal(self):
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        return os.fdopen(descriptor, "wb"), temporal
+
+    async def generar(self, documento: dict, formato: str) -> AsyncIterator[bytes]:
+        """
+        Entrega la exportación por partes mientras la copia en disco. El archivo
+        solo pasa a la caché si la generación termina completa.
+        """
+        definicion = formato_valido(formato)
+        archivo, temporal = await run_in_threadpool(self._temporal)
+        try:
+            if definicion.renderizar is not None:
+                partes = [await self._renderizar(definicion, documento)]
+            else:
+                partes = definicion.generar(documento)
+            for parte in partes:
+                await run_in_threadpool(archivo.write, parte)
+                yield parte
+            await run_in_threadpool(archivo.close)
+            destino = self.ruta(documento, formato)
+            await run_in_threadpool(os.replace, temporal, destino)
+            await run_in_threadpool(self._recortar, destino)
+        finally:
+            if not archivo.closed:
+                archivo.close()
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+    async def _renderizar(self, definicion: Formato, documento: dict) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool, definicion.renderizar, _datos_exportables(documento)
+        )
+
+    async def obtener(self, documento: dict, formato: str) -> Path:
+        """Devuelve la ruta de la exportación, generándola si aún no existe."""
+        ruta = self.existente(documento, formato)
+        if ruta is not None:
+            return ruta
+        async for _ in self.generar(documento, formato):
+            pass
+        return self.ruta(documento, formato)
+
+    def _descartar(self, documento_id) -> None:
+        prefijo = re.sub(r"[^\w\-]", "_", str(documento_id))
+        for ruta in self.directorio.glob(f"{prefijo}_v*"):
+            try:
+                ruta.unlink()
+            except OSError as e:
+                logger.error(f"Error eliminando la exportación {ruta}: {str(e)}")
+
+    async def descartar(self, documento_id) -> None:
+        """Elimina las exportaciones de un documento modificado o borrado."""
+        await run_in_threadpool(self._descartar, documento_id)
+
+    def detener(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+cache_artefactos = CacheArtefactos(
+    DIRECTORIO_EXPORTACIONES, PROCESOS_EXPORTACION, TAMANO_CACHE_EXPORTACIONES
+)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from decouple import config
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+
+from config.db import conn
+
+logger = logging.getLogger("inventario")
+
+MINUTOS_RESERVA_PRESTAMO = config("MINUTOS_RESERVA_PRESTAMO", default=15, cast=int)
+INTERVALO_LIBERAR_RESERVAS = config("INTERVALO_LIBERAR_RESERVAS", default=30, cast=int)
+
+# Campos del documento que se copian en la venta
+CAMPOS_DOCUMENTO_VENTA = {"titulo": 1, "imagen": 1, "stock": 1}
+
+
+async def descontar_stock(id_documento: str, cantidad: int) -> dict:
+    """
+    Descuenta `cantidad` del stock solo si hay unidades suficientes. La condición
+    y el decremento son una única operación atómica en MongoDB, así que dos
+    compras simultáneas nunca pueden dejar el stock en negativo.
+    """
+    documento = await conn["documentos"].find_one_and_update(
+        {"_id": id_documento, "stock": {"$gte": cantidad}},
+        {"$inc": {"stock": -cantidad}},
+        projection=CAMPOS_DOCUMENTO_VENTA,
+        return_document=ReturnDocument.AFTER,
+    )
+    if documento is not None:
+        return documento
+
+    if await conn["documentos"].find_one({"_id": id_documento}, {"_id": 1}) is None:
+        raise HTTPException(
+            status_code=404, detail=f"documento con id {id_documento} no encontrado"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Stock insuficiente para el documento {id_documento}",
+    )
+
+
+async def devolver_stock(id_documento: str, cantidad: int) -> None:
+    await conn["documentos"].update_one({"_id": id_documento}, {"$inc": {"stock": cantidad}})
+
+
+async def descontar_varios(cantidades: Dict[str, int]) -> Dict[str, dict]:
+    """
+    Descuenta el stock de varios documentos a la vez. Si alguno no tiene
+    unidades suficientes se devuelven las ya descontadas (compensación) y se
+    propaga el error, de modo que el pedido se aplica completo o no se aplica.
+    """
+    resultados = await asyncio.gather(
+        *[descontar_stock(id_documento, cantidad) for id_documento, cantidad in cantidades.items()],
+        return_exceptions=True,
+    )
+
+    descontados = {}
+    error = None
+    for id_documento, resultado in zip(cantidades, resultados):
+        if isinstance(resultado, BaseException):
+            error = error or resultado
+        else:
+            descontados[id_documento] = resultado
+
+    if error is not None:
+        await asyncio.gather(
+            *[devolver_stock(id_documento, cantidades[id_documento]) for id_documento in descontados]
+        )
+        raise error
+    return descontados
+
+
+async def crear_reserva(id_documento: str, cantidad: int, id_cliente: str, nombre_cliente: str) -> dict:
+    """Aparta unidades para un préstamo durante MINUTOS_RESERVA_PRESTAMO."""
+    documento = await descontar_stock(id_documento, cantidad)
+    ahora = datetime.now(timezone.utc)
+    reserva = {
+        "id_documento": id_documento,
+        "titulo_documento": documento.get("titulo"),
+        "imagen": documento.get("imagen"),
+        "id_cliente": id_cliente,
+        "nombre_cliente": nombre_cliente,
+        "cantidad": cantidad,
+        "estado": "pendiente",
+        "fecha": ahora,
+        "expira": ahora + timedelta(minutes=MINUTOS_RESERVA_PRESTAMO),
+    }
+    try:
+        await conn["reservas"].insert_one(reserva)
+    except Exception:
+        await devolver_stock(id_documento, cantidad)
+        raise
+    return reserva
+
+
+async def cerrar_reserva(filtro: dict, estado: str) -> Optional[dict]:
+    """
+    Pasa una reserva pendiente a `estado`. El cambio es atómico, por lo que una
+    reserva solo se confirma, cancela o libera una vez aunque haya carreras.
+    """
+    return await conn["reservas"].find_one_and_update(
+        {**filtro, "estado": "pendiente"},
+        {"$set": {"estado": estado, "cerrada": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def reabrir_reserva(reserva: dict) -> None:
+    """
+    Devuelve a pendiente una reserva confirmada cuya venta no llegó a guardarse,
+    para que sus unidades no se pierdan: se puede volver a confirmar o, si
+    caduca, el liberador las devuelve al stock.
+    """
+    await conn["reservas"].update_one(
+        {"_id": reserva["_id"], "estado": reserva["estado"]},
+        {"$set": {"estado": "pendiente"}, "$unset": {"cerrada": ""}},
+    )
+
+
+class LiberadorReservas:
+    """Devuelve al stock las unidades de las reservas de préstamo caducadas."""
+
+    def __init__(self, intervalo: int):
+        self.intervalo = intervalo
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def liberar_caducadas(self) -> int:
+        liberadas = 0
+        while True:
+            reserva = await cerrar_reserva(
+                {"expira": {"$lte": datetime.now(timezone.utc)}}, "caducada"
+            )
+            if reserva is None:
+                return liberadas
+            await devolver_stock(reserva["id_documento"], reserva["cantidad"])
+            liberadas += 1
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                liberadas = await self.liberar_caducadas()
+                if liberadas:
+                    logger.info(f"Reservas caducadas liberadas: {liberadas}")
+            except Exception as e:
+                logger.error(f"Error liberando reservas: {str(e)}")
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+
+def agrupar_items(items: List[dict]) -> Dict[str, int]:
+    cantidades: Dict[str, int] = {}
+    for item in items:
+        cantidades[item["id_documento"]] = cantidades.get(item["id_documento"], 0) + item["cantidad"]
+    return cantidades
+
+
+liberador_reservas = LiberadorReservas(INTERVALO_LIBERAR_RESERVAS)
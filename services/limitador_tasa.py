@@ -0,0 +1,329 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from decouple import config
+from pymongo import UpdateOne
+from starlette.responses import JSONResponse
+
+from config.db import conn
+
+logger = logging.getLogger("limitador_tasa")
+
+# Los buckets sin uso durante este tiempo están llenos: se pueden descartar
+TIEMPO_INACTIVIDAD = config("LIMITE_TIEMPO_INACTIVIDAD", default=600, cast=int)
+MAXIMO_CLAVES = config("LIMITE_MAXIMO_CLAVES", default=100000, cast=int)
+# Las IP pueden agrupar a varios usuarios (NAT), su límite es proporcionalmente mayor
+MULTIPLICADOR_IP = config("LIMITE_MULTIPLICADOR_IP", default=3, cast=int)
+SINCRONIZAR_MONGO = config("LIMITE_SINCRONIZAR_MONGO", default=False, cast=bool)
+INTERVALO_SINCRONIZACION = config("LIMITE_INTERVALO_SINCRONIZACION", default=2, cast=int)
+VENTANA_SINCRONIZACION = 60
+# Los formularios más grandes no se leen para buscar la cuenta
+MAXIMO_CUERPO_FORMULARIO = 16 * 1024
+
+
+class Bucket:
+    __slots__ = ("tokens", "ultimo", "pendiente", "visto", "ventana")
+
+    def __init__(self, capacidad: float, ahora: float):
+        self.tokens = capacidad
+        self.ultimo = ahora
+        # Consumo local aún no enviado a MongoDB y total global conocido
+        self.pendiente = 0
+        self.visto = 0
+        self.ventana = None
+
+
+class GrupoLimite:
+    """
+    Límite de un grupo de rutas: token bucket por clave (usuario o IP) y un
+    máximo de peticiones simultáneas para todo el grupo.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        por_minuto: int,
+        rafaga: int,
+        concurrencia: int,
+        rutas: Tuple[str, ...] = (),
+        prefijos: Tuple[str, ...] = (),
+        metodos: Optional[Tuple[str, ...]] = None,
+        campo_cuenta: Optional[str] = None,
+    ):
+        self.nombre = nombre
+        self.tasa = por_minuto / 60
+        self.rafaga = rafaga
+        self.concurrencia = concurrencia
+        self.rutas = rutas
+        self.prefijos = prefijos
+        self.metodos = metodos
+        # Campo del formulario que identifica la cuenta en rutas sin token, como el login
+        self.campo_cuenta = campo_cuenta
+        self.en_curso = 0
+        self.buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+
+    def coincide(self, ruta: str, metodo: str) -> bool:
+        if self.metodos is not None and metodo not in self.metodos:
+            return False
+        return ruta in self.rutas or ruta.startswith(self.prefijos)
+
+    def _bucket(self, clave: str, capacidad: float, ahora: float) -> Bucket:
+        bucket = self.buckets.get(clave)
+        if bucket is None:
+            bucket = Bucket(capacidad, ahora)
+            self.buckets[clave] = bucket
+        else:
+            self.buckets.move_to_end(clave)
+        return bucket
+
+    def _desalojar(self, ahora: float) -> None:
+        # Los buckets están ordenados por último uso: basta con mirar el principio
+        while self.buckets:
+            clave, bucket = next(iter(self.buckets.items()))
+            if len(self.buckets) <= MAXIMO_CLAVES and ahora - bucket.ultimo < TIEMPO_INACTIVIDAD:
+                break
+            if bucket.pendiente:
+                break
+            del self.buckets[clave]
+
+    def consumir(self, claves: List[Tuple[str, int]]) -> float:
+        """
+        Consume un token de cada clave. Devuelve 0 si se admite la petición o
+        los segundos que hay que esperar si alguna clave no tiene tokens.
+        """
+        ahora = time.monotonic()
+        buckets = []
+        espera = 0.0
+
+        for clave, multiplicador in claves:
+            capacidad = self.rafaga * multiplicador
+            tasa = self.tasa * multiplicador
+            bucket = self._bucket(clave, capacidad, ahora)
+            bucket.tokens = min(capacidad, bucket.tokens + (ahora - bucket.ultimo) * tasa)
+            bucket.ultimo = ahora
+            if bucket.tokens < 1:
+                espera = max(espera, (1 - bucket.tokens) / tasa)
+            buckets.append(bucket)
+
+        if espera == 0:
+            for bucket in buckets:
+                bucket.tokens -= 1
+                if SINCRONIZAR_MONGO:
+                    bucket.pendiente += 1
+
+        self._desalojar(ahora)
+        return espera
+
+    def admitir(self) -> bool:
+        if self.en_curso >= self.concurrencia:
+            return False
+        self.en_curso += 1
+        return True
+
+    def liberar(self) -> None:
+        self.en_curso -= 1
+
+
+def crear_grupo(nombre: str, por_minuto: int, rafaga: int, concurrencia: int, **opciones) -> GrupoLimite:
+    prefijo = f"LIMITE_{nombre.upper()}"
+    return GrupoLimite(
+        nombre,
+        por_minuto=config(f"{prefijo}_POR_MINUTO", default=por_minuto, cast=int),
+        rafaga=config(f"{prefijo}_RAFAGA", default=rafaga, cast=int),
+        concurrencia=config(f"{prefijo}_CONCURRENCIA", default=concurrencia, cast=int),
+        **opciones,
+    )
+
+
+class LimitadorTasa:
+    def __init__(self, grupos: List[GrupoLimite]):
+        self.grupos = grupos
+        self._tarea: Optional[asyncio.Task] = None
+
+    def grupo_para(self, ruta: str, metodo: str) -> Optional[GrupoLimite]:
+        for grupo in self.grupos:
+            if grupo.coincide(ruta, metodo):
+                return grupo
+        return None
+
+    @staticmethod
+    def claves(scope) -> List[Tuple[str, int]]:
+        claves = []
+        cliente = scope.get("client")
+        if cliente:
+            claves.append((f"ip:{cliente[0]}", MULTIPLICADOR_IP))
+
+        for nombre, valor in scope.get("headers", []):
+            if nombre == b"authorization":
+                # El token identifica al usuario sin necesidad de decodificarlo
+                claves.append((f"token:{hashlib.sha256(valor).hexdigest()[:32]}", 1))
+                break
+        return claves
+
+    async def sincronizar(self) -> None:
+        """
+        Envía a MongoDB el consumo pendiente de todas las claves con un solo
+        bulk_write y lee con una sola consulta lo que otros workers han
+        consumido de las claves usadas en la última ventana.
+        """
+        ahora = time.monotonic()
+        ventana = int(time.time() // VENTANA_SINCRONIZACION)
+        activos = []
+        for grupo in self.grupos:
+            for clave, bucket in list(grupo.buckets.items()):
+                if not bucket.pendiente and ahora - bucket.ultimo >= VENTANA_SINCRONIZACION:
+                    continue
+                if bucket.ventana != ventana:
+                    bucket.ventana = ventana
+                    bucket.visto = 0
+                activos.append((f"{grupo.nombre}|{clave}|{ventana}", bucket, bucket.pendiente))
+                bucket.pendiente = 0
+        if not activos:
+            return
+
+        expira = datetime.now(timezone.utc) + timedelta(seconds=VENTANA_SINCRONIZACION * 2)
+        escrituras = [
+            UpdateOne(
+                {"_id": contador_id},
+                {"$inc": {"n": pendiente}, "$setOnInsert": {"expira": expira}},
+                upsert=True,
+            )
+            for contador_id, _, pendiente in activos
+            if pendiente
+        ]
+        if escrituras:
+            await conn["limites_tasa"].bulk_write(escrituras, ordered=False)
+        contadores = {
+            contador["_id"]: contador["n"]
+            async for contador in conn["limites_tasa"].find(
+                {"_id": {"$in": [contador_id for contador_id, _, _ in activos]}}, {"n": 1}
+            )
+        }
+
+        for contador_id, bucket, pendiente in activos:
+            total = contadores.get(contador_id, 0)
+            # Lo consumido por otros workers desde la última sincronización
+            remoto = total - bucket.visto - pendiente
+            if remoto > 0:
+                bucket.tokens -= remoto
+            bucket.visto = total
+
+    async def _bucle(self) -> None:
+        while True:
+            await asyncio.sleep(INTERVALO_SINCRONIZACION)
+            try:
+                await self.sincronizar()
+            except Exception as e:
+                logger.error(f"Error sincronizando límites de tasa: {str(e)}")
+
+    async def iniciar(self) -> None:
+        if not SINCRONIZAR_MONGO:
+            return
+        try:
+            await conn["limites_tasa"].create_index("expira", expireAfterSeconds=0)
+        except Exception as e:
+            logger.error(f"Error creando índices de límites de tasa: {str(e)}")
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+
+async def _leer_formulario(scope, receive) -> Tuple[Optional[dict], object]:
+    """
+    Lee el cuerpo de un formulario urlencoded sin consumirlo: devuelve sus
+    campos y un `receive` que vuelve a entregar el cuerpo a la aplicación.
+    """
+    cabeceras = dict(scope.get("headers", []))
+    if not cabeceras.get(b"content-type", b"").startswith(b"application/x-www-form-urlencoded"):
+        return None, receive
+
+    mensajes = []
+    tamano = 0
+    while True:
+        mensaje = await receive()
+        mensajes.append(mensaje)
+        if mensaje["type"] != "http.request":
+            break
+        tamano += len(mensaje.get("body", b""))
+        if not mensaje.get("more_body") or tamano > MAXIMO_CUERPO_FORMULARIO:
+            break
+
+    async def repetir():
+        if mensajes:
+            return mensajes.pop(0)
+        return await receive()
+
+    completo = mensajes[-1]["type"] == "http.request" and not mensajes[-1].get("more_body")
+    if not completo:
+        return None, repetir
+    cuerpo = b"".join(mensaje.get("body", b"") for mensaje in mensajes)
+    campos = parse_qs(cuerpo.decode("latin-1"))
+    return {campo: valores[0] for campo, valores in campos.items()}, repetir
+
+
+def _demasiadas_peticiones(detalle: str, espera: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": detalle},
+        headers={"Retry-After": str(max(1, math.ceil(espera)))},
+    )
+
+
+class LimitadorTasaMiddleware:
+    """Middleware ASGI que aplica los límites de tasa y de concurrencia por grupo de rutas."""
+
+    def __init__(self, app, limitador: LimitadorTasa):
+        self.app = app
+        self.limitador = limitador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        grupo = self.limitador.grupo_para(scope["path"], scope["method"])
+        if grupo is None:
+            return await self.app(scope, receive, send)
+
+        claves = self.limitador.claves(scope)
+        if grupo.campo_cuenta is not None:
+            # El login no lleva token: se limita también por la cuenta atacada
+            formulario, receive = await _leer_formulario(scope, receive)
+            cuenta = (formulario or {}).get(grupo.campo_cuenta, "").strip().lower()
+            if cuenta:
+                claves.append((f"cuenta:{hashlib.sha256(cuenta.encode()).hexdigest()[:32]}", 1))
+
+        espera = grupo.consumir(claves)
+        if espera:
+            respuesta = _demasiadas_peticiones(
+                "Demasiadas peticiones, intente de nuevo más tarde", espera
+            )
+            return await respuesta(scope, receive, send)
+
+        if not grupo.admitir():
+            respuesta = _demasiadas_peticiones(
+                "El servidor está procesando demasiadas peticiones de este tipo", 1
+            )
+            return await respuesta(scope, receive, send)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            grupo.liberar()
+
+
+limitador_tasa = LimitadorTasa(
+    [
+        crear_grupo("login", 10, 5, 32, rutas=("/token",), metodos=("POST",), campo_cuenta="username"),
+        crear_grupo("ia", 20, 5, 8, prefijos=("/ia/",)),
+    ]
+)
@@ -0,0 +1,341 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from bson import ObjectId
+from decouple import config
+from fastapi.encoders import jsonable_encoder
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from config.db import conn
+from models.Notificacion import EstadoNotificacion, TipoNotificacion
+from utils.serializers import serialize_mongo_doc
+
+logger = logging.getLogger("notificaciones")
+
+# Eventos pendientes de enviar por conexión; si se llena, la conexión se cierra
+# y el cliente recupera lo perdido al reconectar con Last-Event-ID
+TAMANO_COLA_SSE = config("TAMANO_COLA_SSE", default=100, cast=int)
+INTERVALO_LATIDO_SSE = config("INTERVALO_LATIDO_SSE", default=15, cast=int)
+MAXIMO_REPETICION_SSE = config("MAXIMO_REPETICION_SSE", default=500, cast=int)
+# Milisegundos que espera el navegador antes de reconectar
+REINTENTO_SSE = 3000
+# Segundos tras el reenvío por Last-Event-ID en los que aún pueden llegar por
+# el change stream notificaciones ya reenviadas
+SOLAPE_REPETICION_SSE = 30
+# Segundos antes de la última notificación recibida desde los que se reenvía al
+# reconectar: las creadas en otros procesos en el mismo segundo pueden tener un
+# ObjectId menor, y los relojes de los workers no van exactamente a la par
+MARGEN_REPETICION_SSE = config("MARGEN_REPETICION_SSE", default=5, cast=int)
+# Ids ya entregados que se recuerdan para no repetirlos cuando llegan por el change stream
+RECIENTES_PUBLICADAS = 10000
+
+# Un documento por usuario con su número de notificaciones no leídas
+CONTADORES_NOTIFICACIONES = "contadores_notificaciones"
+
+ICONOS = {
+    TipoNotificacion.INFO: "info-circle",
+    TipoNotificacion.ALERTA: "exclamation-triangle",
+    TipoNotificacion.ERROR: "times-circle",
+    TipoNotificacion.EXITO: "check-circle",
+}
+
+
+def nueva_notificacion(
+    usuario_id,
+    tipo: TipoNotificacion,
+    titulo: str,
+    mensaje: str,
+    documento_id: Optional[str] = None,
+    accion_url: Optional[str] = None,
+) -> dict:
+    return {
+        "usuario_id": usuario_id,
+        "tipo": tipo,
+        "titulo": titulo,
+        "mensaje": mensaje,
+        "documento_id": documento_id,
+        "fecha_creacion": datetime.now(timezone.utc),
+        "estado": EstadoNotificacion.NO_LEIDA,
+        "fecha_lectura": None,
+        "icono": ICONOS.get(tipo),
+        "accion_url": accion_url,
+    }
+
+
+def evento_sse(notificacion: dict) -> str:
+    datos = json.dumps(jsonable_encoder(serialize_mongo_doc(notificacion)), ensure_ascii=False)
+    return f"id: {notificacion['_id']}\nevent: notificacion\ndata: {datos}\n\n"
+
+
+class Suscripcion:
+    def __init__(self, usuario_id: str, tamano: int):
+        self.usuario_id = usuario_id
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=tamano)
+        self.desbordada = False
+
+    def entregar(self, notificacion: dict) -> None:
+        # Tras desbordarse no se encola nada más: lo siguiente llegaría con un
+        # hueco y el cliente, al reconectar, ya no lo pediría
+        if self.desbordada:
+            return
+        try:
+            self.cola.put_nowait(notificacion)
+        except asyncio.QueueFull:
+            # Un cliente lento no puede hacer crecer la memoria: se le desconecta
+            self.desbordada = True
+
+
+class CentroNotificaciones:
+    """
+    Reparte las notificaciones nuevas entre las conexiones abiertas de cada
+    usuario en este proceso. Las creadas aquí se entregan al momento y las de
+    otros procesos llegan por un change stream de `notificaciones`; si MongoDB
+    no admite change streams (servidor sin réplica) solo se reparten las locales.
+    """
+
+    def __init__(self, tamano_cola: int):
+        self.tamano_cola = tamano_cola
+        self._suscripciones: Dict[str, Set[Suscripcion]] = {}
+        self._publicadas: OrderedDict = OrderedDict()
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def conexiones(self) -> int:
+        return sum(len(suscripciones) for suscripciones in self._suscripciones.values())
+
+    def suscribir(self, usuario_id) -> Suscripcion:
+        suscripcion = Suscripcion(str(usuario_id), self.tamano_cola)
+        self._suscripciones.setdefault(suscripcion.usuario_id, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        suscripciones = self._suscripciones.get(suscripcion.usuario_id)
+        if suscripciones is not None:
+            suscripciones.discard(suscripcion)
+            if not suscripciones:
+                del self._suscripciones[suscripcion.usuario_id]
+
+    def publicar(self, notificacion: dict) -> None:
+        notificacion_id = str(notificacion["_id"])
+        if notificacion_id in self._publicadas:
+            return
+        self._publicadas[notificacion_id] = None
+        if len(self._publicadas) > RECIENTES_PUBLICADAS:
+            self._publicadas.popitem(last=False)
+        for suscripcion in self._suscripciones.get(str(notificacion["usuario_id"]), ()):
+            suscripcion.entregar(notificacion)
+
+    async def _escuchar(self) -> None:
+        token = None
+        espera = 1
+        while True:
+            try:
+                async with conn["notificaciones"].watch(
+                    [{"$match": {"operationType": "insert"}}], resume_after=token
+                ) as flujo:
+                    espera = 1
+                    async for cambio in flujo:
+                        token = flujo.resume_token
+                        self.publicar(cambio["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except (NotImplementedError, AttributeError) as e:
+                logger.warning(f"Change streams no disponibles, solo se reparten notificaciones locales: {str(e)}")
+                return
+            except OperationFailure as e:
+                if e.code == 40573:  # Solo se admiten en réplicas o clústeres
+                    logger.warning("MongoDB sin réplica: solo se reparten notificaciones locales")
+                    return
+                logger.error(f"Error en el change stream de notificaciones: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error en el change stream de notificaciones: {str(e)}")
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, 60)
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+
+centro_notificaciones = CentroNotificaciones(TAMANO_COLA_SSE)
+
+
+async def guardar_notificacion(notificacion: dict) -> dict:
+    """Guarda una notificación y la entrega a las conexiones abiertas de su usuario."""
+    resultado = await conn["notificaciones"].insert_one(notificacion)
+    notificacion["_id"] = resultado.inserted_id
+    await conn[CONTADORES_NOTIFICACIONES].update_one(
+        {"_id": notificacion["usuario_id"]}, {"$inc": {"no_leidas": 1}}, upsert=True
+    )
+    centro_notificaciones.publicar(notificacion)
+    return notificacion
+
+
+async def guardar_notificaciones(notificaciones: List[dict], ordenado: bool = False) -> int:
+    """
+    Como `guardar_notificacion`, para un lote, con un único insert_many. Con
+    `ordenado` el lote se detiene en el primer error, así que las guardadas son
+    siempre las primeras. Si falla parte del lote, los contadores y el reparto
+    se aplican a las que sí se guardaron antes de propagar el error.
+    """
+    if not notificaciones:
+        return 0
+    error = None
+    try:
+        await conn["notificaciones"].insert_many(notificaciones, ordered=ordenado)
+        guardadas = notificaciones
+    except BulkWriteError as e:
+        error = e
+        if ordenado:
+            guardadas = notificaciones[:e.details.get("nInserted", 0)]
+        else:
+            fallidas = {fallo["index"] for fallo in e.details.get("writeErrors", [])}
+            guardadas = [n for indice, n in enumerate(notificaciones) if indice not in fallidas]
+
+    por_usuario = Counter(notificacion["usuario_id"] for notificacion in guardadas)
+    if por_usuario:
+        await conn[CONTADORES_NOTIFICACIONES].bulk_write(
+            [
+                UpdateOne({"_id": usuario_id}, {"$inc": {"no_leidas": n}}, upsert=True)
+                for usuario_id, n in por_usuario.items()
+            ],
+            ordered=False,
+        )
+    for notificacion in guardadas:
+        centro_notificaciones.publicar(notificacion)
+    if error is not None:
+        raise error
+    return len(guardadas)
+
+
+async def contar_no_leidas(usuario_id) -> int:
+    """
+    Notificaciones no leídas del usuario, leídas de su contador. Si el
+    contador no existe, no se ha contado nunca (lo creó un `$inc` sin contar
+    las anteriores) o ha quedado negativo, se reconcilia con las notificaciones.
+    """
+    contador = await conn[CONTADORES_NOTIFICACIONES].find_one({"_id": usuario_id})
+    if contador is not None and contador.get("contado") and contador.get("no_leidas", 0) >= 0:
+        return contador["no_leidas"]
+    return await reconciliar_no_leidas(usuario_id, contador)
+
+
+async def reconciliar_no_leidas(usuario_id, contador: Optional[dict] = None) -> int:
+    """
+    Cuenta las no leídas del usuario y las guarda en su contador. Solo se
+    sobrescribe si el contador sigue como se leyó: si otro proceso lo ha
+    cambiado mientras tanto, se deja sin marcar como contado y la siguiente
+    consulta vuelve a reconciliarlo.
+    """
+    no_leidas = await conn["notificaciones"].count_documents(
+        {"usuario_id": usuario_id, "estado": EstadoNotificacion.NO_LEIDA}
+    )
+    if contador is None:
+        await conn[CONTADORES_NOTIFICACIONES].update_one(
+            {"_id": usuario_id},
+            {"$setOnInsert": {"no_leidas": no_leidas, "contado": True}},
+            upsert=True,
+        )
+    else:
+        await conn[CONTADORES_NOTIFICACIONES].update_one(
+            {"_id": usuario_id, "no_leidas": contador.get("no_leidas")},
+            {"$set": {"no_leidas": no_leidas, "contado": True}},
+        )
+    return no_leidas
+
+
+def ids_notificacion(ids: List[str]) -> list:
+    # Las notificaciones se crean con ObjectId pero la API recibe texto
+    return [ObjectId(i) if ObjectId.is_valid(i) else i for i in ids]
+
+
+async def cambiar_estado(usuario_id, estado: EstadoNotificacion, ids: Optional[List[str]] = None) -> int:
+    """
+    Marca como leídas o archivadas las notificaciones `ids` del usuario (todas
+    si no se indican) con update_many y descuenta del contador las que
+    dejaron de estar no leídas. Devuelve cuántas cambiaron.
+    """
+    filtro = {"usuario_id": usuario_id}
+    if ids is not None:
+        filtro["_id"] = {"$in": ids_notificacion(ids)}
+    ahora = datetime.now(timezone.utc)
+
+    no_leidas = await conn["notificaciones"].update_many(
+        {**filtro, "estado": EstadoNotificacion.NO_LEIDA},
+        {"$set": {"estado": estado, "fecha_lectura": ahora}},
+    )
+    cambiadas = no_leidas.modified_count
+    if estado == EstadoNotificacion.ARCHIVADA:
+        leidas = await conn["notificaciones"].update_many(
+            {**filtro, "estado": EstadoNotificacion.LEIDA},
+            {"$set": {"estado": estado}},
+        )
+        cambiadas += leidas.modified_count
+
+    if no_leidas.modified_count:
+        await conn[CONTADORES_NOTIFICACIONES].update_one(
+            {"_id": usuario_id}, {"$inc": {"no_leidas": -no_leidas.modified_count}}
+        )
+    return cambiadas
+
+
+async def flujo_notificaciones(usuario_id, ultimo_id: Optional[str]):
+    """
+    Genera el flujo SSE de un usuario: primero las notificaciones posteriores a
+    `ultimo_id` (cabecera Last-Event-ID al reconectar) y después las nuevas a
+    medida que llegan, con un comentario de latido cuando no hay actividad.
+    """
+    # Se suscribe antes de consultar para no perder nada entre ambos pasos.
+    # Lo que llegue por ambos caminos se descarta comparando con los ids
+    # reenviados, nunca por orden de id: los ObjectId de procesos distintos
+    # no crecen de forma global. Por lo mismo, el reenvío parte de la fecha
+    # de la última recibida menos un margen, y puede repetir alguna que el
+    # cliente ya tenía (lleva el mismo id) antes que perder una
+    suscripcion = centro_notificaciones.suscribir(usuario_id)
+    try:
+        yield f"retry: {REINTENTO_SSE}\n\n"
+        reenviadas: Set[ObjectId] = set()
+        ultimo = ObjectId(ultimo_id) if ultimo_id and ObjectId.is_valid(ultimo_id) else None
+        if ultimo is not None:
+            recibida = await conn["notificaciones"].find_one(
+                {"_id": ultimo, "usuario_id": usuario_id}, {"fecha_creacion": 1}
+            )
+            fecha = recibida["fecha_creacion"] if recibida else ultimo.generation_time
+            pendientes = await conn["notificaciones"].find({
+                "usuario_id": usuario_id,
+                "fecha_creacion": {"$gte": fecha - timedelta(seconds=MARGEN_REPETICION_SSE)},
+                "_id": {"$ne": ultimo},
+            }).sort([("fecha_creacion", 1), ("_id", 1)]).limit(
+                MAXIMO_REPETICION_SSE
+            ).to_list(MAXIMO_REPETICION_SSE)
+            for notificacion in pendientes:
+                reenviadas.add(notificacion["_id"])
+                yield evento_sse(notificacion)
+        # Pasado el solape, lo que llega ya no puede estar entre lo reenviado
+        fin_solape = time.monotonic() + SOLAPE_REPETICION_SSE
+
+        while not suscripcion.desbordada or not suscripcion.cola.empty():
+            try:
+                notificacion = await asyncio.wait_for(suscripcion.cola.get(), INTERVALO_LATIDO_SSE)
+            except asyncio.TimeoutError:
+                yield ": latido\n\n"
+                continue
+            if reenviadas:
+                if time.monotonic() > fin_solape:
+                    reenviadas.clear()
+                elif notificacion["_id"] in reenviadas:
+                    reenviadas.discard(notificacion["_id"])
+                    continue
+            yield evento_sse(notificacion)
+    finally:
+        centro_notificaciones.cancelar(suscripcion)
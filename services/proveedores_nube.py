@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import math
+import random
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+
+import httpx
+from decouple import config
+from starlette.concurrency import run_in_threadpool
+
+from models.Integracion import ProveedorNube
+
+logger = logging.getLogger("proveedores_nube")
+
+DIRECTORIO_NUBE_LOCAL = Path(
+    str(config("DIRECTORIO_NUBE_LOCAL", default="nube_local"))
+).absolute()
+# Fracción de subidas que el proveedor local hace fallar, para probar los reintentos
+FALLOS_NUBE_LOCAL = config("FALLOS_NUBE_LOCAL", default=0.0, cast=float)
+# "local" copia a DIRECTORIO_NUBE_LOCAL; "http" sube por partes a URL_NUBE
+PROVEEDOR_NUBE = config("PROVEEDOR_NUBE", default="local")
+URL_NUBE = str(config("URL_NUBE", default="http://localhost:8090")).rstrip("/")
+TAMANO_PARTE_NUBE = config("TAMANO_PARTE_NUBE", default=8 * 1024 * 1024, cast=int)
+# Partes de un mismo archivo subiéndose a la vez
+PARALELISMO_PARTES = config("PARALELISMO_PARTES", default=4, cast=int)
+TIEMPO_ESPERA_NUBE = config("TIEMPO_ESPERA_NUBE", default=60, cast=int)
+
+
+class ErrorProveedor(Exception):
+    """Fallo de una subida. Si no es `reintentable`, repetirla no serviría de nada."""
+
+    def __init__(self, mensaje: str, reintentable: bool = True):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+
+class PuntoControl:
+    """
+    Progreso de una subida por partes: sesión abierta en el proveedor y partes
+    ya enviadas. Esta versión solo lo guarda en memoria; el planificador usa
+    una que además lo persiste para poder reanudar la subida en otro proceso.
+    """
+
+    def __init__(self, datos: Optional[dict] = None):
+        self.datos = dict(datos or {})
+        self.datos.setdefault("partes", [])
+
+    async def iniciar(self, **datos) -> None:
+        self.datos = {**datos, "partes": []}
+
+    async def parte_completada(self, indice: int) -> None:
+        self.datos["partes"].append(indice)
+
+
+class ProveedorSubida(ABC):
+    """Interfaz común de los servicios en la nube a los que se suben documentos."""
+
+    @abstractmethod
+    async def subir(
+        self,
+        ruta: Path,
+        nombre: str,
+        configuracion: dict,
+        id_en_nube: Optional[str] = None,
+        punto_control: Optional[PuntoControl] = None,
+    ) -> dict:
+        """
+        Sube el archivo `ruta` con el nombre `nombre` usando la configuración de
+        la integración del usuario. Si `id_en_nube` viene de una subida anterior
+        el archivo se reemplaza; si `punto_control` tiene una subida a medias,
+        se continúa. Devuelve `id_en_nube` y `url_en_nube`.
+        """
+
+    async def cerrar(self) -> None:
+        pass
+
+
+class ProveedorLocal(ProveedorSubida):
+    """
+    Simula un proveedor copiando los archivos a un directorio local, con una
+    carpeta por proveedor y por carpeta (o usuario) de destino.
+    """
+
+    def __init__(self, directorio: Path, probabilidad_fallo: float = 0.0):
+        self.directorio = directorio
+        self.probabilidad_fallo = probabilidad_fallo
+
+    @staticmethod
+    def _copiar(origen: Path, destino: Path) -> None:
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        temporal = destino.with_suffix(destino.suffix + ".tmp")
+        shutil.copyfile(origen, temporal)
+        temporal.replace(destino)
+
+    async def subir(
+        self,
+        ruta: Path,
+        nombre: str,
+        configuracion: dict,
+        id_en_nube: Optional[str] = None,
+        punto_control: Optional[PuntoControl] = None,
+    ) -> dict:
+        if random.random() < self.probabilidad_fallo:
+            raise ErrorProveedor("Fallo simulado del proveedor local")
+
+        id_en_nube = id_en_nube or uuid.uuid4().hex
+        carpeta = configuracion.get("carpeta_id") or str(configuracion["usuario_id"])
+        proveedor = ProveedorNube(configuracion["proveedor"]).value
+        destino = self.directorio / proveedor / carpeta / f"{id_en_nube}{ruta.suffix}"
+        await run_in_threadpool(self._copiar, ruta, destino)
+        return {"id_en_nube": id_en_nube, "url_en_nube": destino.as_uri()}
+
+
+def _leer_parte(ruta: Path, inicio: int, tamano: int) -> bytes:
+    with open(ruta, "rb") as archivo:
+        archivo.seek(inicio)
+        return archivo.read(tamano)
+
+
+class ProveedorHTTP(ProveedorSubida):
+    """
+    Sube los archivos por partes con el protocolo de subidas reanudables de
+    `scripts/servidor_nube_local.py`, parecido al de Drive, Dropbox y OneDrive:
+
+    - `POST {url}/subidas` abre una sesión;
+    - `PUT {url}/subidas/{sesion}/partes/{n}` envía cada parte;
+    - `GET {url}/subidas/{sesion}` indica las partes recibidas;
+    - `POST {url}/subidas/{sesion}/completar` une las partes y devuelve el archivo.
+
+    Las partes de un archivo se envían en paralelo, como mucho `paralelismo` a
+    la vez. Cada parte confirmada queda en el punto de control, así que si la
+    subida se interrumpe solo se reenvían las partes que faltan.
+    """
+
+    def __init__(self, url: str, tamano_parte: int, paralelismo: int, tiempo_espera: int):
+        self.url = url
+        self.tamano_parte = tamano_parte
+        self.paralelismo = paralelismo
+        self.tiempo_espera = tiempo_espera
+        self._cliente: Optional[httpx.AsyncClient] = None
+
+    @property
+    def cliente(self) -> httpx.AsyncClient:
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(base_url=self.url, timeout=self.tiempo_espera)
+        return self._cliente
+
+    @staticmethod
+    def _comprobar(respuesta: httpx.Response) -> dict:
+        if respuesta.status_code in (401, 403):
+            raise ErrorProveedor("El proveedor rechazó el token de acceso", reintentable=False)
+        if respuesta.status_code >= 400:
+            # 429 y 5xx son pasajeros; el resto también se reintenta con espera
+            raise ErrorProveedor(f"El proveedor respondió {respuesta.status_code}: {respuesta.text[:200]}")
+        return respuesta.json() if respuesta.content else {}
+
+    async def _peticion(self, metodo: str, ruta: str, **kwargs) -> httpx.Response:
+        try:
+            return await self.cliente.request(metodo, ruta, **kwargs)
+        except httpx.HTTPError as e:
+            raise ErrorProveedor(f"Error de conexión con el proveedor: {str(e)}")
+
+    async def _reanudar(self, punto_control: PuntoControl, huella: str, cabeceras: dict) -> Optional[set]:
+        # Partes que el proveedor ya tiene de la sesión guardada, si sigue abierta
+        datos = punto_control.datos
+        if not datos.get("sesion") or datos.get("huella") != huella:
+            return None
+        respuesta = await self._peticion("GET", f"/subidas/{datos['sesion']}", headers=cabeceras)
+        if respuesta.status_code == 404:
+            return None
+        return set(self._comprobar(respuesta).get("partes", []))
+
+    async def subir(
+        self,
+        ruta: Path,
+        nombre: str,
+        configuracion: dict,
+        id_en_nube: Optional[str] = None,
+        punto_control: Optional[PuntoControl] = None,
+    ) -> dict:
+        punto_control = punto_control or PuntoControl()
+        cabeceras = {"Authorization": f"Bearer {configuracion['token_acceso']}"}
+        tamano = ruta.stat().st_size
+        # El nombre del artefacto incluye la versión del documento: si cambia,
+        # la sesión guardada ya no sirve
+        huella = f"{ruta.name}:{tamano}"
+
+        recibidas = await self._reanudar(punto_control, huella, cabeceras)
+        if recibidas is None:
+            respuesta = await self._peticion("POST", "/subidas", headers=cabeceras, json={
+                "nombre": nombre,
+                "tamano": tamano,
+                "tamano_parte": self.tamano_parte,
+                "carpeta": configuracion.get("carpeta_id"),
+                "id": id_en_nube,
+            })
+            sesion = self._comprobar(respuesta)["sesion"]
+            await punto_control.iniciar(sesion=sesion, huella=huella, tamano_parte=self.tamano_parte)
+            recibidas = set()
+
+        sesion = punto_control.datos["sesion"]
+        tamano_parte = punto_control.datos["tamano_parte"]
+        semaforo = asyncio.Semaphore(self.paralelismo)
+
+        async def enviar(indice: int) -> None:
+            async with semaforo:
+                datos = await run_in_threadpool(_leer_parte, ruta, indice * tamano_parte, tamano_parte)
+                respuesta = await self._peticion(
+                    "PUT", f"/subidas/{sesion}/partes/{indice}", headers=cabeceras, content=datos
+                )
+                self._comprobar(respuesta)
+                await punto_control.parte_completada(indice)
+
+        pendientes = [i for i in range(math.ceil(tamano / tamano_parte)) if i not in recibidas]
+        resultados = await asyncio.gather(*[enviar(i) for i in pendientes], return_exceptions=True)
+        errores = [r for r in resultados if isinstance(r, BaseException)]
+        if errores:
+            raise errores[0]
+
+        respuesta = await self._peticion("POST", f"/subidas/{sesion}/completar", headers=cabeceras)
+        archivo = self._comprobar(respuesta)
+        return {"id_en_nube": archivo["id"], "url_en_nube": archivo["url"]}
+
+    async def cerrar(self) -> None:
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+
+def crear_proveedores() -> Dict[str, ProveedorSubida]:
+    if PROVEEDOR_NUBE == "http":
+        return {
+            proveedor.value: ProveedorHTTP(
+                f"{URL_NUBE}/{proveedor.value}", TAMANO_PARTE_NUBE, PARALELISMO_PARTES, TIEMPO_ESPERA_NUBE
+            )
+            for proveedor in ProveedorNube
+        }
+    local = ProveedorLocal(DIRECTORIO_NUBE_LOCAL, FALLOS_NUBE_LOCAL)
+    return {proveedor.value: local for proveedor in ProveedorNube}
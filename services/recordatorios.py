@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from decouple import config
+
+from config.db import conn
+from models.Notificacion import TipoNotificacion
+from services.correo import enviar_correo
+from services.notificaciones import guardar_notificacion, nueva_notificacion
+
+logger = logging.getLogger("recordatorios")
+
+# Segundos por delante que se cargan en memoria en cada consulta
+VENTANA_RECORDATORIOS = config("VENTANA_RECORDATORIOS", default=300, cast=int)
+MAXIMO_RECORDATORIOS_MEMORIA = config("MAXIMO_RECORDATORIOS_MEMORIA", default=10000, cast=int)
+CONCURRENCIA_RECORDATORIOS = config("CONCURRENCIA_RECORDATORIOS", default=16, cast=int)
+
+
+def fecha_utc(fecha: datetime) -> datetime:
+    # Las fechas sin zona horaria que llegan de la API se interpretan en hora local
+    return fecha.astimezone(timezone.utc)
+
+
+def _desde_mongo(fecha: datetime) -> datetime:
+    # Motor devuelve las fechas sin zona horaria, pero siempre están en UTC
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+def siguiente_ejecucion(proxima: datetime, intervalo_dias: int, ahora: datetime) -> datetime:
+    """Siguiente repetición posterior a `ahora`, saltando las que se perdieron."""
+    paso = timedelta(days=intervalo_dias)
+    saltos = max((ahora - proxima) // paso + 1, 1)
+    return proxima + paso * saltos
+
+
+class MotorRecordatorios:
+    """
+    Ejecuta los recordatorios cuando llega su `proxima_ejecucion`. Cada
+    `ventana` segundos carga, con una consulta por índice, los que vencen en
+    la siguiente ventana en un montículo ordenado por fecha y duerme justo
+    hasta el primero, sin recorrer la colección en cada vuelta. Los creados o
+    modificados en este proceso entran en el montículo al momento.
+
+    Todos los procesos ejecutan el motor; cada ejecución se reclama con una
+    actualización condicionada a la `proxima_ejecucion` leída, de modo que
+    solo un proceso la dispara.
+    """
+
+    def __init__(self, ventana: int, maximo: int, concurrencia: int):
+        self.ventana = timedelta(seconds=ventana)
+        self.maximo = maximo
+        self.concurrencia = concurrencia
+        self._monticulo: list = []
+        # Fecha vigente de cada recordatorio del montículo: las entradas que no
+        # coinciden quedaron obsoletas y se ignoran al salir
+        self._programados: Dict[str, datetime] = {}
+        self._orden = itertools.count()
+        self._horizonte: Optional[datetime] = None
+        self._recarga: Optional[datetime] = None
+        # False si la última carga se cortó en `maximo` y faltan recordatorios de la ventana
+        self._completa = True
+        self._cambio = asyncio.Event()
+        self._tareas: set = set()
+        self._tarea: Optional[asyncio.Task] = None
+
+    @property
+    def programados(self) -> int:
+        return len(self._programados)
+
+    def programar(self, recordatorio_id, fecha: Optional[datetime]) -> None:
+        """Registra la nueva fecha de un recordatorio creado o modificado."""
+        clave = str(recordatorio_id)
+        self._programados.pop(clave, None)
+        if fecha is None or self._horizonte is None:
+            return
+        fecha = _desde_mongo(fecha)
+        # Lo que vence después del horizonte llegará con la próxima carga
+        if fecha > self._horizonte:
+            return
+        self._programados[clave] = fecha
+        heapq.heappush(self._monticulo, (fecha, next(self._orden), recordatorio_id))
+        self._cambio.set()
+
+    def descartar(self, recordatorio_id) -> None:
+        self._programados.pop(str(recordatorio_id), None)
+
+    async def cargar(self) -> None:
+        ahora = datetime.now(timezone.utc)
+        horizonte = ahora + self.ventana
+        recordatorios = await conn["recordatorios"].find(
+            {"activo": True, "proxima_ejecucion": {"$lte": horizonte}},
+            {"proxima_ejecucion": 1},
+        ).sort("proxima_ejecucion", 1).limit(self.maximo).to_list(self.maximo)
+        self._completa = len(recordatorios) < self.maximo
+        if not self._completa:
+            # No caben todos: la ventana llega hasta el último cargado y se
+            # vuelve a cargar en cuanto se vacíe el montículo
+            horizonte = _desde_mongo(recordatorios[-1]["proxima_ejecucion"])
+
+        self._programados = {}
+        self._monticulo = []
+        for recordatorio in recordatorios:
+            fecha = _desde_mongo(recordatorio["proxima_ejecucion"])
+            self._programados[str(recordatorio["_id"])] = fecha
+            self._monticulo.append((fecha, next(self._orden), recordatorio["_id"]))
+        heapq.heapify(self._monticulo)
+        self._horizonte = horizonte
+        # Se recarga a media ventana para que siempre haya margen cargado
+        self._recarga = ahora + self.ventana / 2
+
+    def _disparar_vencidos(self, ahora: datetime) -> None:
+        while self._monticulo and self._monticulo[0][0] <= ahora and len(self._tareas) < self.concurrencia:
+            fecha, _, recordatorio_id = heapq.heappop(self._monticulo)
+            if self._programados.get(str(recordatorio_id)) != fecha:
+                continue
+            del self._programados[str(recordatorio_id)]
+            tarea = asyncio.create_task(self.ejecutar(recordatorio_id))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._terminada)
+
+    def _terminada(self, tarea: asyncio.Task) -> None:
+        self._tareas.discard(tarea)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.error(f"Error ejecutando un recordatorio: {str(tarea.exception())}")
+        self._cambio.set()
+
+    async def ejecutar(self, recordatorio_id) -> bool:
+        """Dispara un recordatorio vencido si este proceso consigue reclamarlo."""
+        recordatorio = await conn["recordatorios"].find_one({"_id": recordatorio_id})
+        if not recordatorio or not recordatorio.get("activo") or recordatorio.get("proxima_ejecucion") is None:
+            return False
+        ahora = datetime.now(timezone.utc)
+        proxima = _desde_mongo(recordatorio["proxima_ejecucion"])
+        if proxima > ahora:
+            return False
+
+        siguiente = None
+        if recordatorio.get("repetir") and recordatorio.get("intervalo_repeticion"):
+            siguiente = siguiente_ejecucion(proxima, recordatorio["intervalo_repeticion"], ahora)
+        reclamo = await conn["recordatorios"].update_one(
+            {"_id": recordatorio_id, "activo": True, "proxima_ejecucion": recordatorio["proxima_ejecucion"]},
+            {"$set": {"proxima_ejecucion": siguiente, "ultima_ejecucion": ahora, "enviado": True}},
+        )
+        if reclamo.modified_count == 0:
+            # Otro proceso lo reclamó o se modificó mientras tanto
+            return False
+        self.programar(recordatorio_id, siguiente)
+
+        mensaje = recordatorio.get("mensaje") or f"Recordatorio: {recordatorio['titulo']}"
+        await guardar_notificacion(nueva_notificacion(
+            recordatorio["usuario_id"],
+            TipoNotificacion.INFO,
+            recordatorio["titulo"],
+            mensaje,
+            recordatorio.get("documento_id"),
+        ))
+        if recordatorio.get("enviar_email") and recordatorio.get("email_destino"):
+            try:
+                await enviar_correo(recordatorio["email_destino"], recordatorio["titulo"], mensaje)
+            except Exception as e:
+                logger.error(f"Error enviando el correo del recordatorio {recordatorio_id}: {str(e)}")
+        return True
+
+    async def _bucle(self) -> None:
+        while True:
+            self._cambio.clear()
+            try:
+                ahora = datetime.now(timezone.utc)
+                agotada = not self._completa and not self._monticulo and not self._tareas
+                if self._recarga is None or ahora >= self._recarga or agotada:
+                    await self.cargar()
+                self._disparar_vencidos(ahora)
+                siguiente = self._recarga
+                if self._monticulo and len(self._tareas) < self.concurrencia:
+                    siguiente = min(siguiente, self._monticulo[0][0])
+                espera = (siguiente - datetime.now(timezone.utc)).total_seconds()
+            except Exception as e:
+                logger.error(f"Error planificando recordatorios: {str(e)}")
+                self._recarga = None
+                espera = 5
+            if espera > 0:
+                try:
+                    await asyncio.wait_for(self._cambio.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        tareas = list(self._tareas)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+
+motor_recordatorios = MotorRecordatorios(
+    VENTANA_RECORDATORIOS, MAXIMO_RECORDATORIOS_MEMORIA, CONCURRENCIA_RECORDATORIOS
+)
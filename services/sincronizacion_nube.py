@@ -0,0 +1,375 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from decouple import config
+from pymongo import ReturnDocument
+
+from config.db import conn
+from models.Integracion import EstadoSincronizacion, ProveedorNube
+from services.exportadores import cache_artefactos, nombre_archivo
+from services.proveedores_nube import ErrorProveedor, ProveedorSubida, PuntoControl, crear_proveedores
+
+logger = logging.getLogger("sincronizacion_nube")
+
+# Segundos entre rondas si nadie despierta antes al planificador
+INTERVALO_PLANIFICADOR = config("INTERVALO_PLANIFICADOR", default=5, cast=int)
+CONCURRENCIA_SINCRONIZACION = config("CONCURRENCIA_SINCRONIZACION", default=8, cast=int)
+LIMITE_POR_PROVEEDOR = config("LIMITE_POR_PROVEEDOR", default=4, cast=int)
+LIMITE_POR_USUARIO = config("LIMITE_POR_USUARIO", default=2, cast=int)
+# Segundos que un trabajador se reserva una sincronización antes de que otro pueda retomarla
+DURACION_RECLAMO = config("DURACION_RECLAMO", default=600, cast=int)
+ESPERA_BASE_REINTENTO = config("ESPERA_BASE_REINTENTO", default=30, cast=int)
+ESPERA_MAXIMA_REINTENTO = config("ESPERA_MAXIMA_REINTENTO", default=3600, cast=int)
+MAX_INTENTOS_SINCRONIZACION = config("MAX_INTENTOS_SINCRONIZACION", default=8, cast=int)
+# Minutos entre sincronizaciones automáticas si la integración no indica otro intervalo
+INTERVALO_SINCRONIZACION_DEFECTO = config("INTERVALO_SINCRONIZACION_DEFECTO", default=1440, cast=int)
+FORMATO_SINCRONIZACION = config("FORMATO_SINCRONIZACION", default="json")
+
+SINCRONIZACIONES = "sincronizaciones"
+EN_PROGRESO = EstadoSincronizacion.EN_PROGRESO.value
+
+
+def _utc(fecha: datetime) -> datetime:
+    # Motor devuelve las fechas sin zona horaria, pero siempre están en UTC
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+def filtro_reclamable(ahora: datetime) -> dict:
+    """Sincronizaciones que nadie procesa o cuyo trabajador dejó caducar el reclamo."""
+    return {"$or": [
+        {"estado": {"$ne": EN_PROGRESO}},
+        {"reclamado_hasta": {"$lte": ahora}},
+    ]}
+
+
+def filtro_vencidas(ahora: datetime) -> dict:
+    return {
+        "estado": {"$ne": EN_PROGRESO},
+        "proxima_sincronizacion": {"$lte": ahora},
+    }
+
+
+def espera_reintento(intentos: int) -> float:
+    """Espera exponencial con jitter para no reintentar todos a la vez."""
+    espera = min(ESPERA_BASE_REINTENTO * 2 ** (intentos - 1), ESPERA_MAXIMA_REINTENTO)
+    return espera * random.uniform(0.5, 1.0)
+
+
+class PuntoControlSincronizacion(PuntoControl):
+    """
+    Guarda el progreso de la subida en el campo `subida` del registro de
+    sincronización. Cada parte confirmada renueva además el reclamo, de modo
+    que una subida larga no caduca mientras avanza; si el reclamo ya es de
+    otro trabajador, la subida se detiene.
+    """
+
+    def __init__(self, trabajo: dict, trabajador: str):
+        super().__init__(trabajo.get("subida"))
+        self._filtro = {"_id": trabajo["_id"], "reclamado_por": trabajador}
+
+    async def _guardar(self, cambios: dict) -> None:
+        resultado = await conn[SINCRONIZACIONES].update_one(self._filtro, {
+            **cambios,
+            "$set": {
+                **cambios.get("$set", {}),
+                "reclamado_hasta": datetime.now(timezone.utc) + timedelta(seconds=DURACION_RECLAMO),
+            },
+        })
+        if resultado.matched_count == 0:
+            raise ErrorProveedor("Otro trabajador ha retomado la sincronización")
+
+    async def iniciar(self, **datos) -> None:
+        await super().iniciar(**datos)
+        await self._guardar({"$set": {"subida": self.datos}})
+
+    async def parte_completada(self, indice: int) -> None:
+        await super().parte_completada(indice)
+        # $addToSet: las partes paralelas pueden confirmarse en cualquier orden
+        await self._guardar({"$addToSet": {"subida.partes": indice}})
+
+
+class PlanificadorSincronizacion:
+    """
+    Procesa en segundo plano las sincronizaciones cuya `proxima_sincronizacion`
+    ha llegado. Cada una se reclama con un `find_one_and_update` atómico que la
+    pasa a en_progreso con un plazo (`reclamado_hasta`), así que varios
+    trabajadores nunca procesan la misma; si uno cae, otro la retoma al vencer
+    el plazo. Los límites por proveedor y por usuario se aplican en cada
+    trabajador y los fallos se reintentan con espera exponencial.
+    """
+
+    def __init__(
+        self,
+        proveedores: Dict[str, ProveedorSubida],
+        intervalo: int,
+        concurrencia: int,
+        limite_proveedor: int,
+        limite_usuario: int,
+    ):
+        self.proveedores = proveedores
+        self.intervalo = intervalo
+        self.concurrencia = concurrencia
+        self.limite_proveedor = limite_proveedor
+        self.limite_usuario = limite_usuario
+        self.trabajador = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._semaforos: Dict[tuple, asyncio.Semaphore] = {}
+        self._activos: Counter = Counter()
+        self._tareas: set = set()
+        self._tarea: Optional[asyncio.Task] = None
+        self._despertar = asyncio.Event()
+        self._contadores: Counter = Counter()
+        # Retraso (segundos desde que vencieron) de las últimas sincronizaciones reclamadas
+        self._retrasos: deque = deque(maxlen=200)
+        self._duraciones: deque = deque(maxlen=200)
+
+    def _semaforo(self, clave: tuple) -> asyncio.Semaphore:
+        if clave not in self._semaforos:
+            limite = self.limite_proveedor if clave[0] == "proveedor" else self.limite_usuario
+            self._semaforos[clave] = asyncio.Semaphore(limite)
+        return self._semaforos[clave]
+
+    def _claves(self, trabajo: dict) -> tuple:
+        return ("proveedor", trabajo["proveedor"]), ("usuario", trabajo["usuario_id"])
+
+    def _saturados(self, tipo: str) -> list:
+        return [
+            clave[1] for clave, semaforo in self._semaforos.items()
+            if clave[0] == tipo and semaforo.locked()
+        ]
+
+    async def reclamar(self, filtro: dict) -> Optional[dict]:
+        """Pasa a en_progreso, de forma atómica, la primera sincronización que cumpla `filtro`."""
+        ahora = datetime.now(timezone.utc)
+        return await conn[SINCRONIZACIONES].find_one_and_update(
+            {"$and": [filtro, filtro_reclamable(ahora)]},
+            {"$set": {
+                "estado": EN_PROGRESO,
+                "reclamado_por": self.trabajador,
+                "reclamado_hasta": ahora + timedelta(seconds=DURACION_RECLAMO),
+            }},
+            sort=[("proxima_sincronizacion", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _reclamar_vencida(self) -> Optional[dict]:
+        ahora = datetime.now(timezone.utc)
+        filtro = {"proxima_sincronizacion": {"$lte": ahora}}
+        # Lo que no puede empezar aquí se queda libre para otros trabajadores
+        proveedores, usuarios = self._saturados("proveedor"), self._saturados("usuario")
+        if proveedores:
+            filtro["proveedor"] = {"$nin": proveedores}
+        if usuarios:
+            filtro["usuario_id"] = {"$nin": usuarios}
+        trabajo = await self.reclamar(filtro)
+        if trabajo is not None and trabajo.get("proxima_sincronizacion"):
+            self._retrasos.append((ahora - _utc(trabajo["proxima_sincronizacion"])).total_seconds())
+        return trabajo
+
+    async def _ocupar(self, trabajo: dict) -> None:
+        for clave in self._claves(trabajo):
+            await self._semaforo(clave).acquire()
+            self._activos[clave] += 1
+
+    def _desocupar(self, trabajo: dict) -> None:
+        for clave in self._claves(trabajo):
+            self._activos[clave] -= 1
+            self._semaforo(clave).release()
+
+    async def ejecutar(self, trabajo: dict, ocupado: bool = False) -> dict:
+        """
+        Sube el documento de una sincronización ya reclamada respetando los
+        límites de concurrencia y guarda el resultado. Devuelve el registro
+        actualizado, con estado completado o fallido.
+        """
+        if not ocupado:
+            await self._ocupar(trabajo)
+        inicio = time.monotonic()
+        try:
+            resultado, documento, configuracion = await self._subir(trabajo)
+        except asyncio.CancelledError:
+            await self._liberar(trabajo)
+            raise
+        except Exception as e:
+            logger.error(f"Error sincronizando {trabajo['_id']} con {trabajo['proveedor']}: {str(e)}")
+            return await self._registrar_fallo(trabajo, e)
+        else:
+            return await self._registrar_exito(trabajo, resultado, documento, configuracion)
+        finally:
+            self._duraciones.append(time.monotonic() - inicio)
+            self._desocupar(trabajo)
+
+    async def _subir(self, trabajo: dict) -> tuple:
+        configuracion = await conn["integraciones_nube"].find_one(
+            {"usuario_id": trabajo["usuario_id"], "proveedor": trabajo["proveedor"]}
+        )
+        if configuracion is None:
+            raise ErrorProveedor("La integración ya no está configurada", reintentable=False)
+        documento = await conn["documentos"].find_one({"_id": trabajo["documento_id"]})
+        if documento is None:
+            raise ErrorProveedor("El documento ya no existe", reintentable=False)
+
+        ruta = await cache_artefactos.obtener(documento, FORMATO_SINCRONIZACION)
+        resultado = await self.proveedores[ProveedorNube(trabajo["proveedor"]).value].subir(
+            ruta,
+            nombre_archivo(documento, FORMATO_SINCRONIZACION),
+            configuracion,
+            trabajo.get("id_en_nube"),
+            PuntoControlSincronizacion(trabajo, self.trabajador),
+        )
+        return resultado, documento, configuracion
+
+    async def _finalizar(self, trabajo: dict, cambios: dict, descartar: tuple = ()) -> dict:
+        # Solo se guarda si el reclamo sigue siendo de este trabajador
+        actualizado = await conn[SINCRONIZACIONES].find_one_and_update(
+            {"_id": trabajo["_id"], "reclamado_por": self.trabajador},
+            {"$set": cambios, "$unset": {campo: "" for campo in ("reclamado_por", "reclamado_hasta", *descartar)}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return actualizado or {**trabajo, **cambios}
+
+    async def _registrar_exito(
+        self, trabajo: dict, resultado: dict, documento: dict, configuracion: dict
+    ) -> dict:
+        self._contadores["completadas"] += 1
+        ahora = datetime.now(timezone.utc)
+        proxima = None
+        if configuracion.get("sincronizacion_automatica"):
+            minutos = configuracion.get("intervalo_sincronizacion") or INTERVALO_SINCRONIZACION_DEFECTO
+            proxima = ahora + timedelta(minutes=minutos)
+        return await self._finalizar(trabajo, {
+            "estado": EstadoSincronizacion.COMPLETADO.value,
+            "id_en_nube": resultado["id_en_nube"],
+            "url_en_nube": resultado["url_en_nube"],
+            "documento_nombre": documento.get("titulo", "Documento sin título"),
+            "ultima_sincronizacion": ahora,
+            "proxima_sincronizacion": proxima,
+            "intentos": 0,
+            "error": None,
+        }, descartar=("subida",))
+
+    async def _registrar_fallo(self, trabajo: dict, error: Exception) -> dict:
+        self._contadores["fallidas"] += 1
+        intentos = trabajo.get("intentos", 0) + 1
+        reintentable = getattr(error, "reintentable", True) and intentos < MAX_INTENTOS_SINCRONIZACION
+        proxima = None
+        if reintentable:
+            proxima = datetime.now(timezone.utc) + timedelta(seconds=espera_reintento(intentos))
+        else:
+            self._contadores["abandonadas"] += 1
+        return await self._finalizar(trabajo, {
+            "estado": EstadoSincronizacion.FALLIDO.value,
+            "intentos": intentos,
+            "error": str(error),
+            "proxima_sincronizacion": proxima,
+        })
+
+    async def _liberar(self, trabajo: dict) -> None:
+        # Al detener el planificador la sincronización vuelve a quedar disponible
+        try:
+            await conn[SINCRONIZACIONES].update_one(
+                {"_id": trabajo["_id"], "reclamado_por": self.trabajador},
+                {"$set": {"estado": EstadoSincronizacion.PENDIENTE.value},
+                 "$unset": {"reclamado_por": "", "reclamado_hasta": ""}},
+            )
+        except Exception as e:
+            logger.error(f"Error liberando la sincronización {trabajo['_id']}: {str(e)}")
+
+    async def ronda(self) -> int:
+        """Reclama sincronizaciones vencidas mientras quede capacidad libre."""
+        reclamadas = 0
+        while len(self._tareas) < self.concurrencia:
+            trabajo = await self._reclamar_vencida()
+            if trabajo is None:
+                break
+            # Se ocupan los límites antes de reclamar la siguiente, para que
+            # esta ya cuente al excluir proveedores y usuarios saturados
+            await self._ocupar(trabajo)
+            tarea = asyncio.create_task(self.ejecutar(trabajo, ocupado=True))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._terminada)
+            reclamadas += 1
+        return reclamadas
+
+    def _terminada(self, tarea: asyncio.Task) -> None:
+        self._tareas.discard(tarea)
+        # Hay capacidad libre: no se espera al siguiente intervalo
+        self._despertar.set()
+
+    def despertar(self) -> None:
+        self._despertar.set()
+
+    async def _bucle(self) -> None:
+        while True:
+            self._despertar.clear()
+            try:
+                await self.ronda()
+            except Exception as e:
+                logger.error(f"Error planificando sincronizaciones: {str(e)}")
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+    async def metricas(self) -> dict:
+        ahora = datetime.now(timezone.utc)
+        coleccion = conn[SINCRONIZACIONES]
+        vencidas, en_progreso, mas_antigua = await asyncio.gather(
+            coleccion.count_documents(filtro_vencidas(ahora)),
+            coleccion.count_documents({"estado": EN_PROGRESO}),
+            coleccion.find_one(
+                filtro_vencidas(ahora),
+                {"proxima_sincronizacion": 1},
+                sort=[("proxima_sincronizacion", 1)],
+            ),
+        )
+        retrasos, duraciones = list(self._retrasos), list(self._duraciones)
+        return {
+            "trabajador": self.trabajador,
+            "pendientes": vencidas,
+            "retraso_cola_segundos": (
+                (ahora - _utc(mas_antigua["proxima_sincronizacion"])).total_seconds()
+                if mas_antigua else 0.0
+            ),
+            "en_progreso": en_progreso,
+            "en_curso_trabajador": len(self._tareas),
+            "activas_por_proveedor": {
+                clave[1]: n for clave, n in self._activos.items() if clave[0] == "proveedor" and n
+            },
+            "retraso_medio_segundos": sum(retrasos) / len(retrasos) if retrasos else 0.0,
+            "retraso_maximo_segundos": max(retrasos, default=0.0),
+            "duracion_media_segundos": sum(duraciones) / len(duraciones) if duraciones else 0.0,
+            "completadas": self._contadores["completadas"],
+            "fallidas": self._contadores["fallidas"],
+            "abandonadas": self._contadores["abandonadas"],
+        }
+
+    async def iniciar(self) -> None:
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        tareas = list(self._tareas)
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        for proveedor in set(self.proveedores.values()):
+            await proveedor.cerrar()
+
+
+planificador_sincronizacion = PlanificadorSincronizacion(
+    crear_proveedores(),
+    INTERVALO_PLANIFICADOR,
+    CONCURRENCIA_SINCRONIZACION,
+    LIMITE_POR_PROVEEDOR,
+    LIMITE_POR_USUARIO,
+)
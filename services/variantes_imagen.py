@@ -0,0 +1,190 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from decouple import config
+
+from services.almacenamiento_imagenes import almacenamiento
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow es opcional: sin él se sirven siempre los originales
+    Image = None
+    features = None
+
+logger = logging.getLogger("variantes_imagen")
+
+ANCHOS_VARIANTES = tuple(
+    sorted(int(a) for a in str(config("ANCHOS_VARIANTES", default="160,320,640")).split(","))
+)
+PROCESOS_IMAGENES = config("PROCESOS_IMAGENES", default=2, cast=int)
+CALIDAD_VARIANTES = config("CALIDAD_VARIANTES", default=80, cast=int)
+
+TIPOS_MIME = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+EXTENSIONES = {"avif": ".avif", "webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+
+
+def _soporta(formato: str) -> bool:
+    if features is None:
+        return False
+    try:
+        return bool(features.check(formato))
+    except ValueError:
+        return False
+
+
+SOPORTA_WEBP = _soporta("webp")
+SOPORTA_AVIF = _soporta("avif")
+
+# Formatos modernos que se generan al subir una imagen
+FORMATOS_PRECALCULADOS = [
+    formato
+    for formato, soportado in (("webp", SOPORTA_WEBP), ("avif", SOPORTA_AVIF))
+    if soportado
+]
+
+
+class ImagenIlegible(Exception):
+    """El original no es una imagen que Pillow pueda decodificar."""
+
+
+def redimensionar(datos: bytes, ancho: int, formato: str, calidad: int) -> bytes:
+    """
+    Genera una variante de la imagen. Se ejecuta en un proceso del pool, por lo
+    que solo recibe y devuelve bytes.
+    """
+    with Image.open(io.BytesIO(datos)) as imagen:
+        # En JPEG permite decodificar directamente a una escala reducida
+        imagen.draft("RGB", (ancho, ancho * 4))
+        if imagen.width > ancho:
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            imagen = imagen.resize((ancho, alto), Image.LANCZOS)
+
+        if formato == "jpeg":
+            imagen = imagen.convert("RGB")
+        elif imagen.mode not in ("RGB", "RGBA"):
+            imagen = imagen.convert("RGBA")
+
+        salida = io.BytesIO()
+        imagen.save(salida, format=formato.upper(), quality=calidad)
+        return salida.getvalue()
+
+
+def ancho_normalizado(ancho: int) -> int:
+    """Ajusta el ancho pedido al menor ancho disponible que lo cubra."""
+    for disponible in ANCHOS_VARIANTES:
+        if disponible >= ancho:
+            return disponible
+    return ANCHOS_VARIANTES[-1]
+
+
+def formato_original(nombre: str) -> str:
+    return "png" if Path(nombre).suffix.lower() in (".png", ".gif") else "jpeg"
+
+
+def elegir_formato(nombre: str, accept: str) -> str:
+    """Elige el formato más ligero que acepte el cliente según la cabecera Accept."""
+    accept = accept or ""
+    if SOPORTA_AVIF and "image/avif" in accept:
+        return "avif"
+    if SOPORTA_WEBP and "image/webp" in accept:
+        return "webp"
+    return formato_original(nombre)
+
+
+def nombre_variante(nombre: str, ancho: int, formato: str) -> str:
+    # Se conserva la extensión del original: portada.jpg y portada.png son
+    # imágenes distintas y sus variantes no deben pisarse
+    return f"{nombre}_w{ancho}{EXTENSIONES[formato]}"
+
+
+class GeneradorVariantes:
+    """
+    Genera las variantes redimensionadas en un ProcessPoolExecutor para no
+    bloquear el bucle de eventos. Las peticiones simultáneas de la misma
+    variante comparten una única generación.
+    """
+
+    def __init__(self, procesos: int):
+        self.procesos = procesos
+        self._ejecutor: Optional[ProcessPoolExecutor] = None
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self._tareas = set()
+
+    @property
+    def disponible(self) -> bool:
+        return Image is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._ejecutor is None:
+            self._ejecutor = ProcessPoolExecutor(max_workers=self.procesos)
+        return self._ejecutor
+
+    async def _generar(self, nombre: str, ancho: int, formato: str) -> Optional[bytes]:
+        original = await almacenamiento.leer(nombre)
+        if original is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            datos = await loop.run_in_executor(
+                self._pool(), redimensionar, original, ancho, formato, CALIDAD_VARIANTES
+            )
+        except (OSError, Image.DecompressionBombError) as e:
+            # UnidentifiedImageError y los archivos truncados son OSError
+            logger.warning(f"No se puede generar la variante de {nombre}: {str(e)}")
+            raise ImagenIlegible(nombre) from e
+        await almacenamiento.guardar_bytes(
+            nombre_variante(nombre, ancho, formato), datos, TIPOS_MIME[formato]
+        )
+        return datos
+
+    async def generar(self, nombre: str, ancho: int, formato: str) -> Optional[bytes]:
+        """
+        Genera (y guarda en caché) una variante; devuelve None si no existe el
+        original y lanza ImagenIlegible si el original no se puede decodificar.
+        """
+        clave = nombre_variante(nombre, ancho, formato)
+        futuro = self._en_curso.get(clave)
+        if futuro is None:
+            futuro = asyncio.ensure_future(self._generar(nombre, ancho, formato))
+            self._en_curso[clave] = futuro
+            futuro.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        return await asyncio.shield(futuro)
+
+    async def _precalcular(self, nombre: str) -> None:
+        for ancho in ANCHOS_VARIANTES:
+            for formato in FORMATOS_PRECALCULADOS:
+                try:
+                    await self.generar(nombre, ancho, formato)
+                except ImagenIlegible:
+                    return
+                except Exception as e:
+                    logger.error(f"Error generando variante de {nombre}: {str(e)}")
+
+    def programar(self, nombre: str) -> None:
+        """Programa en segundo plano la generación de las variantes de una imagen nueva."""
+        if not self.disponible:
+            return
+        tarea = asyncio.create_task(self._precalcular(nombre))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def detener(self) -> None:
+        for tarea in list(self._tareas):
+            tarea.cancel()
+        if self._ejecutor is not None:
+            self._ejecutor.shutdown(wait=False, cancel_futures=True)
+            self._ejecutor = None
+
+
+generador_variantes = GeneradorVariantes(PROCESOS_IMAGENES)
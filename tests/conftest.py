@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+# Configuración de pruebas, antes de importar cualquier módulo de la API
+_temporal = Path(tempfile.mkdtemp(prefix="pruebas-api-"))
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("CLAVE_SECRETA", "clave-de-pruebas")
+os.environ.setdefault("BCRYPT_COSTO", "4")
+os.environ.setdefault("DIRECTORIO_EXPORTACIONES", str(_temporal / "exportaciones"))
+os.environ.setdefault("DIRECTORIO_NUBE_LOCAL", str(_temporal / "nube_local"))
+os.environ.setdefault("DIRECTORIO_IMAGENES", str(_temporal / "images"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockCollection
+
+# MongoDB en memoria: los módulos importan `conn` de config.db, así que se
+# sustituye antes de que se importen
+import config.db
+
+config.db.client = AsyncMongoMockClient()
+config.db.conn = config.db.client["misiontic"]
+
+from auth.cache_principales import cache_principales
+from services.limitador_tasa import limitador_tasa
+from main import app
+
+
+async def _bulk_write(self, operaciones, ordered=True, **kwargs):
+    # mongomock no reconoce las operaciones de esta versión de pymongo
+    for operacion in operaciones:
+        await self.update_one(operacion._filter, operacion._doc, upsert=operacion._upsert)
+
+
+AsyncMongoMockCollection.bulk_write = _bulk_write
+
+OPERACIONES_MONGO = (
+    "find", "find_one", "find_one_and_update", "count_documents", "aggregate",
+    "insert_one", "insert_many", "update_one", "update_many", "delete_one",
+    "delete_many", "bulk_write",
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def conn():
+    return config.db.conn
+
+
+@pytest.fixture(autouse=True)
+def base_de_datos_limpia():
+    yield
+    asyncio.run(config.db.client.drop_database("misiontic"))
+    cache_principales.limpiar()
+    for grupo in limitador_tasa.grupos:
+        grupo.buckets.clear()
+
+
+@pytest.fixture
+def cliente():
+    # Sin `with`: no se ejecuta el lifespan ni arrancan las tareas de fondo
+    return TestClient(app)
+
+
+@pytest.fixture
+def comandos(monkeypatch):
+    """Cuenta las operaciones enviadas a MongoDB, por (colección, operación)."""
+    contador = Counter()
+
+    def contar(nombre, original):
+        def envoltura(self, *args, **kwargs):
+            contador[(self.name, nombre)] += 1
+            return original(self, *args, **kwargs)
+        return envoltura
+
+    for nombre in OPERACIONES_MONGO:
+        monkeypatch.setattr(
+            AsyncMongoMockCollection, nombre, contar(nombre, getattr(AsyncMongoMockCollection, nombre))
+        )
+    return contador
+
+
+def registrar(cliente, correo="ana@ejemplo.com", contra="clave123", **datos) -> dict:
+    respuesta = cliente.post("/usuarios/guardar", json={
+        "nombres": "Ana",
+        "apellidos": "Pérez",
+        "correo": correo,
+        "contra": contra,
+        "pais": "Colombia",
+        "ciudad": "Cali",
+        **datos,
+    })
+    assert respuesta.status_code == 201, respuesta.text
+    return respuesta.json()
+
+
+def iniciar_sesion(cliente, correo="ana@ejemplo.com", contra="clave123") -> dict:
+    respuesta = cliente.post("/token", data={"username": correo, "password": contra})
+    assert respuesta.status_code == 200, respuesta.text
+    return {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+
+@pytest.fixture
+def cabeceras(cliente):
+    registrar(cliente)
+    return iniciar_sesion(cliente)
@@ -0,0 +1,23 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from services.analitica_ventas import VENTAS_POR_CLIENTE, VENTAS_POR_DIA, VENTAS_POR_DOCUMENTO, reconstruir_agregados
+
+
+@pytest.mark.anyio
+async def test_reconstruir_elimina_claves_sin_ventas(conn):
+    # Agregados de un documento cuyas ventas ya se borraron
+    await conn[VENTAS_POR_DOCUMENTO].insert_one({"_id": "borrado", "ventas": 3, "unidades": 3})
+    await conn[VENTAS_POR_DIA].insert_one({"_id": "2020-01-01", "ventas": 3, "unidades": 3})
+    await conn["ventas"].insert_one({
+        "id_documento": "doc-1", "titulo_documento": "Rayuela", "id_cliente": "c1", "nombre_cliente": "Ana",
+        "tipo_de_adquisicion": "compra", "cantidad": 2, "fecha": datetime(2024, 5, 1, tzinfo=timezone.utc),
+    })
+
+    await reconstruir_agregados()
+
+    assert await conn[VENTAS_POR_DOCUMENTO].distinct("_id") == ["doc-1"]
+    assert await conn[VENTAS_POR_DIA].distinct("_id") == ["2024-05-01"]
+    cliente = await conn[VENTAS_POR_CLIENTE].find_one({"_id": "c1"})
+    assert (cliente["ventas"], cliente["unidades"]) == (1, 2)
@@ -0,0 +1,48 @@
+import time
+
+from auth.cache_principales import CachePrincipales
+
+
+def usuario(n: int) -> dict:
+    return {"_id": f"id-{n}", "correo": f"u{n}@ejemplo.com"}
+
+
+def test_invalidar_por_id_o_correo_solo_toca_los_tokens_del_usuario():
+    cache = CachePrincipales(100, 60)
+    for n in range(3):
+        cache.guardar(f"token-{n}-a", usuario(n), None)
+        cache.guardar(f"token-{n}-b", usuario(n), None)
+
+    cache.invalidar_usuario(usuario_id="id-0")
+    cache.invalidar_usuario(correo="u1@ejemplo.com")
+
+    assert cache.obtener("token-0-a") is None and cache.obtener("token-0-b") is None
+    assert cache.obtener("token-1-a") is None and cache.obtener("token-1-b") is None
+    assert cache.obtener("token-2-a") == usuario(2)
+    assert set(cache._por_id) == {"id-2"} and set(cache._por_correo) == {"u2@ejemplo.com"}
+
+
+def test_indices_no_guardan_entradas_expulsadas_o_caducadas():
+    cache = CachePrincipales(10, 0.05)
+    for n in range(25):
+        cache.guardar(f"token-{n}", usuario(n), None)
+    assert sum(len(claves) for claves in cache._por_id.values()) == 10
+
+    time.sleep(0.1)
+    cache.guardar("nuevo", usuario(99), None)
+    assert set(cache._por_id) == {"id-99"} and set(cache._por_correo) == {"u99@ejemplo.com"}
+
+
+def test_modificar_el_usuario_devuelto_no_altera_la_cache():
+    cache = CachePrincipales(100, 60)
+    guardado = {**usuario(1), "rol": "USER", "permisos": ["leer"]}
+    cache.guardar("token", guardado, None)
+
+    # Ni el diccionario guardado ni el devuelto comparten estado con la caché
+    guardado["rol"] = "ADMIN"
+    primero = cache.obtener("token")
+    primero.pop("correo")
+    primero["permisos"].append("escribir")
+
+    assert cache.obtener("token") == {**usuario(1), "rol": "USER", "permisos": ["leer"]}
+    assert cache.obtener("token") is not cache.obtener("token")
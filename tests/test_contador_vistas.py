@@ -0,0 +1,45 @@
+import pytest
+from mongomock_motor import AsyncMongoMockCollection
+from pymongo.errors import BulkWriteError
+
+from services.contador_vistas import VISTAS_DIARIAS, VISTAS_DOCUMENTOS, ContadorVistas
+
+
+def fallar_una_vez(monkeypatch, coleccion: str, indice: int) -> None:
+    """El primer bulk_write en `coleccion` aplica todo salvo la operación `indice`."""
+    original = AsyncMongoMockCollection.bulk_write
+    fallado = []
+
+    async def bulk_write(self, operaciones, ordered=True, **kwargs):
+        if self.name != coleccion or fallado:
+            return await original(self, operaciones, ordered=ordered, **kwargs)
+        fallado.append(True)
+        await original(self, [op for i, op in enumerate(operaciones) if i != indice], ordered=ordered)
+        raise BulkWriteError({
+            "writeErrors": [{"index": indice, "code": 11000, "errmsg": "E11000"}],
+            "nInserted": 0,
+        })
+
+    monkeypatch.setattr(AsyncMongoMockCollection, "bulk_write", bulk_write)
+
+
+async def vistas(conn) -> tuple:
+    diarias = {d["documento_id"]: d["vistas"] for d in await conn[VISTAS_DIARIAS].find({}).to_list(10)}
+    totales = {d["_id"]: d["total"] for d in await conn[VISTAS_DOCUMENTOS].find({}).to_list(10)}
+    return diarias, totales
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("coleccion", [VISTAS_DIARIAS, VISTAS_DOCUMENTOS])
+async def test_fallo_parcial_no_cuenta_dos_veces(conn, monkeypatch, coleccion):
+    contador = ContadorVistas(10)
+    for documento_id, n in (("a", 3), ("b", 2), ("c", 1)):
+        for _ in range(n):
+            contador.registrar(documento_id)
+    fallar_una_vez(monkeypatch, coleccion, 1)
+
+    with pytest.raises(BulkWriteError):
+        await contador.volcar()
+    await contador.volcar()
+
+    assert await vistas(conn) == ({"a": 3, "b": 2, "c": 1}, {"a": 3, "b": 2, "c": 1})
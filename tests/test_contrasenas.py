@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from services.contrasenas import EjecutorContrasenas
+
+
+@pytest.mark.anyio
+async def test_peticion_cancelada_ocupa_la_cola_hasta_que_acaba_el_hilo():
+    ejecutor = EjecutorContrasenas(hilos=1, cola_maxima=1)
+    en_curso, liberar = threading.Event(), threading.Event()
+
+    def hash_lento():
+        en_curso.set()
+        liberar.wait(5)
+
+    try:
+        tarea = asyncio.create_task(ejecutor._ejecutar(hash_lento))
+        await asyncio.to_thread(en_curso.wait, 5)
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+
+        # El hilo sigue calculando: la cola sigue llena
+        assert ejecutor.pendientes == 1
+        with pytest.raises(HTTPException) as error:
+            await ejecutor._ejecutar(lambda: None)
+        assert error.value.status_code == 503
+
+        liberar.set()
+        for _ in range(100):
+            if ejecutor.pendientes == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert ejecutor.pendientes == 0
+        assert await ejecutor._ejecutar(lambda: "hecho") == "hecho"
+    finally:
+        liberar.set()
+        ejecutor.detener()
@@ -0,0 +1,58 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockCollection
+from pymongo.errors import BulkWriteError
+
+from services.difusiones import DIFUSIONES, MotorDifusiones
+from services.notificaciones import CONTADORES_NOTIFICACIONES
+
+
+def fallar_a_mitad_de_lote(monkeypatch, llamada: int, guardadas: int) -> None:
+    """
+    La `llamada`-ésima inserción de notificaciones falla en la posición
+    `guardadas`, como MongoDB: en orden se detiene ahí; sin orden sigue con el resto.
+    """
+    original = AsyncMongoMockCollection.insert_many
+    llamadas = []
+
+    async def insert_many(self, documentos, ordered=True, **kwargs):
+        if self.name != "notificaciones":
+            return await original(self, documentos, ordered=ordered, **kwargs)
+        llamadas.append(True)
+        if len(llamadas) != llamada:
+            return await original(self, documentos, ordered=ordered, **kwargs)
+        escritos = documentos[:guardadas] if ordered else documentos[:guardadas] + documentos[guardadas + 1:]
+        await original(self, escritos)
+        raise BulkWriteError({
+            "writeErrors": [{"index": guardadas, "code": 91, "errmsg": "apagando"}],
+            "nInserted": len(escritos),
+        })
+
+    monkeypatch.setattr(AsyncMongoMockCollection, "insert_many", insert_many)
+
+
+@pytest.mark.anyio
+async def test_difusion_reanudada_tras_fallo_parcial_notifica_a_todos_una_vez(conn, monkeypatch):
+    usuarios = [ObjectId() for _ in range(23)]
+    await conn["usuarios"].insert_many(
+        [{"_id": u, "correo": f"{i}@ejemplo.com", "pais": "Peru", "inactivo": False} for i, u in enumerate(usuarios)]
+    )
+    await conn[DIFUSIONES].insert_one({
+        "_id": ObjectId(), "titulo": "Aviso", "mensaje": "m", "tipo": "info", "segmento": {"pais": "Peru"},
+        "estado": "pendiente", "fecha_creacion": datetime.now(timezone.utc), "total": None, "enviadas": 0,
+    })
+    fallar_a_mitad_de_lote(monkeypatch, llamada=2, guardadas=3)
+    motor = MotorDifusiones(1, tamano_lote=5)
+
+    assert await motor.ejecutar(await motor.reclamar()) is False
+    assert await motor.ejecutar(await motor.reclamar()) is True
+
+    notificadas = Counter(n["usuario_id"] for n in await conn["notificaciones"].find({}).to_list(100))
+    assert notificadas == Counter(usuarios)
+    contadores = {c["_id"]: c["no_leidas"] for c in await conn[CONTADORES_NOTIFICACIONES].find({}).to_list(100)}
+    assert contadores == {u: 1 for u in usuarios}
+    difusion = await conn[DIFUSIONES].find_one({})
+    assert (difusion["estado"], difusion["enviadas"], difusion["intentos"]) == ("completada", 23, 1)
@@ -0,0 +1,125 @@
+import asyncio
+import types
+
+import pytest
+
+import services.estadisticas as estadisticas
+from services.estadisticas import InstantaneaCacheada, calcular_estadisticas, estadisticas_dashboard
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Reloj manual para la instantánea; el de asyncio no se toca."""
+    ahora = types.SimpleNamespace(valor=1000.0)
+    monkeypatch.setattr(estadisticas, "time", types.SimpleNamespace(monotonic=lambda: ahora.valor))
+    return ahora
+
+
+@pytest.fixture
+def dashboard_vacio(monkeypatch):
+    monkeypatch.setattr(estadisticas_dashboard, "_valor", None)
+    monkeypatch.setattr(estadisticas_dashboard, "_calculado", 0.0)
+    monkeypatch.setattr(estadisticas_dashboard, "_tarea", None)
+
+
+def contador_de_calculos():
+    calculos = []
+
+    async def calcular():
+        calculos.append(len(calculos) + 1)
+        await asyncio.sleep(0)
+        return {"version": len(calculos)}
+
+    return calculos, calcular
+
+
+@pytest.mark.anyio
+async def test_dashboard_se_calcula_con_una_sola_agregacion(conn, comandos):
+    await conn["documentos"].insert_many([
+        {"titulo": "Rayuela", "autor": "Cortázar", "categoria": "novela", "idioma": "es"},
+        {"titulo": "Ficciones", "autor": "Borges", "categoria": "cuento", "idioma": "es"},
+        {"titulo": "Dubliners", "autor": "Joyce", "categoria": "cuento", "idioma": "en"},
+    ])
+    comandos.clear()
+
+    datos = await calcular_estadisticas()
+
+    assert comandos[("documentos", "aggregate")] == 1
+    assert sum(n for (_, operacion), n in comandos.items() if operacion == "aggregate") == 1
+    assert datos["total_documentos"] == 3
+    assert datos["documentos_por_categoria"] == {"cuento": 2, "novela": 1}
+    assert datos["documentos_por_idioma"] == {"es": 2, "en": 1}
+    assert [d["titulo"] for d in datos["documentos_recientes"]] == ["Dubliners", "Ficciones", "Rayuela"]
+
+
+@pytest.mark.anyio
+async def test_lecturas_simultaneas_comparten_el_primer_calculo(reloj):
+    calculos, calcular = contador_de_calculos()
+    instantanea = InstantaneaCacheada(calcular, intervalo=30)
+
+    valores = await asyncio.gather(*[instantanea.obtener() for _ in range(10)])
+
+    assert calculos == [1]
+    assert valores == [{"version": 1}] * 10
+
+
+@pytest.mark.anyio
+async def test_dentro_del_intervalo_se_reutiliza_el_valor(reloj):
+    calculos, calcular = contador_de_calculos()
+    instantanea = InstantaneaCacheada(calcular, intervalo=30)
+    primero = await instantanea.obtener()
+
+    reloj.valor += 29
+    for _ in range(5):
+        assert await instantanea.obtener() is primero
+
+    assert calculos == [1]
+
+
+@pytest.mark.anyio
+async def test_al_caducar_sirve_el_anterior_y_recalcula_una_vez(reloj):
+    calculos, calcular = contador_de_calculos()
+    instantanea = InstantaneaCacheada(calcular, intervalo=30)
+    await instantanea.obtener()
+
+    reloj.valor += 30
+    # Las lecturas no esperan al cálculo: reciben el valor caducado
+    assert [await instantanea.obtener() for _ in range(5)] == [{"version": 1}] * 5
+    await instantanea._tarea
+
+    assert calculos == [1, 2]
+    assert await instantanea.obtener() == {"version": 2}
+
+
+@pytest.mark.anyio
+async def test_un_fallo_al_recalcular_conserva_el_valor_anterior(reloj):
+    calculos, calcular = contador_de_calculos()
+    instantanea = InstantaneaCacheada(calcular, intervalo=30)
+    await instantanea.obtener()
+
+    async def fallar():
+        raise RuntimeError("base de datos no disponible")
+
+    instantanea._calcular = fallar
+    reloj.valor += 30
+    await instantanea.obtener()
+    with pytest.raises(RuntimeError):
+        await instantanea._tarea
+
+    assert await instantanea.obtener() == {"version": 1}
+    # Sigue caducado: la siguiente lectura vuelve a intentarlo
+    instantanea._calcular = calcular
+    await instantanea.obtener()
+    await instantanea._tarea
+    assert await instantanea.obtener() == {"version": 2}
+
+
+def test_ruta_del_dashboard_sirve_la_instantanea(cliente, cabeceras, comandos, dashboard_vacio):
+    comandos.clear()
+
+    primera = cliente.get("/integracion/dashboard/estadisticas", headers=cabeceras)
+    segunda = cliente.get("/integracion/dashboard/estadisticas", headers=cabeceras)
+
+    assert primera.status_code == 200, primera.text
+    assert primera.json() == segunda.json()
+    assert comandos[("documentos", "aggregate")] == 1
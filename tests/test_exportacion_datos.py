@@ -0,0 +1,92 @@
+import asyncio
+import csv
+import gzip
+import io
+
+import pytest
+
+from services.exportacion_datos import COLUMNAS_DOCUMENTOS, CodificadorCSV, exportar
+
+CABECERA = [campo for campo, _ in COLUMNAS_DOCUMENTOS]
+DOCUMENTOS = [
+    {"_id": f"doc-{n}", "titulo": f"Título {n}", "autor": "Cortázar", "stock": n, "precio": 10 * n}
+    for n in range(1, 6)
+]
+
+
+class CursorContado:
+    """Cursor en memoria que anota cuántos documentos se han leído."""
+
+    def __init__(self, documentos):
+        self.documentos = documentos
+        self.leidos = 0
+        self.tamano_lote = None
+
+    def batch_size(self, tamano):
+        self.tamano_lote = tamano
+        return self
+
+    async def __aiter__(self):
+        for documento in self.documentos:
+            self.leidos += 1
+            yield documento
+
+
+def filas_csv(contenido: bytes):
+    return list(csv.reader(io.StringIO(contenido.decode("utf-8"))))
+
+
+def filas_esperadas():
+    return [
+        [d["_id"], d["titulo"], "Cortázar", "", "", "", "", "", str(d["stock"]), str(d["precio"]), "", ""]
+        for d in DOCUMENTOS
+    ]
+
+
+@pytest.mark.parametrize("comprimir", [False, True])
+def test_exportar_documentos_en_csv(cliente, cabeceras, conn, comprimir):
+    asyncio.run(conn["documentos"].insert_many([dict(d) for d in DOCUMENTOS]))
+
+    respuesta = cliente.get(
+        "/documentos/exportar", headers=cabeceras, params={"gzip": str(comprimir).lower()}
+    )
+
+    assert respuesta.status_code == 200, respuesta.text
+    contenido = respuesta.content
+    if comprimir:
+        assert respuesta.headers["content-type"] == "application/gzip"
+        assert respuesta.headers["content-disposition"].endswith('.csv.gz"')
+        contenido = gzip.decompress(contenido)
+    else:
+        assert respuesta.headers["content-type"].startswith("text/csv")
+    filas = filas_csv(contenido)
+    assert filas[0] == CABECERA
+    assert filas[1:] == filas_esperadas()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("comprimir", [False, True])
+async def test_exportar_lee_el_cursor_por_lotes(comprimir):
+    cursor = CursorContado(DOCUMENTOS)
+    partes, leidos = [], []
+
+    async for parte in exportar(cursor, CodificadorCSV(COLUMNAS_DOCUMENTOS, comprimir), tamano_lote=2):
+        partes.append(parte)
+        leidos.append(cursor.leidos)
+
+    # Cada parte sale en cuanto se completa su lote, sin leer el resto del cursor
+    assert cursor.tamano_lote == 2
+    assert leidos == [2, 4, 5, 5]
+    contenido = b"".join(partes)
+    if comprimir:
+        contenido = gzip.decompress(contenido)
+    else:
+        assert filas_csv(partes[0]) == [CABECERA, *filas_esperadas()[:2]]
+    assert filas_csv(contenido) == [CABECERA, *filas_esperadas()]
+
+
+@pytest.mark.anyio
+async def test_exportar_sin_filas_entrega_la_cabecera():
+    partes = [parte async for parte in exportar(CursorContado([]), CodificadorCSV(COLUMNAS_DOCUMENTOS, True))]
+
+    assert filas_csv(gzip.decompress(b"".join(partes))) == [CABECERA]
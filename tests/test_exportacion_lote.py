@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import iniciar_sesion, registrar
+
+
+@pytest.fixture
+def de_ana(cliente):
+    # Los primeros usuarios registrados son administradores
+    for correo in ("admin1@ejemplo.com", "admin2@ejemplo.com", "admin3@ejemplo.com"):
+        registrar(cliente, correo)
+    registrar(cliente, "ana@ejemplo.com")
+    return iniciar_sesion(cliente, "ana@ejemplo.com")
+
+
+def exportar(cliente, cabeceras, **cuerpo):
+    return cliente.post("/integracion/exportar/lote", headers=cabeceras, json={"formato": "json", **cuerpo})
+
+
+def test_lote_sin_ids_ni_filtros_se_rechaza(cliente, cabeceras):
+    assert exportar(cliente, cabeceras).status_code == 400
+    assert exportar(cliente, cabeceras, documento_ids=[]).status_code == 422
+
+
+def test_lote_limita_el_numero_de_ids(cliente, cabeceras):
+    ids = [f"doc-{i}" for i in range(501)]
+    assert exportar(cliente, cabeceras, documento_ids=ids).status_code == 422
+
+
+def test_lote_por_filtros_solo_para_administradores(cliente, de_ana):
+    cabeceras_admin = iniciar_sesion(cliente, "admin1@ejemplo.com")
+
+    assert exportar(cliente, de_ana, categoria="novela").status_code == 404
+    assert exportar(cliente, cabeceras_admin, categoria="novela").status_code == 200
+    assert exportar(cliente, de_ana, documento_ids=["doc-1"]).status_code == 200
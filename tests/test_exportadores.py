@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from services.exportadores import CacheArtefactos, FORMATOS
+from services.inventario import descontar_stock
+
+DOCUMENTO = {
+    "_id": "doc-1", "titulo": "Rayuela", "autor": "Cortázar", "precio": 20,
+    "stock": 7, "version": 2, "descripcion": "Novela",
+}
+
+
+@pytest.mark.parametrize("formato", ["json", "csv", "xml", "txt"])
+def test_exportacion_solo_incluye_los_campos_exportados(formato):
+    contenido = b"".join(FORMATOS[formato].generar(DOCUMENTO)).decode("utf-8")
+
+    assert "Rayuela" in contenido and "Cortázar" in contenido
+    assert "stock" not in contenido.lower()
+
+
+def test_json_conserva_los_tipos_de_los_campos():
+    datos = json.loads(b"".join(FORMATOS["json"].generar(DOCUMENTO)))
+
+    assert datos["id"] == "doc-1" and datos["precio"] == 20
+    assert "version" not in datos and "stock" not in datos
+
+
+def test_exportacion_repetida_se_sirve_desde_la_cache(cliente, cabeceras, conn, monkeypatch):
+    asyncio.run(conn["documentos"].insert_one(dict(DOCUMENTO)))
+    generaciones = []
+    original = FORMATOS["json"].generar
+    monkeypatch.setattr(FORMATOS["json"], "generar", lambda d: generaciones.append(d) or original(d))
+
+    def exportar():
+        respuesta = cliente.post(
+            "/integracion/exportar", headers=cabeceras, json={"documento_id": "doc-1", "formato": "json"}
+        )
+        assert respuesta.status_code == 200, respuesta.text
+        return respuesta.content
+
+    primera = exportar()
+    # Una venta cambia el stock sin cambiar la versión: la caché sigue siendo válida
+    asyncio.run(descontar_stock("doc-1", 3))
+    segunda = exportar()
+
+    assert len(generaciones) == 1
+    assert primera == segunda
+
+
+@pytest.mark.anyio
+async def test_cache_borra_las_exportaciones_usadas_hace_mas_tiempo(tmp_path):
+    cache = CacheArtefactos(tmp_path, 1, tamano_maximo=0)
+    tamano = len(b"".join(FORMATOS["txt"].generar(DOCUMENTO)))
+    cache.tamano_maximo = int(tamano * 2.5)
+    documentos = [{**DOCUMENTO, "_id": f"doc-{n}"} for n in range(3)]
+
+    primera = await cache.obtener(documentos[0], "txt")
+    segunda = await cache.obtener(documentos[1], "txt")
+    os.utime(primera, (100, 100))
+    os.utime(segunda, (200, 200))
+    # Un acierto renueva la primera, así que la siguiente en salir es la segunda
+    assert cache.existente(documentos[0], "txt") == primera
+    tercera = await cache.obtener(documentos[2], "txt")
+
+    assert primera.exists() and tercera.exists()
+    assert not segunda.exists()
+    assert cache.existente(documentos[1], "txt") is None
+
+
+@pytest.mark.anyio
+async def test_cache_conserva_la_exportacion_recien_generada_aunque_supere_el_limite(tmp_path):
+    cache = CacheArtefactos(tmp_path, 1, tamano_maximo=1)
+
+    ruta = await cache.obtener(DOCUMENTO, "txt")
+
+    assert ruta.is_file()
@@ -0,0 +1,186 @@
+import asyncio
+import io
+import os
+
+import pytest
+from cachetools import LRUCache
+from PIL import Image
+
+import routes.imagenes
+from routes.imagenes import _cabeceras_cache
+from services.almacenamiento_imagenes import AlmacenamientoImagenes, AlmacenamientoLocal, almacenamiento
+from services.variantes_imagen import generador_variantes, nombre_variante
+
+HASH = "ab" * 32
+METADATOS = {"modificado": 1700000000.0, "tamano": 1024}
+CONTENIDO = bytes(range(100))
+
+
+@pytest.fixture
+def cache_vacia(monkeypatch):
+    cache = LRUCache(maxsize=routes.imagenes.TAMANO_CACHE_IMAGENES, getsizeof=lambda e: len(e[0]))
+    monkeypatch.setattr(routes.imagenes, "cache_imagenes", cache)
+    return cache
+
+
+def guardar(datos=CONTENIDO):
+    # Nombre direccionado por contenido, distinto en cada prueba
+    nombre = f"{os.urandom(32).hex()}.jpg"
+    asyncio.run(almacenamiento.guardar_bytes(nombre, datos, "image/jpeg"))
+    return nombre
+
+
+class SinRutaLocal:
+    """Almacenamiento sin ruta en disco, como GridFS: se sirve con el flujo propio."""
+
+    def __init__(self, real):
+        self._real = real
+
+    def ruta(self, nombre):
+        return None
+
+    def __getattr__(self, atributo):
+        return getattr(self._real, atributo)
+
+
+def test_variantes_de_formato_tienen_etag_distinto():
+    etags = {
+        _cabeceras_cache(f"{HASH}.jpg_w320.{extension}", METADATOS)["ETag"]
+        for extension in ("webp", "avif", "jpg")
+    }
+    assert len(etags) == 3
+
+
+def test_variantes_de_originales_con_distinta_extension_no_coinciden():
+    nombres = {nombre_variante(f"portada.{extension}", 320, "webp") for extension in ("jpg", "jpeg", "png")}
+
+    assert nombres == {"portada.jpg_w320.webp", "portada.jpeg_w320.webp", "portada.png_w320.webp"}
+    assert routes.imagenes.PATRON_DIRECCIONADO.match(nombre_variante(f"{HASH}.png", 320, "avif"))
+
+
+def test_cada_original_sirve_sus_propias_variantes(cliente, cache_vacia):
+    colores = {"jpg": ("JPEG", (255, 0, 0)), "png": ("PNG", (0, 0, 255))}
+    for extension, (formato, color) in colores.items():
+        salida = io.BytesIO()
+        Image.new("RGB", (400, 300), color).save(salida, formato)
+        asyncio.run(
+            almacenamiento.guardar_bytes(f"portada.{extension}", salida.getvalue(), f"image/{formato.lower()}")
+        )
+    try:
+        variantes = {
+            extension: cliente.get(
+                f"/images/portada.{extension}", params={"w": 160}, headers={"Accept": "image/webp"}
+            )
+            for extension in colores
+        }
+    finally:
+        asyncio.run(generador_variantes.detener())
+
+    for extension, (_, color) in colores.items():
+        assert variantes[extension].status_code == 200
+        imagen = Image.open(io.BytesIO(variantes[extension].content)).convert("RGB")
+        assert imagen.width == 160
+        assert max(abs(a - b) for a, b in zip(imagen.getpixel((80, 60)), color)) < 10
+
+
+def test_variante_de_un_original_danado_sirve_el_original(cliente):
+    nombre = f"{'cd' * 32}.jpg"
+    danada = b"\xff\xd8\xff\xe0 no es un jpeg"
+    asyncio.run(almacenamiento.guardar_bytes(nombre, danada, "image/jpeg"))
+    try:
+        respuesta = cliente.get(f"/images/{nombre}", params={"w": 160}, headers={"Accept": "image/webp"})
+    finally:
+        asyncio.run(generador_variantes.detener())
+
+    assert respuesta.status_code == 200
+    assert respuesta.content == danada
+
+
+def test_almacenamiento_exige_implementar_la_interfaz(tmp_path):
+    class SinFlujo(AlmacenamientoLocal):
+        flujo = AlmacenamientoImagenes.flujo
+
+    with pytest.raises(TypeError):
+        AlmacenamientoImagenes()
+    with pytest.raises(TypeError):
+        SinFlujo(tmp_path)
+
+
+@pytest.mark.parametrize("desde_memoria", [True, False])
+def test_rango_de_bytes_devuelve_contenido_parcial(cliente, cache_vacia, monkeypatch, desde_memoria):
+    if not desde_memoria:
+        monkeypatch.setattr(routes.imagenes, "TAMANO_MAXIMO_EN_CACHE", 10)
+        monkeypatch.setattr(routes.imagenes, "almacenamiento", SinRutaLocal(almacenamiento))
+    nombre = guardar()
+
+    parcial = cliente.get(f"/images/{nombre}", headers={"Range": "bytes=10-19"})
+    sufijo = cliente.get(f"/images/{nombre}", headers={"Range": "bytes=-5"})
+    abierto = cliente.get(f"/images/{nombre}", headers={"Range": "bytes=95-"})
+
+    assert parcial.status_code == 206
+    assert parcial.content == CONTENIDO[10:20]
+    assert parcial.headers["content-range"] == "bytes 10-19/100"
+    assert parcial.headers["content-length"] == "10"
+    assert sufijo.status_code == 206 and sufijo.content == CONTENIDO[-5:]
+    assert abierto.status_code == 206 and abierto.content == CONTENIDO[95:]
+    assert (nombre in cache_vacia) is desde_memoria
+
+
+@pytest.mark.parametrize("rango", ["bytes=100-", "bytes=150-200", "bytes=-0"])
+def test_rango_fuera_de_la_imagen_responde_416(cliente, cache_vacia, rango):
+    nombre = guardar()
+
+    respuesta = cliente.get(f"/images/{nombre}", headers={"Range": rango})
+
+    assert respuesta.status_code == 416
+    assert respuesta.headers["content-range"] == "bytes */100"
+
+
+def test_rango_con_if_range_obsoleto_devuelve_la_imagen_completa(cliente, cache_vacia):
+    nombre = guardar()
+
+    respuesta = cliente.get(
+        f"/images/{nombre}", headers={"Range": "bytes=0-9", "If-Range": '"otra-version"'}
+    )
+
+    assert respuesta.status_code == 200
+    assert respuesta.content == CONTENIDO
+
+
+def test_if_none_match_con_el_etag_actual_responde_304(cliente, cache_vacia):
+    nombre = guardar()
+    etag = cliente.get(f"/images/{nombre}").headers["etag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"otro", {etag}', "*"):
+        respuesta = cliente.get(f"/images/{nombre}", headers={"If-None-Match": if_none_match})
+        assert respuesta.status_code == 304, if_none_match
+        assert respuesta.content == b""
+        assert respuesta.headers["etag"] == etag
+
+    distinto = cliente.get(f"/images/{nombre}", headers={"If-None-Match": '"otro"'})
+    assert distinto.status_code == 200 and distinto.content == CONTENIDO
+
+
+def test_cache_de_imagenes_descarta_la_usada_hace_mas_tiempo(cliente, monkeypatch):
+    # Caben dos imágenes de 100 bytes
+    cache = LRUCache(maxsize=250, getsizeof=lambda e: len(e[0]))
+    monkeypatch.setattr(routes.imagenes, "cache_imagenes", cache)
+    primera, segunda, tercera = guardar(), guardar(), guardar()
+
+    cliente.get(f"/images/{primera}")
+    cliente.get(f"/images/{segunda}")
+    # Leer la primera la marca como reciente: la que sale es la segunda
+    cliente.get(f"/images/{primera}")
+    cliente.get(f"/images/{tercera}")
+
+    assert set(cache) == {primera, tercera}
+    assert cliente.get(f"/images/{segunda}").content == CONTENIDO
+    assert set(cache) == {tercera, segunda}
+
+
+def test_imagen_grande_no_entra_en_la_cache(cliente, cache_vacia, monkeypatch):
+    monkeypatch.setattr(routes.imagenes, "TAMANO_MAXIMO_EN_CACHE", 99)
+    nombre = guardar()
+
+    assert cliente.get(f"/images/{nombre}").content == CONTENIDO
+    assert nombre not in cache_vacia
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from config.indices import _convertir_fechas
+
+
+@pytest.fixture
+def hora_de_bogota():
+    anterior = os.environ.get("TZ")
+    os.environ["TZ"] = "America/Bogota"
+    time.tzset()
+    yield
+    if anterior is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = anterior
+    time.tzset()
+
+
+def utc(fecha: datetime) -> datetime:
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+def test_fechas_de_texto_sin_zona_se_convierten_desde_hora_local(conn, hora_de_bogota):
+    asyncio.run(conn["recordatorios"].insert_many([
+        {"_id": 1, "proxima_ejecucion": "2024-05-01T10:00:00", "fecha_creacion": "2024-04-30T23:30:00.123456"},
+        {"_id": 2, "proxima_ejecucion": "2024-05-01T10:00:00+02:00"},
+        {"_id": 3, "proxima_ejecucion": "mañana"},
+    ]))
+
+    asyncio.run(_convertir_fechas("recordatorios", ("proxima_ejecucion", "fecha_creacion")))
+
+    documentos = {d["_id"]: d for d in asyncio.run(conn["recordatorios"].find({}).to_list(None))}
+    assert utc(documentos[1]["proxima_ejecucion"]) == datetime(2024, 5, 1, 15, tzinfo=timezone.utc)
+    assert utc(documentos[1]["fecha_creacion"]) == datetime(2024, 5, 1, 4, 30, 0, 123000, tzinfo=timezone.utc)
+    assert utc(documentos[2]["proxima_ejecucion"]) == datetime(2024, 5, 1, 8, tzinfo=timezone.utc)
+    assert documentos[3]["proxima_ejecucion"] == "mañana"
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import routes.registros
+from conftest import iniciar_sesion, registrar
+from main import app
+from services.inventario import descontar_stock
+
+
+@pytest.mark.anyio
+async def test_compras_concurrentes_nunca_dejan_stock_negativo(conn):
+    await conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela", "stock": 50})
+
+    resultados = await asyncio.gather(
+        *[descontar_stock("doc-1", 1 + i % 3) for i in range(300)], return_exceptions=True
+    )
+
+    vendidas = sum(1 + i % 3 for i, r in enumerate(resultados) if not isinstance(r, BaseException))
+    rechazos = [r for r in resultados if isinstance(r, BaseException)]
+    documento = await conn["documentos"].find_one({"_id": "doc-1"})
+    assert all(isinstance(r, HTTPException) and r.status_code == 409 for r in rechazos)
+    assert documento["stock"] >= 0
+    assert vendidas + documento["stock"] == 50
+
+
+def reservar(cliente, cabeceras, id_cliente: str) -> str:
+    respuesta = cliente.post("/ventas/reservas", headers=cabeceras, json={
+        "id_cliente": id_cliente, "nombre_cliente": "Ana", "id_documento": "doc-1", "cantidad": 2,
+    })
+    assert respuesta.status_code == 201, respuesta.text
+    return respuesta.json()["_id"]
+
+
+@pytest.fixture
+def documento(conn):
+    asyncio.run(conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela", "stock": 5}))
+
+
+def test_solo_el_cliente_confirma_o_cancela_su_reserva(cliente, documento):
+    # Los primeros usuarios registrados son administradores
+    for correo in ("admin1@ejemplo.com", "admin2@ejemplo.com"):
+        registrar(cliente, correo)
+    ana = registrar(cliente, "ana@ejemplo.com")
+    registrar(cliente, "beto@ejemplo.com")
+    de_ana = iniciar_sesion(cliente, "ana@ejemplo.com")
+    de_beto = iniciar_sesion(cliente, "beto@ejemplo.com")
+    reserva_id = reservar(cliente, de_ana, ana["_id"])
+
+    assert cliente.post(f"/ventas/reservas/{reserva_id}/confirmar", headers=de_beto).status_code == 404
+    assert cliente.delete(f"/ventas/reservas/{reserva_id}", headers=de_beto).status_code == 404
+    assert cliente.post(
+        f"/ventas/reservas/{reserva_id}/confirmar", headers={"Authorization": "Bearer cualquiera"}
+    ).status_code == 401
+    assert cliente.post(f"/ventas/reservas/{reserva_id}/confirmar", headers=de_ana).status_code == 201
+
+
+def test_reserva_vuelve_a_pendiente_si_falla_la_venta(cliente, cabeceras, documento, conn, monkeypatch):
+    usuario = asyncio.run(conn["usuarios"].find_one({"correo": "ana@ejemplo.com"}))
+    reserva_id = reservar(cliente, cabeceras, str(usuario["_id"]))
+
+    async def fallar(ventas):
+        raise RuntimeError("MongoDB no disponible")
+
+    monkeypatch.setattr(routes.registros, "_insertar_ventas", fallar)
+    respuesta = TestClient(app, raise_server_exceptions=False).post(
+        f"/ventas/reservas/{reserva_id}/confirmar", headers=cabeceras
+    )
+
+    assert respuesta.status_code == 500
+    reserva = asyncio.run(conn["reservas"].find_one({}))
+    documento = asyncio.run(conn["documentos"].find_one({"_id": "doc-1"}))
+    assert reserva["estado"] == "pendiente"
+    assert documento["stock"] == 3
+    assert asyncio.run(conn["ventas"].count_documents({})) == 0
+
+
+def test_reserva_a_nombre_de_otro_cliente_queda_a_nombre_de_quien_reserva(cliente, documento, conn):
+    for correo in ("admin1@ejemplo.com", "admin2@ejemplo.com", "admin3@ejemplo.com"):
+        registrar(cliente, correo)
+    ana = registrar(cliente, "ana@ejemplo.com")
+    beto = registrar(cliente, "beto@ejemplo.com")
+    de_ana = iniciar_sesion(cliente, "ana@ejemplo.com")
+    de_beto = iniciar_sesion(cliente, "beto@ejemplo.com")
+    de_admin = iniciar_sesion(cliente, "admin1@ejemplo.com")
+
+    reserva_id = reservar(cliente, de_beto, ana["_id"])
+    reserva = asyncio.run(conn["reservas"].find_one({"_id": ObjectId(reserva_id)}))
+    assert reserva["id_cliente"] == beto["_id"]
+    # Ana no la ve como suya y Beto sí puede cancelarla
+    assert cliente.delete(f"/ventas/reservas/{reserva_id}", headers=de_ana).status_code == 404
+    assert cliente.delete(f"/ventas/reservas/{reserva_id}", headers=de_beto).status_code == 204
+
+    reserva_id = reservar(cliente, de_admin, ana["_id"])
+    reserva = asyncio.run(conn["reservas"].find_one({"_id": ObjectId(reserva_id)}))
+    assert reserva["id_cliente"] == ana["_id"]
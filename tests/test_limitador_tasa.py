@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Form
+
+from services import limitador_tasa as modulo
+from services.limitador_tasa import GrupoLimite, LimitadorTasa, LimitadorTasaMiddleware
+
+
+def aplicacion(limitador: LimitadorTasa) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/token")
+    async def token(username: str = Form(...), password: str = Form(...)):
+        # El formulario llega completo a la ruta después de leerlo el middleware
+        return {"username": username}
+
+    app.add_middleware(LimitadorTasaMiddleware, limitador=limitador)
+    return app
+
+
+async def iniciar_sesion(app, ip: str, correo: str) -> httpx.Response:
+    transporte = httpx.ASGITransport(app=app, client=(ip, 1234))
+    async with httpx.AsyncClient(transport=transporte, base_url="http://api") as cliente:
+        return await cliente.post("/token", data={"username": correo, "password": "x"})
+
+
+@pytest.mark.anyio
+async def test_login_se_limita_por_cuenta_aunque_cambie_la_ip():
+    grupo = GrupoLimite("login", 10, 3, 32, rutas=("/token",), campo_cuenta="username")
+    app = aplicacion(LimitadorTasa([grupo]))
+
+    codigos = [(await iniciar_sesion(app, f"10.0.0.{i}", "Ana@Ejemplo.com")).status_code for i in range(5)]
+    otra_cuenta = await iniciar_sesion(app, "10.0.0.99", "beto@ejemplo.com")
+
+    assert codigos == [200, 200, 200, 429, 429]
+    assert otra_cuenta.status_code == 200
+    assert otra_cuenta.json() == {"username": "beto@ejemplo.com"}
+
+
+@pytest.mark.anyio
+async def test_sincronizar_envia_solo_lo_pendiente_en_un_bulk_write(conn, comandos, monkeypatch):
+    monkeypatch.setattr(modulo, "SINCRONIZAR_MONGO", True)
+    grupo = GrupoLimite("ia", 60, 10, 8, prefijos=("/ia/",))
+    limitador = LimitadorTasa([grupo])
+    for clave in ("a", "b", "c"):
+        grupo.consumir([(clave, 1)])
+    await limitador.sincronizar()
+    # Otro worker consume 4 tokens de "a"; "b" y "c" quedan inactivas
+    ventana = int(time.time() // modulo.VENTANA_SINCRONIZACION)
+    await conn["limites_tasa"].update_one({"_id": f"ia|a|{ventana}"}, {"$inc": {"n": 4}})
+    grupo.consumir([("b", 1)])
+    tokens_a = grupo.buckets["a"].tokens
+    comandos.clear()
+
+    await limitador.sincronizar()
+
+    assert comandos[("limites_tasa", "bulk_write")] == 1
+    assert comandos[("limites_tasa", "find")] == 1
+    assert comandos[("limites_tasa", "find_one_and_update")] == 0
+    # Solo "b" tenía consumo pendiente
+    assert comandos[("limites_tasa", "update_one")] == 1
+    assert grupo.buckets["a"].tokens == pytest.approx(tokens_a - 4)
+    contadores = await conn["limites_tasa"].find({}).to_list(10)
+    assert sorted(c["n"] for c in contadores) == [1, 2, 5]
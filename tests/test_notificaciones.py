@@ -0,0 +1,118 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from bson import ObjectId
+
+from config.indices import MIGRACIONES, _crear_contadores_notificaciones
+from models.Notificacion import TipoNotificacion
+from services.notificaciones import (
+    CONTADORES_NOTIFICACIONES,
+    centro_notificaciones,
+    contar_no_leidas,
+    flujo_notificaciones,
+    guardar_notificacion,
+    nueva_notificacion,
+)
+
+
+def notificacion(usuario_id, _id: str) -> dict:
+    return {**nueva_notificacion(usuario_id, TipoNotificacion.INFO, _id, "m"), "_id": ObjectId(_id)}
+
+
+async def siguiente_evento(flujo) -> str:
+    return await asyncio.wait_for(flujo.__anext__(), 2)
+
+
+@pytest.mark.anyio
+async def test_flujo_entrega_ids_menores_que_los_reenviados(conn):
+    usuario_id = ObjectId()
+    vista = notificacion(usuario_id, "65a000000000000000000001")
+    reenviada = notificacion(usuario_id, "65a000000000000000000003")
+    await conn["notificaciones"].insert_many([vista, reenviada])
+
+    flujo = flujo_notificaciones(usuario_id, str(vista["_id"]))
+    try:
+        assert (await siguiente_evento(flujo)).startswith("retry:")
+        assert (await siguiente_evento(flujo)).startswith(f"id: {reenviada['_id']}")
+
+        # La reenviada llega otra vez por el change stream y otra creada en
+        # otro proceso tiene un id menor que ella
+        remota = notificacion(usuario_id, "65a000000000000000000002")
+        centro_notificaciones.publicar(reenviada)
+        centro_notificaciones.publicar(remota)
+
+        assert (await siguiente_evento(flujo)).startswith(f"id: {remota['_id']}")
+    finally:
+        await flujo.aclose()
+
+
+@pytest.mark.anyio
+async def test_reconexion_reenvia_las_de_id_menor_creadas_a_la_vez(conn):
+    usuario_id = ObjectId()
+    vista = notificacion(usuario_id, "65a000000000000000000005")
+    # Creada en otro proceso en el mismo segundo, con un ObjectId menor
+    remota = {**notificacion(usuario_id, "65a000000000000000000004"), "fecha_creacion": vista["fecha_creacion"]}
+    antigua = {
+        **notificacion(usuario_id, "65a000000000000000000001"),
+        "fecha_creacion": vista["fecha_creacion"] - timedelta(hours=1),
+    }
+    await conn["notificaciones"].insert_many([antigua, remota, vista])
+
+    flujo = flujo_notificaciones(usuario_id, str(vista["_id"]))
+    try:
+        assert (await siguiente_evento(flujo)).startswith("retry:")
+        assert (await siguiente_evento(flujo)).startswith(f"id: {remota['_id']}")
+
+        # Lo reenviado que llega después por el change stream no se repite
+        nueva = notificacion(usuario_id, "65a000000000000000000009")
+        centro_notificaciones.publicar(remota)
+        centro_notificaciones.publicar(nueva)
+        assert (await siguiente_evento(flujo)).startswith(f"id: {nueva['_id']}")
+    finally:
+        await flujo.aclose()
+
+
+async def insertar_no_leidas(conn, usuario_id, n: int) -> None:
+    await conn["notificaciones"].insert_many(
+        [nueva_notificacion(usuario_id, TipoNotificacion.INFO, f"antigua {i}", "m") for i in range(n)]
+    )
+
+
+@pytest.mark.anyio
+async def test_migracion_de_contadores_no_pisa_incrementos_y_se_hace_una_vez(conn):
+    usuario_id = ObjectId()
+    await insertar_no_leidas(conn, usuario_id, 3)
+    # Otro worker ya tiene el contador al día y lo incrementa antes de migrar
+    await conn[CONTADORES_NOTIFICACIONES].insert_one({"_id": usuario_id, "no_leidas": 3, "contado": True})
+    await guardar_notificacion(nueva_notificacion(usuario_id, TipoNotificacion.INFO, "nueva", "m"))
+
+    await _crear_contadores_notificaciones()
+    assert await contar_no_leidas(usuario_id) == 4
+    assert await conn[MIGRACIONES].count_documents({"_id": CONTADORES_NOTIFICACIONES}) == 1
+
+    otro = ObjectId()
+    await insertar_no_leidas(conn, otro, 2)
+    await _crear_contadores_notificaciones()
+    assert await conn[CONTADORES_NOTIFICACIONES].find_one({"_id": otro}) is None
+
+
+@pytest.mark.anyio
+async def test_contador_creado_por_incremento_se_reconcilia(conn):
+    usuario_id = ObjectId()
+    await insertar_no_leidas(conn, usuario_id, 3)
+    # Sin migrar, la primera notificación nueva crea el contador a 1
+    await guardar_notificacion(nueva_notificacion(usuario_id, TipoNotificacion.INFO, "nueva", "m"))
+
+    assert await contar_no_leidas(usuario_id) == 4
+    assert (await conn[CONTADORES_NOTIFICACIONES].find_one({"_id": usuario_id}))["no_leidas"] == 4
+
+
+@pytest.mark.anyio
+async def test_contador_negativo_se_reconcilia(conn):
+    usuario_id = ObjectId()
+    await insertar_no_leidas(conn, usuario_id, 2)
+    await conn[CONTADORES_NOTIFICACIONES].insert_one({"_id": usuario_id, "no_leidas": -3, "contado": True})
+
+    assert await contar_no_leidas(usuario_id) == 2
+    assert (await conn[CONTADORES_NOTIFICACIONES].find_one({"_id": usuario_id}))["no_leidas"] == 2
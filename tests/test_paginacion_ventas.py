@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+
+def sembrar(conn, *ventas):
+    """Inserta las ventas en orden y devuelve sus ids, de la más antigua a la más reciente."""
+    documentos = [{"_id": ObjectId(), "cantidad": 1, **venta} for venta in ventas]
+    asyncio.run(conn["ventas"].insert_many(documentos))
+    return [str(documento["_id"]) for documento in documentos]
+
+
+def recorrer(cliente, cabeceras, ruta, tamano):
+    """Sigue el cursor `siguiente` hasta el final y devuelve los ids de cada página."""
+    paginas, despues = [], None
+    while True:
+        params = {"tamano": tamano, **({"despues": despues} if despues else {})}
+        respuesta = cliente.get(ruta, headers=cabeceras, params=params)
+        assert respuesta.status_code == 200, respuesta.text
+        cuerpo = respuesta.json()
+        paginas.append([venta["_id"] for venta in cuerpo["ventas"]])
+        despues = cuerpo["siguiente"]
+        if despues is None:
+            return paginas
+        assert despues == paginas[-1][-1]
+
+
+def test_ventas_por_tipo_se_recorren_de_la_mas_reciente_a_la_mas_antigua(cliente, cabeceras, conn):
+    ids = sembrar(conn, *[
+        {"tipo_de_adquisicion": "compra" if n % 3 else "prestamo", "id_documento": "doc-1"}
+        for n in range(1, 8)
+    ])
+    compras = [id_ for n, id_ in enumerate(ids, start=1) if n % 3]
+
+    paginas = recorrer(cliente, cabeceras, "/ventas/tipo/compra", tamano=2)
+
+    assert paginas == [compras[::-1][0:2], compras[::-1][2:4], compras[::-1][4:]]
+
+
+@pytest.mark.parametrize("total", [3, 4])
+def test_la_ultima_pagina_no_tiene_siguiente(cliente, cabeceras, conn, total):
+    ids = sembrar(conn, *[{"tipo_de_adquisicion": "compra"} for _ in range(total)])
+
+    paginas = recorrer(cliente, cabeceras, "/ventas/tipo/compra", tamano=2)
+
+    # Con un número exacto de páginas no se devuelve una página vacía de más
+    assert [len(pagina) for pagina in paginas] == ([2, 1] if total == 3 else [2, 2])
+    assert sum(paginas, []) == ids[::-1]
+
+
+def test_ventas_por_id_de_documento_y_por_cliente(cliente, cabeceras, conn):
+    ids = sembrar(
+        conn,
+        {"id_documento": "doc-1", "id_cliente": "ana"},
+        {"id_documento": "doc-2", "id_cliente": "ana"},
+        {"id_documento": "doc-1", "id_cliente": "beto"},
+        {"id_documento": "doc-1", "id_cliente": "ana"},
+    )
+
+    assert recorrer(cliente, cabeceras, "/ventas/documento/id/doc-1", tamano=2) == [
+        [ids[3], ids[2]], [ids[0]],
+    ]
+    assert recorrer(cliente, cabeceras, "/ventas/usuario/ana", tamano=2) == [
+        [ids[3], ids[1]], [ids[0]],
+    ]
+    assert cliente.get("/ventas/documento/id/doc-9", headers=cabeceras).status_code == 404
+    assert cliente.get("/ventas/usuario/carla", headers=cabeceras).status_code == 404
+
+
+def test_ventas_por_titulo_incluye_todos_los_documentos_con_ese_titulo(cliente, cabeceras, conn):
+    asyncio.run(conn["documentos"].insert_many([
+        {"_id": "doc-1", "titulo": "Rayuela"},
+        {"_id": "doc-2", "titulo": "Rayuela"},
+        {"_id": "doc-3", "titulo": "Ficciones"},
+    ]))
+    ids = sembrar(conn, *[{"id_documento": f"doc-{n}"} for n in (1, 3, 2, 1, 3)])
+
+    paginas = recorrer(cliente, cabeceras, "/ventas/documento/Rayuela", tamano=2)
+
+    assert paginas == [[ids[3], ids[2]], [ids[0]]]
+    assert cliente.get("/ventas/documento/Cien años", headers=cabeceras).status_code == 404
+
+
+def test_pagina_posterior_a_la_ultima_venta_esta_vacia(cliente, cabeceras, conn):
+    ids = sembrar(conn, {"tipo_de_adquisicion": "compra"})
+
+    respuesta = cliente.get("/ventas/tipo/compra", headers=cabeceras, params={"despues": ids[0]})
+
+    # Con `despues` no se responde 404: el recorrido simplemente ha terminado
+    assert respuesta.status_code == 200
+    assert respuesta.json() == {"ventas": [], "siguiente": None}
+
+
+def test_despues_no_valido_se_rechaza(cliente, cabeceras):
+    respuesta = cliente.get("/ventas/tipo/compra", headers=cabeceras, params={"despues": "abc"})
+
+    assert respuesta.status_code == 400
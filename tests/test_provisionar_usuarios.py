@@ -0,0 +1,95 @@
+import argparse
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import scripts.provisionar_usuarios as provisionar_usuarios
+
+COLUMNAS = ("nombres", "apellidos", "correo", "contra")
+
+
+@pytest.fixture
+def hasheadas(monkeypatch, conn):
+    """Ejecuta el script contra la base en memoria y anota cada contraseña hasheada."""
+    contras = []
+
+    def hashear(lote):
+        contras.extend(lote)
+        return [f"hash-{contra}" for contra in lote]
+
+    monkeypatch.setattr(provisionar_usuarios, "db", conn)
+    # Hilos en lugar de procesos: el parche de la función y la base en memoria
+    # no llegan a los procesos hijos
+    monkeypatch.setattr(provisionar_usuarios, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(provisionar_usuarios, "hashear_contras", hashear)
+    return contras
+
+
+def escribir_csv(ruta, correos):
+    with open(ruta, "w", newline="", encoding="utf-8") as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(COLUMNAS)
+        for correo in correos:
+            escritor.writerow(("Ana", "Pérez", correo, f"clave-{correo}"))
+
+
+def argumentos(ruta, lote=2):
+    return argparse.Namespace(csv=str(ruta), lote=lote, procesos=2, punto_control=None, reiniciar=False)
+
+
+@pytest.mark.anyio
+async def test_correos_repetidos_se_omiten_y_se_cuentan(tmp_path, conn, hasheadas, capsys):
+    await conn["usuarios"].insert_one({"correo": "carla@ejemplo.com", "contra": "anterior"})
+    ruta = tmp_path / "usuarios.csv"
+    # beto se repite en el mismo lote y ana en lotes distintos; carla ya existía
+    escribir_csv(ruta, [
+        "ana@ejemplo.com", "carla@ejemplo.com",
+        "beto@ejemplo.com", "beto@ejemplo.com",
+        "ana@ejemplo.com",
+    ])
+
+    await provisionar_usuarios.provisionar(argumentos(ruta))
+
+    assert "creados 2, existentes 3, inválidos 0" in capsys.readouterr().out
+    correos = [usuario["correo"] async for usuario in conn["usuarios"].find({}, {"correo": 1})]
+    assert sorted(correos) == ["ana@ejemplo.com", "beto@ejemplo.com", "carla@ejemplo.com"]
+    # El correo ya registrado no se hashea ni se sobrescribe
+    assert "clave-carla@ejemplo.com" not in hasheadas
+    carla = await conn["usuarios"].find_one({"correo": "carla@ejemplo.com"})
+    assert carla["contra"] == "anterior"
+
+
+@pytest.mark.anyio
+async def test_relanzar_continua_desde_el_punto_de_control(tmp_path, conn, hasheadas, monkeypatch):
+    ruta = tmp_path / "usuarios.csv"
+    correos = [f"usuario{i}@ejemplo.com" for i in range(1, 7)]
+    escribir_csv(ruta, correos)
+    punto_control = tmp_path / "usuarios.csv.checkpoint"
+
+    insertar = provisionar_usuarios.insertar_lote
+    insertados = []
+
+    async def insertar_y_fallar(usuarios, estadisticas):
+        # Se interrumpe en el tercer lote, con los dos primeros ya guardados
+        if len(insertados) == 2:
+            raise RuntimeError("conexión perdida")
+        insertados.append(usuarios)
+        await insertar(usuarios, estadisticas)
+
+    monkeypatch.setattr(provisionar_usuarios, "insertar_lote", insertar_y_fallar)
+    with pytest.raises(RuntimeError):
+        await provisionar_usuarios.provisionar(argumentos(ruta))
+
+    assert json.loads(punto_control.read_text()) == {"filas": 4}
+    assert await conn["usuarios"].count_documents({}) == 4
+
+    monkeypatch.setattr(provisionar_usuarios, "insertar_lote", insertar)
+    hasheadas.clear()
+    await provisionar_usuarios.provisionar(argumentos(ruta))
+
+    # Solo se leen las filas pendientes y el progreso se borra al terminar
+    assert hasheadas == ["clave-usuario5@ejemplo.com", "clave-usuario6@ejemplo.com"]
+    assert await conn["usuarios"].count_documents({}) == 6
+    assert not punto_control.exists()
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+from utils.proyeccion import construir_proyeccion
+
+
+@pytest.mark.parametrize(
+    "fields, esperada",
+    [
+        ("autor,autor.nombre", {"autor": 1}),
+        ("autor.nombre,titulo,autor", {"titulo": 1, "autor": 1}),
+        ("a.b.c,a.b,a.bc", {"a.b": 1, "a.bc": 1}),
+        ("autor,autor", {"autor": 1}),
+    ],
+)
+def test_campos_solapados_se_reducen_al_padre(fields, esperada):
+    assert construir_proyeccion(fields) == esperada
+
+
+def test_proyeccion_solapada_es_valida_en_la_consulta(cliente, cabeceras, conn):
+    asyncio.run(conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela", "autor": {"nombre": "Julio"}}))
+
+    respuesta = cliente.get("/documentos/doc-1", headers=cabeceras, params={"fields": "autor,autor.nombre"})
+
+    assert respuesta.status_code == 200, respuesta.text
+    assert respuesta.json()["autor"] == {"nombre": "Julio"}
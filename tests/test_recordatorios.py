@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from services.recordatorios import motor_recordatorios
+
+
+@pytest.fixture
+def motor(monkeypatch):
+    # Sin lifespan el motor no ha cargado nada: se abre una ventana amplia
+    monkeypatch.setattr(motor_recordatorios, "_horizonte", datetime.now(timezone.utc) + timedelta(days=30))
+    monkeypatch.setattr(motor_recordatorios, "_monticulo", [])
+    monkeypatch.setattr(motor_recordatorios, "_programados", {})
+    return motor_recordatorios
+
+
+def crear(cliente, cabeceras, conn, fecha: datetime) -> str:
+    asyncio.run(conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela"}))
+    respuesta = cliente.post("/notificaciones/recordatorios", headers=cabeceras, json={
+        "documento_id": "doc-1", "titulo_recordatorio": "Leer", "fecha_recordatorio": fecha.isoformat(),
+    })
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()["_id"]
+
+
+def test_modificar_recordatorio_lo_reprograma_con_su_objectid(cliente, cabeceras, conn, motor):
+    ahora = datetime.now(timezone.utc).replace(microsecond=0)
+    recordatorio_id = crear(cliente, cabeceras, conn, ahora + timedelta(days=1))
+    nueva = ahora + timedelta(days=2)
+
+    respuesta = cliente.put(
+        f"/notificaciones/recordatorios/{recordatorio_id}", headers=cabeceras,
+        json={"fecha_programada": nueva.isoformat()},
+    )
+
+    assert respuesta.status_code == 200, respuesta.text
+    assert motor._programados[recordatorio_id] == nueva
+    fecha, _, en_monticulo = max(motor._monticulo)
+    assert (fecha, en_monticulo) == (nueva, ObjectId(recordatorio_id))
+
+    respuesta = cliente.put(
+        f"/notificaciones/recordatorios/{recordatorio_id}", headers=cabeceras, json={"activo": False}
+    )
+    assert respuesta.status_code == 200
+    assert recordatorio_id not in motor._programados
+
+
+def test_eliminar_recordatorio_lo_descarta(cliente, cabeceras, conn, motor):
+    recordatorio_id = crear(cliente, cabeceras, conn, datetime.now(timezone.utc) + timedelta(days=1))
+    assert recordatorio_id in motor._programados
+
+    respuesta = cliente.delete(f"/notificaciones/recordatorios/{recordatorio_id}", headers=cabeceras)
+
+    assert respuesta.status_code == 200, respuesta.text
+    assert recordatorio_id not in motor._programados
+    assert asyncio.run(conn["recordatorios"].count_documents({})) == 0
+    assert cliente.delete("/notificaciones/recordatorios/no-es-un-id", headers=cabeceras).status_code == 404
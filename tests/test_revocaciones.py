@@ -0,0 +1,18 @@
+import pytest
+
+import auth.revocaciones
+from auth.revocaciones import RegistroRevocaciones
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("autocontenidos", [False, True])
+async def test_solo_sincroniza_con_tokens_autocontenidos(monkeypatch, comandos, autocontenidos):
+    monkeypatch.setattr(auth.revocaciones, "TOKENS_AUTOCONTENIDOS", autocontenidos)
+    registro = RegistroRevocaciones(60)
+
+    await registro.iniciar()
+    try:
+        assert (registro._tarea is not None) == autocontenidos
+        assert bool(comandos) == autocontenidos
+    finally:
+        await registro.detener()
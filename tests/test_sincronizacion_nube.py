@@ -0,0 +1,141 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services import sincronizacion_nube
+from services.proveedores_nube import ErrorProveedor, ProveedorLocal
+from services.sincronizacion_nube import PlanificadorSincronizacion
+
+PROVEEDORES = ("google_drive", "dropbox")
+
+
+class ProveedorContado(ProveedorLocal):
+    """Proveedor local que anota cada subida y puede retenerlas o hacerlas fallar."""
+
+    def __init__(self, directorio, error=None):
+        super().__init__(directorio)
+        self.subidas = Counter()
+        self.error = error
+        self.en_curso = 0
+        self.maximo_en_curso = 0
+        self.continuar = asyncio.Event()
+        self.continuar.set()
+
+    async def subir(self, ruta, nombre, configuracion, id_en_nube=None, punto_control=None):
+        self.subidas[ruta.name] += 1
+        self.en_curso += 1
+        self.maximo_en_curso = max(self.maximo_en_curso, self.en_curso)
+        try:
+            await self.continuar.wait()
+            if self.error is not None:
+                raise self.error
+            return await super().subir(ruta, nombre, configuracion, id_en_nube, punto_control)
+        finally:
+            self.en_curso -= 1
+
+
+def planificador(proveedor, concurrencia=50, limite_proveedor=50, limite_usuario=50):
+    return PlanificadorSincronizacion(
+        {nombre: proveedor for nombre in PROVEEDORES}, 1, concurrencia, limite_proveedor, limite_usuario
+    )
+
+
+async def crear_trabajos(conn, n: int, usuarios: int = 4) -> None:
+    ahora = datetime.now(timezone.utc)
+    await conn["documentos"].insert_many(
+        [{"_id": f"doc-{i}", "titulo": f"Documento {i}", "autor": "Ana"} for i in range(n)]
+    )
+    await conn["integraciones_nube"].insert_many([
+        {"usuario_id": f"usuario-{u}", "proveedor": proveedor, "token_acceso": "t"}
+        for u in range(usuarios) for proveedor in PROVEEDORES
+    ])
+    await conn["sincronizaciones"].insert_many([
+        {
+            "usuario_id": f"usuario-{i % usuarios}",
+            "documento_id": f"doc-{i}",
+            "proveedor": PROVEEDORES[i % 2],
+            "estado": "pendiente",
+            "intentos": 0,
+            "proxima_sincronizacion": ahora - timedelta(seconds=i),
+        }
+        for i in range(n)
+    ])
+
+
+async def terminar(*planificadores) -> None:
+    await asyncio.gather(*[tarea for p in planificadores for tarea in list(p._tareas)])
+
+
+@pytest.mark.anyio
+async def test_dos_planificadores_procesan_cada_trabajo_una_vez(conn, tmp_path):
+    await crear_trabajos(conn, 40)
+    proveedor = ProveedorContado(tmp_path)
+    a, b = planificador(proveedor), planificador(proveedor)
+
+    reclamadas = await asyncio.gather(a.ronda(), b.ronda())
+    await terminar(a, b)
+
+    assert sum(reclamadas) == 40
+    assert len(proveedor.subidas) == 40
+    assert set(proveedor.subidas.values()) == {1}
+    estados = await conn["sincronizaciones"].distinct("estado")
+    assert estados == ["completado"]
+    assert await a.ronda() + await b.ronda() == 0
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("usuarios, limite_proveedor, limite_usuario", [
+    # Dos usuarios con un trabajo a la vez cada uno
+    (2, 50, 1),
+    # Dos proveedores con un trabajo a la vez cada uno
+    (4, 1, 50),
+])
+async def test_limites_por_usuario_y_por_proveedor(conn, tmp_path, usuarios, limite_proveedor, limite_usuario):
+    await crear_trabajos(conn, 12, usuarios=usuarios)
+    proveedor = ProveedorContado(tmp_path)
+    proveedor.continuar.clear()
+    a = planificador(proveedor, limite_proveedor=limite_proveedor, limite_usuario=limite_usuario)
+
+    assert await a.ronda() == 2
+    await asyncio.sleep(0)
+    assert proveedor.en_curso == 2
+    assert await conn["sincronizaciones"].count_documents({"estado": "en_progreso"}) == 2
+
+    proveedor.continuar.set()
+    await terminar(a)
+    assert proveedor.maximo_en_curso == 2
+
+
+@pytest.mark.anyio
+async def test_fallos_se_reintentan_con_espera_exponencial(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(sincronizacion_nube, "ESPERA_BASE_REINTENTO", 10)
+    await crear_trabajos(conn, 1)
+    a = planificador(ProveedorContado(tmp_path, error=ErrorProveedor("503")))
+
+    esperas = []
+    for intentos in (1, 2, 3):
+        trabajo = await a.reclamar({"_id": {"$exists": True}})
+        antes = datetime.now(timezone.utc)
+        resultado = await a.ejecutar(trabajo)
+        assert resultado["estado"] == "fallido"
+        assert resultado["intentos"] == intentos
+        esperas.append((sincronizacion_nube._utc(resultado["proxima_sincronizacion"]) - antes).total_seconds())
+        # Se fuerza el vencimiento para el siguiente intento
+        await conn["sincronizaciones"].update_one({}, {"$set": {"proxima_sincronizacion": antes}})
+
+    for intento, espera in enumerate(esperas):
+        assert 10 * 2 ** intento * 0.5 - 1 <= espera <= 10 * 2 ** intento + 1
+
+
+@pytest.mark.anyio
+async def test_fallo_no_reintentable_se_abandona(conn, tmp_path):
+    await crear_trabajos(conn, 1)
+    a = planificador(ProveedorContado(tmp_path, error=ErrorProveedor("token", reintentable=False)))
+
+    resultado = await a.ejecutar(await a.reclamar({}))
+
+    assert resultado["estado"] == "fallido"
+    assert resultado["proxima_sincronizacion"] is None
+    assert await a.ronda() == 0
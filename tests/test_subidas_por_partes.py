@@ -0,0 +1,99 @@
+import asyncio
+import os
+import random
+from collections import Counter
+
+import httpx
+import pytest
+from bson import ObjectId
+
+from scripts.servidor_nube_local import crear_app
+from services.proveedores_nube import ErrorProveedor, ProveedorHTTP, PuntoControl
+
+TAMANO_PARTE = 1024
+
+
+def proveedor_contra(app, partes_aceptadas: Counter) -> ProveedorHTTP:
+    async def anotar(respuesta: httpx.Response) -> None:
+        peticion = respuesta.request
+        if peticion.method == "PUT" and respuesta.status_code == 200:
+            partes_aceptadas[int(peticion.url.path.rsplit("/", 1)[1])] += 1
+
+    proveedor = ProveedorHTTP("http://nube/dropbox", TAMANO_PARTE, 4, 10)
+    proveedor._cliente = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url=proveedor.url,
+        event_hooks={"response": [anotar]},
+    )
+    return proveedor
+
+
+@pytest.mark.anyio
+async def test_reanudar_solo_envia_las_partes_que_faltan(tmp_path):
+    random.seed(46)
+    contenido = os.urandom(TAMANO_PARTE * 60 + 300)
+    ruta = tmp_path / "documento-v1.json"
+    ruta.write_bytes(contenido)
+    aceptadas = Counter()
+    proveedor = proveedor_contra(crear_app(tmp_path / "nube", fallos=0.3), aceptadas)
+    punto_control = PuntoControl()
+    configuracion = {"token_acceso": "t", "carpeta_id": None}
+
+    intentos = 0
+    try:
+        while True:
+            intentos += 1
+            try:
+                resultado = await proveedor.subir(ruta, "documento.json", configuracion, None, punto_control)
+                break
+            except ErrorProveedor:
+                # Cada intento fallido deja más partes en el punto de control
+                assert len(set(punto_control.datos["partes"])) == len(aceptadas)
+    finally:
+        await proveedor.cerrar()
+
+    assert intentos > 1
+    assert sorted(aceptadas) == list(range(61))
+    assert set(aceptadas.values()) == {1}
+    subido = next((tmp_path / "nube" / "dropbox" / "raiz").glob(resultado["id_en_nube"]))
+    assert subido.read_bytes() == contenido
+
+
+@pytest.mark.anyio
+async def test_sesion_perdida_empieza_de_nuevo(tmp_path):
+    ruta = tmp_path / "documento-v1.json"
+    ruta.write_bytes(os.urandom(TAMANO_PARTE * 3))
+    aceptadas = Counter()
+    proveedor = proveedor_contra(crear_app(tmp_path / "nube", fallos=0.0), aceptadas)
+    punto_control = PuntoControl({"sesion": "caducada", "huella": "documento-v1.json:3072",
+                                  "tamano_parte": TAMANO_PARTE, "partes": [0, 1]})
+    try:
+        await proveedor.subir(ruta, "documento.json", {"token_acceso": "t"}, None, punto_control)
+    finally:
+        await proveedor.cerrar()
+
+    assert sorted(aceptadas) == [0, 1, 2]
+    assert punto_control.datos["sesion"] != "caducada"
+
+
+def test_volver_a_poner_en_cola_reinicia_los_reintentos(cliente, cabeceras, conn):
+    usuario = asyncio.run(conn["usuarios"].find_one({"correo": "ana@ejemplo.com"}))
+    asyncio.run(conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela"}))
+    asyncio.run(conn["integraciones_nube"].insert_one(
+        {"usuario_id": usuario["_id"], "proveedor": "dropbox", "token_acceso": "t"}
+    ))
+    asyncio.run(conn["sincronizaciones"].insert_one({
+        "_id": ObjectId(), "usuario_id": usuario["_id"], "documento_id": "doc-1", "proveedor": "dropbox",
+        "estado": "fallido", "intentos": 8, "error": "503", "proxima_sincronizacion": None,
+    }))
+
+    respuesta = cliente.post(
+        "/integracion/nube/sincronizar/lote", headers=cabeceras,
+        json={"proveedor": "dropbox", "documento_ids": ["doc-1"]},
+    )
+
+    assert respuesta.status_code == 202
+    sincronizacion = asyncio.run(conn["sincronizaciones"].find_one({}))
+    assert sincronizacion["intentos"] == 0
+    assert sincronizacion["error"] is None
+    assert sincronizacion["proxima_sincronizacion"] is not None
@@ -0,0 +1,50 @@
+import asyncio
+
+from auth.cache_principales import cache_principales
+
+
+def consultas_de_usuarios(comandos) -> int:
+    return sum(n for (coleccion, _), n in comandos.items() if coleccion == "usuarios")
+
+
+def test_notificaciones_consulta_el_usuario_una_vez_con_cache_fria(cliente, cabeceras, comandos):
+    cache_principales.limpiar()
+    comandos.clear()
+
+    respuesta = cliente.get("/notificaciones", headers=cabeceras)
+
+    assert respuesta.status_code == 200
+    assert consultas_de_usuarios(comandos) == 1
+
+
+def test_notificaciones_no_consulta_el_usuario_con_cache_caliente(cliente, cabeceras, comandos):
+    cliente.get("/notificaciones", headers=cabeceras)
+    comandos.clear()
+
+    respuesta = cliente.post(
+        "/notificaciones", headers=cabeceras, json={"tipo": "info", "titulo": "t", "mensaje": "m"}
+    )
+
+    assert respuesta.status_code == 200
+    assert consultas_de_usuarios(comandos) == 0
+
+
+def test_exportar_consulta_el_usuario_solo_con_cache_fria(cliente, cabeceras, conn, comandos):
+    asyncio.run(conn["documentos"].insert_one({"_id": "doc-1", "titulo": "Rayuela", "autor": "Cortazar"}))
+    cache_principales.limpiar()
+    comandos.clear()
+
+    respuesta = cliente.post(
+        "/integracion/exportar", headers=cabeceras, json={"documento_id": "doc-1", "formato": "json"}
+    )
+
+    assert respuesta.status_code == 200
+    assert consultas_de_usuarios(comandos) == 1
+
+    comandos.clear()
+    respuesta = cliente.post(
+        "/integracion/exportar", headers=cabeceras, json={"documento_id": "doc-1", "formato": "json"}
+    )
+
+    assert respuesta.status_code == 200
+    assert consultas_de_usuarios(comandos) == 0
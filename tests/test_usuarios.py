@@ -0,0 +1,36 @@
+import asyncio
+
+from conftest import iniciar_sesion, registrar
+from config.indices import crear_indices
+
+
+def test_listado_de_usuarios_pagina_por_nombre_sin_repetir_ni_saltar(cliente):
+    # Nombres repetidos para que el _id tenga que desempatar entre páginas
+    nombres = ["Beto", "Ana", "Ana", "Carla", "Ana", "Beto", "Dario"]
+    for i, nombre in enumerate(nombres):
+        registrar(cliente, f"u{i}@ejemplo.com", nombres=nombre)
+    cabeceras = iniciar_sesion(cliente, "u0@ejemplo.com")
+
+    vistos, despues = [], None
+    while True:
+        parametros = {"tamano": 2, **({"despues": despues} if despues else {})}
+        respuesta = cliente.get("/usuarios", headers=cabeceras, params=parametros)
+        assert respuesta.status_code == 200, respuesta.text
+        pagina = respuesta.json()
+        vistos += [usuario["nombres"] for usuario in pagina["usuarios"]]
+        despues = pagina["siguiente"]
+        if despues is None:
+            break
+
+    assert vistos == sorted(nombres)
+    assert cliente.get("/usuarios", headers=cabeceras, params={"tamano": 201}).status_code == 422
+
+
+def test_indices_del_listado_incluyen_el_desempate_por_id(conn):
+    asyncio.run(conn["usuarios"].create_index([("rol", 1), ("inactivo", 1), ("nombre_busqueda", 1)]))
+    asyncio.run(crear_indices())
+
+    claves = [list(indice["key"]) for indice in asyncio.run(conn["usuarios"].index_information()).values()]
+    assert [("rol", 1), ("inactivo", 1), ("nombre_busqueda", 1), ("_id", 1)] in claves
+    assert [("ciudad", 1), ("nombre_busqueda", 1), ("_id", 1)] in claves
+    assert [("rol", 1), ("inactivo", 1), ("nombre_busqueda", 1)] not in claves
@@ -0,0 +1,27 @@
+"""
+Utilidades para normalizar textos usados en búsquedas por prefijo
+"""
+import re
+import unicodedata
+from typing import Optional
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """
+    Pasa el texto a minúsculas, sin tildes y con los espacios simplificados,
+    para poder buscar por prefijo con un índice sin distinguir mayúsculas.
+    """
+    if not texto:
+        return ""
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    sin_tildes = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_tildes.lower().split())
+
+
+def nombre_busqueda(nombres: Optional[str], apellidos: Optional[str]) -> str:
+    return normalizar_texto(f"{nombres or ''} {apellidos or ''}")
+
+
+def filtro_prefijo(prefijo: str) -> dict:
+    """Expresión regular anclada al inicio, que MongoDB resuelve con el índice."""
+    return {"$regex": f"^{re.escape(normalizar_texto(prefijo))}"}
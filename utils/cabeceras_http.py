@@ -0,0 +1,92 @@
+"""
+Utilidades para respuestas HTTP cacheables: validadores (ETag / Last-Modified),
+peticiones condicionales y peticiones por rangos de bytes
+"""
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request
+
+PATRON_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangoNoSatisfacible(Exception):
+    pass
+
+
+def fecha_http(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def etag_coincide(if_none_match: str, etag: str) -> bool:
+    """Compara la cabecera If-None-Match con un ETag usando comparación débil."""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(
+        candidato.strip().removeprefix("W/") == etag
+        for candidato in if_none_match.split(",")
+    )
+
+
+def no_modificado(request: Request, etag: str, modificado: float) -> bool:
+    """
+    Indica si el cliente ya tiene la versión actual del recurso y se le puede
+    responder 304. If-None-Match tiene prioridad sobre If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_coincide(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            fecha = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(modificado) <= fecha.timestamp()
+
+    return False
+
+
+def rango_solicitado(
+    request: Request, tamano: int, etag: str, modificado: float
+) -> Optional[Tuple[int, int]]:
+    """
+    Devuelve el rango [inicio, fin) pedido en la cabecera Range, o None si se
+    debe enviar el recurso completo (sin Range, If-Range obsoleto o rango no
+    interpretable, que según el RFC 9110 se puede ignorar).
+
+    Raises:
+        RangoNoSatisfacible: si el rango queda fuera del recurso
+    """
+    cabecera = request.headers.get("range")
+    if cabecera is None:
+        return None
+
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range not in (etag, fecha_http(modificado)):
+        return None
+
+    coincidencia = PATRON_RANGO.match(cabecera.strip())
+    if coincidencia is None:
+        # Rangos múltiples o unidades distintas de bytes: se envía completo
+        return None
+
+    inicio, fin = coincidencia.groups()
+    if not inicio and not fin:
+        return None
+
+    if not inicio:
+        # Sufijo: los últimos N bytes
+        longitud = int(fin)
+        if longitud == 0:
+            raise RangoNoSatisfacible()
+        return max(0, tamano - longitud), tamano
+
+    inicio = int(inicio)
+    fin = min(int(fin) + 1, tamano) if fin else tamano
+    if inicio >= tamano or inicio >= fin:
+        raise RangoNoSatisfacible()
+    return inicio, fin
@@ -0,0 +1,91 @@
+"""
+Utilidades para paginar consultas por _id (paginación por clave o keyset)
+"""
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, Query, status
+
+TAMANO_MAXIMO_PAGINA = 200
+
+
+class PaginaPorId:
+    """
+    Dependencia de FastAPI con los parámetros `tamano` y `despues`. Las páginas
+    se ordenan por _id descendente (primero lo más reciente), o por otro campo
+    con el _id como desempate, y cada una continúa tras el último documento de
+    la anterior, de modo que con un índice (filtro, [campo,] _id) el coste de
+    una página no depende de lo lejos que esté del principio.
+    """
+
+    def __init__(
+        self,
+        tamano: int = Query(50, ge=1, le=TAMANO_MAXIMO_PAGINA),
+        despues: Optional[str] = Query(
+            None, description="Valor de `siguiente` devuelto por la página anterior"
+        ),
+    ):
+        if despues is not None and not ObjectId.is_valid(despues):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Parámetro despues no válido"
+            )
+        self.tamano = tamano
+        self.despues = ObjectId(despues) if despues is not None else None
+
+    async def consultar(
+        self, coleccion, filtro: dict, proyeccion: Optional[dict] = None, campo: Optional[str] = None
+    ):
+        """
+        Devuelve los documentos de la página y el `siguiente` para pedir la
+        próxima. Con `campo` las páginas se ordenan por (campo, _id) ascendente
+        y la página continúa tras el valor de `campo` del documento `despues`,
+        así que el índice debe ser (filtro, campo, _id).
+        """
+        if campo is not None:
+            return await self._consultar_por_campo(coleccion, filtro, proyeccion, campo)
+
+        if self.despues is not None:
+            filtro = {**filtro, "_id": {"$lt": self.despues}}
+
+        # Se pide un elemento de más para saber si hay otra página
+        documentos = (
+            await coleccion.find(filtro, proyeccion)
+            .sort("_id", -1)
+            .limit(self.tamano + 1)
+            .to_list(self.tamano + 1)
+        )
+        return self._separar(documentos)
+
+    async def _consultar_por_campo(self, coleccion, filtro: dict, proyeccion: Optional[dict], campo: str):
+        if self.despues is not None:
+            anterior = await coleccion.find_one({"_id": self.despues}, {campo: 1})
+            if anterior is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="El último elemento de la página anterior ya no existe",
+                )
+            valor = anterior.get(campo)
+            filtro = {
+                "$and": [
+                    filtro,
+                    {"$or": [
+                        {campo: {"$gt": valor}},
+                        {campo: valor, "_id": {"$gt": self.despues}},
+                    ]},
+                ]
+            }
+
+        documentos = (
+            await coleccion.find(filtro, proyeccion)
+            .sort([(campo, 1), ("_id", 1)])
+            .limit(self.tamano + 1)
+            .to_list(self.tamano + 1)
+        )
+        return self._separar(documentos)
+
+    def _separar(self, documentos: list):
+        siguiente = None
+        if len(documentos) > self.tamano:
+            documentos = documentos[: self.tamano]
+            siguiente = str(documentos[-1]["_id"])
+        return documentos, siguiente
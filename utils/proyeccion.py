@@ -0,0 +1,84 @@
+"""
+Utilidades para convertir el parámetro de consulta `fields` en proyecciones de MongoDB
+"""
+import re
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException, Query, status
+
+PATRON_CAMPO = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+def construir_proyeccion(
+    fields: Optional[str],
+    por_defecto: Optional[Dict[str, int]] = None,
+    prohibidos: Iterable[str] = (),
+) -> Optional[Dict[str, int]]:
+    """
+    Convierte una lista de campos separada por comas en una proyección de MongoDB.
+    Los subcampos de un campo también solicitado se descartan.
+
+    Args:
+        fields: Valor del parámetro `fields` (por ejemplo "titulo,autor,imagen")
+        por_defecto: Proyección usada cuando no se envía `fields`
+        prohibidos: Campos que nunca se devuelven aunque se soliciten
+
+    Returns:
+        Proyección de inclusión, la proyección por defecto o None si no hay ninguna
+    """
+    prohibidos = set(prohibidos)
+
+    if not fields or not fields.strip():
+        return dict(por_defecto) if por_defecto else None
+
+    proyeccion = {}
+    for campo in fields.split(","):
+        campo = campo.strip()
+        if not campo:
+            continue
+        if not PATRON_CAMPO.match(campo):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Campo no válido en fields: {campo}",
+            )
+        if campo.split(".")[0] in prohibidos:
+            continue
+        proyeccion[campo] = 1
+
+    # MongoDB rechaza rutas solapadas ("autor,autor.nombre"): el campo padre ya
+    # incluye a sus subcampos, así que estos se descartan
+    proyeccion = {
+        campo: 1
+        for campo in proyeccion
+        if not any(campo.startswith(f"{otro}.") for otro in proyeccion)
+    }
+
+    # Si todos los campos solicitados estaban prohibidos solo se devuelve el _id
+    return proyeccion or {"_id": 1}
+
+
+def campos_de_consulta(
+    por_defecto: Optional[Dict[str, int]] = None, prohibidos: Iterable[str] = ()
+):
+    """
+    Crea una dependencia de FastAPI que lee el parámetro `fields` y devuelve
+    la proyección correspondiente para usarla en `find` o `find_one`.
+    """
+    prohibidos = frozenset(prohibidos)
+
+    def dependencia(
+        fields: Optional[str] = Query(
+            None,
+            description="Campos a devolver separados por comas (ej. titulo,autor,imagen)",
+        )
+    ) -> Optional[Dict[str, int]]:
+        return construir_proyeccion(fields, por_defecto, prohibidos)
+
+    return dependencia
+
+
+# Proyecciones compartidas por los routers
+CAMPOS_DOCUMENTO = campos_de_consulta()
+CAMPOS_LISTA_DOCUMENTOS = campos_de_consulta(por_defecto={"descripcion": 0})
+CAMPOS_USUARIO = campos_de_consulta(por_defecto={"contra": 0}, prohibidos={"contra"})
+CAMPOS_GENERICOS = campos_de_consulta()